@@ -0,0 +1,105 @@
+"""Ingest coalescing benchmark: viewer wakeups and writes per second for several ingestCoalesceMs windows.
+
+Segments are ingested as FFmpeg sends them, CMAF fragments split into several body messages a few milliseconds
+apart, while every viewer streams them as outgoing_data does. Each notification of new data wakes every viewer
+waiting for it, and every wakeup with new data is one write. The delay is the time from a body message being
+received to its last byte being handed to a viewer. Run from the repository root:
+python bench/bench_coalesce.py [--viewers N] ...
+"""
+import argparse
+import asyncio
+import bisect
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger  # noqa: E402
+
+import fastll  # noqa: E402
+from fastll_storage import MemoryStorage  # noqa: E402
+from fastll_stream import Segment  # noqa: E402
+
+
+def fragment(size: int) -> bytes:
+    # a complete CMAF fragment as far as the segment index is concerned
+    return struct.pack(">I4s", size, b"mdat") + bytes(size - 8)
+
+
+async def run(window: float, args):
+    storage = MemoryStorage()
+    notifications = [0]
+    notify = storage._notify
+
+    def counting_notify(entry):
+        notifications[0] += 1
+        notify(entry)
+
+    storage._notify = counting_notify
+    writes = [0]
+    delays = []
+    # end offset and received time of every body message of the current segment
+    received_ends = []
+    received_times = []
+
+    async def viewer(segment: Segment):
+        offset = 0
+        async for data in fastll.generate_partial_segment(segment):
+            now = time.perf_counter()
+            offset += len(data)
+            writes[0] += 1
+            # received time of the body message holding the last byte written
+            delays.append(now - received_times[bisect.bisect_left(received_ends, offset)])
+
+    data = fragment(args.fragment_size)
+    message_size = -(-args.fragment_size // args.messages)
+    messages = [data[i:i + message_size] for i in range(0, len(data), message_size)]
+    start = time.perf_counter()
+    for number in range(args.segments):
+        segment = Segment(f"chunk-stream0-{number:05d}.m4s", storage)
+        received_ends.clear()
+        received_times.clear()
+        viewers = [asyncio.ensure_future(viewer(segment)) for _ in range(args.viewers)]
+        await asyncio.sleep(0)
+        size = 0
+        for _ in range(args.fragments):
+            for message in messages:
+                size += len(message)
+                received_ends.append(size)
+                received_times.append(time.perf_counter())
+                segment.append(message, window)
+                await asyncio.sleep(args.message_interval / 1000)
+        segment.complete()
+        await asyncio.gather(*viewers)
+        segment.retire()
+    elapsed = time.perf_counter() - start
+    storage.close()
+    return elapsed, notifications[0], writes[0], delays
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--viewers", type=int, default=500)
+    parser.add_argument("--segments", type=int, default=3)
+    parser.add_argument("--fragments", type=int, default=10, help="CMAF fragments per segment")
+    parser.add_argument("--fragment-size", type=int, default=16384)
+    parser.add_argument("--messages", type=int, default=12, help="body messages per fragment")
+    parser.add_argument("--message-interval", type=float, default=1, help="milliseconds between body messages")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 5, 50], help="ingestCoalesceMs values")
+    args = parser.parse_args()
+
+    logger.remove()
+    print(f"{args.viewers} viewers, {args.segments} segments of {args.fragments} fragments in {args.messages} "
+          f"body messages {args.message_interval} ms apart")
+    for window in args.windows:
+        elapsed, notifications, writes, delays = asyncio.run(run(window / 1000, args))
+        wakeups = notifications * args.viewers
+        print(f"ingestCoalesceMs {window:g}: {wakeups / elapsed:.0f} wakeups/s, {writes / elapsed:.0f} writes/s, "
+              f"{writes / args.viewers / args.segments:.1f} writes per viewer and segment, "
+              f"delay mean {sum(delays) / len(delays) * 1000:.2f} ms, max {max(delays) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""HTTP/2 benchmark: time to first byte and server CPU per viewer, hypercorn HTTP/2 against uvicorn HTTP/1.1.
+
+For each server a child process serves the application, with a fake FFmpeg ingesting segments of several
+fragments as they are produced. Viewers open one connection each (h2c with prior knowledge for HTTP/2) and
+request consecutive segments as players do, each one as soon as the previous one ends. The time to first byte is
+measured up to the first body byte, and the server CPU time is read from /proc while viewers are playing. Needs
+hypercorn (pip install hypercorn). Run from the repository root: python bench/bench_http2.py [--viewers N] ...
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STREAM = "cam"
+SEGMENT_NAME = "chunk-stream0-{:05d}.m4s"
+
+
+def serve(args):
+    """Child process: the application served by uvicorn or hypercorn, fed by a fake FFmpeg"""
+    import fastll
+    import fastllapp
+    from loguru import logger
+    from soak import MANIFEST, mdat, stream_config, whole_body
+
+    logger.remove()
+    fragment = mdat(args.fragment_size)
+
+    async def fragments():
+        # the next segment starts arriving as soon as this one is completed
+        for _ in range(args.fragments):
+            yield fragment
+            await asyncio.sleep(args.fragment_interval / 1000)
+
+    async def ingest():
+        # the first manifests are skipped
+        for _ in range(6):
+            await fastll.process_incoming(STREAM, "manifest.mpd", None, whole_body(MANIFEST.encode()))
+        for representation in range(2):
+            await fastll.process_incoming(STREAM, f"init-stream{representation}.m4s", None, whole_body(mdat(1024)))
+        number = 1
+        while True:
+            await fastll.process_incoming(STREAM, SEGMENT_NAME.format(number), fragments(), None)
+            if number > 3:
+                await fastll.delete_data(STREAM, SEGMENT_NAME.format(number - 3))
+            number = number + 1
+
+    class FakeFfmpeg:
+        def __init__(self, command):
+            self.task = asyncio.get_running_loop().create_task(ingest())
+
+        def kill(self):
+            self.task.cancel()
+
+    fastll.subprocess.Popen = FakeFfmpeg
+    config = stream_config(STREAM, "memory")
+    config["sessionTimeout"] = 10
+    fastll.fastll_conf.update({"host": "127.0.0.1", "port": args.port, "https": False, "timeDisplacement": 0,
+                               "streams": [config]})
+    fastllapp.create_server("127.0.0.1", args.port, "warning", None, None, args.http2).run()
+
+
+class Http1Viewer:
+    async def connect(self, port: int):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def get(self, path: str):
+        """Status, time to first body byte and body size of a request"""
+        start = time.perf_counter()
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+        status = int(head.split(" ", 2)[1])
+        first_byte = None
+        size = 0
+        if "transfer-encoding: chunked" in head:
+            while True:
+                chunk_size = int((await self.reader.readline()).strip(), 16)
+                if chunk_size == 0:
+                    await self.reader.readline()
+                    break
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                size = size + len(await self.reader.readexactly(chunk_size + 2)) - 2
+        else:
+            length = int(head.split("content-length:", 1)[1].split("\r\n", 1)[0])
+            if length > 0:
+                await self.reader.readexactly(1)
+                first_byte = time.perf_counter() - start
+                size = 1 + len(await self.reader.readexactly(length - 1))
+        return status, first_byte, size
+
+    def close(self):
+        self.writer.close()
+
+
+class Http2Viewer:
+    async def connect(self, port: int):
+        import h2.config
+        import h2.connection
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+        self.connection.initiate_connection()
+        self.writer.write(self.connection.data_to_send())
+
+    async def get(self, path: str):
+        import h2.events
+        start = time.perf_counter()
+        stream_id = self.connection.get_next_available_stream_id()
+        self.connection.send_headers(stream_id, [(":method", "GET"), (":path", path), (":scheme", "http"),
+                                                 (":authority", "localhost")], end_stream=True)
+        self.writer.write(self.connection.data_to_send())
+        status = None
+        first_byte = None
+        size = 0
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError("connection closed")
+            for event in self.connection.receive_data(data):
+                if isinstance(event, h2.events.ResponseReceived) and event.stream_id == stream_id:
+                    status = int(dict(event.headers)[b":status"])
+                elif isinstance(event, h2.events.DataReceived) and event.stream_id == stream_id:
+                    if first_byte is None and len(event.data) > 0:
+                        first_byte = time.perf_counter() - start
+                    size = size + len(event.data)
+                    self.connection.acknowledge_received_data(event.flow_controlled_length, stream_id)
+                elif isinstance(event, h2.events.StreamEnded) and event.stream_id == stream_id:
+                    self.writer.write(self.connection.data_to_send())
+                    return status, first_byte, size
+            self.writer.write(self.connection.data_to_send())
+
+    def close(self):
+        self.writer.close()
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    # utime and stime
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def wait_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def play(viewer_class, pid: int, args):
+    await wait_port(args.port)
+    viewers = [viewer_class() for _ in range(args.viewers)]
+    for viewer in viewers:
+        await viewer.connect(args.port)
+    # the first request starts the stream
+    status, _, _ = await viewers[0].get(f"/{STREAM}-v0/manifest.mpd")
+    assert status == 200, status
+
+    ttfb = []
+    failed = [0]
+
+    async def run(i, viewer):
+        await viewer.get(f"/{STREAM}-v{i}/init-stream0.m4s")
+        for number in range(1, args.segments + 1):
+            status, first_byte, _ = await viewer.get(f"/{STREAM}-v{i}/{SEGMENT_NAME.format(number)}")
+            if status != 200 or first_byte is None:
+                failed[0] += 1
+            # the first segment is the warm-up
+            elif number > 1:
+                ttfb.append(first_byte)
+
+    tasks = [asyncio.ensure_future(run(i, viewer)) for i, viewer in enumerate(viewers)]
+    # CPU is measured from the second segment on
+    segment_time = args.fragments * args.fragment_interval / 1000
+    await asyncio.sleep(segment_time)
+    cpu = cpu_seconds(pid)
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds(pid) - cpu
+    for viewer in viewers:
+        viewer.close()
+    return ttfb, failed[0], cpu, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--viewers", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=10, help="segments played by each viewer")
+    parser.add_argument("--fragments", type=int, default=10, help="CMAF fragments per segment")
+    parser.add_argument("--fragment-size", type=int, default=16384)
+    parser.add_argument("--fragment-interval", type=float, default=50, help="milliseconds between fragments")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--http2", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    print(f"{args.viewers} viewers, {args.segments} segments of {args.fragments} fragments of {args.fragment_size} "
+          f"bytes every {args.fragment_interval:g} ms")
+    for name, http2, viewer_class in (("uvicorn HTTP/1.1", False, Http1Viewer), ("hypercorn HTTP/2", True,
+                                                                                  Http2Viewer)):
+        command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)]
+        for option in ("segments", "fragments", "fragment_size", "fragment_interval"):
+            command.extend([f"--{option.replace('_', '-')}", str(getattr(args, option))])
+        if http2:
+            command.append("--http2")
+        server = subprocess.Popen(command)
+        try:
+            ttfb, failed, cpu, elapsed = asyncio.run(play(viewer_class, server.pid, args))
+        finally:
+            server.terminate()
+            server.wait()
+        quantiles = statistics.quantiles(ttfb, n=20)
+        print(f"{name:>17}: ttfb median {statistics.median(ttfb) * 1000:.2f} ms, p95 {quantiles[18] * 1000:.2f} ms, "
+              f"server cpu {cpu / elapsed / args.viewers * 1000:.2f} ms per viewer and second, "
+              f"{failed} failed requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Cold start benchmark: time and RSS from process start to the first served manifest.
+
+Each run starts a new interpreter that imports the application, runs its startup and answers a manifest request,
+which starts the (fake) FFmpeg of the stream and waits for its manifest, as the first viewer of a restarted server
+does. The time of fastllapp.py --version is measured as well. Run from the repository root:
+python bench/bench_startup.py [--runs N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+async def call(app, method: str, path: str, body: bytes = b""):
+    """Status and body of a request handled by an ASGI application"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "http_version": "1.1", "method": method, "path": path, "raw_path": path.encode(),
+             "root_path": "", "scheme": "http", "query_string": b"", "headers": [(b"host", b"localhost")],
+             "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000)}
+    await app(scope, receive, send)
+    status = next(i["status"] for i in messages if i["type"] == "http.response.start")
+    return status, b"".join(i.get("body", b"") for i in messages if i["type"] == "http.response.body")
+
+
+def child(storage_dir: str):
+    start = time.perf_counter()
+    import fastll
+    from loguru import logger
+    from soak import MANIFEST, stream_config
+    imported = time.perf_counter()
+
+    logger.remove()
+
+    class FakeFfmpeg:
+        # sends the manifests FFmpeg would send once started, the first ones are skipped by the server
+        def __init__(self, command):
+            async def put_manifests():
+                for _ in range(6):
+                    await call(fastll.app, "PUT", "/cam/manifest.mpd", MANIFEST.encode())
+            self.task = asyncio.get_running_loop().create_task(put_manifests())
+
+        def kill(self):
+            pass
+
+    fastll.subprocess.Popen = FakeFfmpeg
+    fastll.fastll_conf.update({"host": "localhost", "port": 8000, "https": False, "timeDisplacement": 0,
+                               "storageDir": storage_dir, "streams": [stream_config("cam", "memory")]})
+
+    async def serve():
+        await fastll.startup_event()
+        started = time.perf_counter()
+        status, body = await call(fastll.app, "GET", "/cam-viewer/manifest.mpd")
+        assert status == 200 and b"MPD" in body, status
+        return started
+
+    started = asyncio.run(serve())
+    served = time.perf_counter()
+    print(json.dumps({"import": imported - start, "startup": started - imported, "manifest": served - started,
+                      "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with tempfile.TemporaryDirectory() as storage_dir:
+            child(storage_dir)
+        return
+
+    versions = []
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, "fastllapp.py"), "--version"], check=True,
+                       stdout=subprocess.DEVNULL)
+        versions.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], check=True,
+                                stdout=subprocess.PIPE)
+        run = json.loads(result.stdout)
+        run["total"] = time.perf_counter() - start
+        runs.append(run)
+
+    def mean(values):
+        return sum(values) / len(values) * 1000
+
+    print(f"{args.runs} runs, mean times")
+    print(f"fastllapp.py --version: {mean(versions):.1f} ms")
+    print(f"import: {mean([i['import'] for i in runs]):.1f} ms, startup: {mean([i['startup'] for i in runs]):.1f} ms, "
+          f"first manifest: {mean([i['manifest'] for i in runs]):.1f} ms")
+    print(f"process start to first served manifest: {mean([i['total'] for i in runs]):.1f} ms, "
+          f"max rss: {max(i['rss'] for i in runs)} KiB")
+
+
+if __name__ == "__main__":
+    main()
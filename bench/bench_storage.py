@@ -0,0 +1,66 @@
+"""Segment storage benchmark: ingest and fan-out throughput of every storage backend.
+
+Each segment is appended in chunks while viewers subscribed to it read the data as it arrives, as FFmpeg and
+players do. Run from the repository root: python bench/bench_storage.py [--viewers N] ...
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastll_storage import MemoryStorage, MmapFileStorage, SharedMemoryRingStorage  # noqa: E402
+
+
+async def run(storage, segments: int, chunks: int, chunk_size: int, viewers: int):
+    chunk = bytes(chunk_size)
+    received = [0]
+
+    async def viewer(key):
+        async for data in storage.subscribe(key):
+            received[0] += len(data)
+
+    start = time.perf_counter()
+    for i in range(segments):
+        key = storage.put(f"chunk-stream0-{i:05d}.m4s")
+        tasks = [asyncio.ensure_future(viewer(key)) for _ in range(viewers)]
+        for _ in range(chunks):
+            storage.append(key, chunk)
+            await asyncio.sleep(0)
+        storage.complete(key)
+        await asyncio.gather(*tasks)
+        storage.delete(key)
+    elapsed = time.perf_counter() - start
+    return elapsed, received[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=100, help="appends per segment")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--viewers", type=int, default=50)
+    args = parser.parse_args()
+
+    segment_size = args.chunks * args.chunk_size
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            "memory": MemoryStorage(),
+            "sharedMemory": SharedMemoryRingStorage(4, segment_size),
+            "mmap": MmapFileStorage(os.path.join(directory, "segments")),
+        }
+        print(f"{args.segments} segments of {segment_size} bytes in {args.chunks} chunks, {args.viewers} viewers")
+        for name, storage in backends.items():
+            elapsed, received = asyncio.run(run(storage, args.segments, args.chunks, args.chunk_size,
+                                                args.viewers))
+            storage.close()
+            ingested = args.segments * segment_size
+            print(f"{name:>12}: {elapsed:.3f} s, ingest {ingested / elapsed / 1e6:.1f} MB/s, "
+                  f"delivered {received / elapsed / 1e6:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
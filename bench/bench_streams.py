@@ -0,0 +1,92 @@
+"""Configured streams benchmark: startup time and RSS of a server with thousands of configured streams.
+
+Configured streams are kept as their configuration until they are requested. The benchmark runs the startup of the
+application with --streams configured streams, a stream check pass with all of them idle, and then materializes
+--active of them, as their first requests do, for comparison. Run from the repository root:
+python bench/bench_streams.py [--streams N] ...
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger  # noqa: E402
+
+
+def stream_config(i: int):
+    return {
+        "name": f"Camera {i}",
+        "stream": f"cam{i}",
+        "type": "RTSP",
+        "input": f"rtsp://10.0.{i // 256 % 256}.{i % 256}:554/main",
+        "targetFps": "25",
+        "segmentDuration": "1",
+        "fragmentDuration": "0.1",
+        "intraInterval": "25",
+        "qualities": {"video": [{"targetWidth": "640", "targetBitrate": "500"},
+                                {"targetWidth": "1280", "targetBitrate": "2000"}]},
+    }
+
+
+def rss_kb() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+async def run(args, storage_dir: str):
+    import fastll
+    from fastll_conf import fastll_conf
+
+    fastll_conf.update({"host": "localhost", "port": 8000, "https": False, "timeDisplacement": 0,
+                        "storageDir": storage_dir, "streams": [stream_config(i) for i in range(args.streams)]})
+    gc.collect()
+    rss = rss_kb()
+    start = time.perf_counter()
+    await fastll.startup_event()
+    startup = time.perf_counter() - start
+    gc.collect()
+    print(f"startup: {startup * 1000:.1f} ms, rss +{rss_kb() - rss} KiB")
+
+    start = time.perf_counter()
+    await fastll.StreamCheckTask.check_streams()
+    print(f"stream check pass: {(time.perf_counter() - start) * 1000:.2f} ms, "
+          f"{len(fastll.fll_streams)} streams materialized")
+
+    rss = rss_kb()
+    start = time.perf_counter()
+    for i in range(args.active):
+        fastll.get_stream(f"cam{i}")
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    print(f"materializing {args.active} streams: {elapsed * 1000:.1f} ms, rss +{rss_kb() - rss} KiB")
+
+    start = time.perf_counter()
+    await fastll.StreamCheckTask.check_streams()
+    print(f"stream check pass: {(time.perf_counter() - start) * 1000:.2f} ms, "
+          f"{len(fastll.fll_streams)} streams materialized after releasing the idle ones")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=10000, help="configured streams")
+    parser.add_argument("--active", type=int, default=1000, help="streams materialized after startup")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    rss = rss_kb()
+    start = time.perf_counter()
+    import fastll  # noqa: F401
+    print(f"{args.streams} configured streams")
+    print(f"import: {(time.perf_counter() - start) * 1000:.1f} ms, rss +{rss_kb() - rss} KiB")
+    with tempfile.TemporaryDirectory() as storage_dir:
+        asyncio.run(run(args, storage_dir))
+
+
+if __name__ == "__main__":
+    main()
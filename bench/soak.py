@@ -0,0 +1,227 @@
+"""Soak test: memory growth of the origin over many stream lifetimes.
+
+Each cycle starts the configured streams (FFmpeg is not run), ingests manifests, init segments and segments
+while churning viewers read them, requests far-ahead segments that never arrive, and then lets the stream check
+task stop and release the streams. Memory is traced with tracemalloc from the end of the warm-up cycles on, so
+anything a stream lifetime leaves behind shows up as growth. Exits with status 1 when memory or live object
+counts grow. Run from the repository root: python bench/soak.py [--cycles N] ...
+"""
+import argparse
+import asyncio
+import gc
+import os
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+import fastll  # noqa: E402
+import fastll_stream  # noqa: E402
+from fastll_session import Session  # noqa: E402
+from fastll_stream import Segment, Stream  # noqa: E402
+
+MANIFEST = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="dynamic">
+  <Period id="0">
+    <AdaptationSet id="0" contentType="video">
+      <Representation id="0" bandwidth="250000"/>
+      <Representation id="1" bandwidth="500000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>"""
+
+
+class FakeFfmpeg:
+    """Stands in for the FFmpeg process, the soak test plays its part"""
+
+    def __init__(self, command):
+        self.command = command
+
+    def kill(self):
+        pass
+
+
+def stream_config(stream: str, storage: str):
+    return {
+        "name": stream,
+        "stream": stream,
+        "type": "GEN",
+        "segmentDuration": "1",
+        "fragmentDuration": "0.1",
+        # sessions expire as soon as their viewers stop requesting
+        "sessionTimeout": 0.05,
+        "serverSideRepresentationSwitching": False,
+        "storage": storage,
+        "qualities": {"video": [{"targetWidth": "640", "targetBitrate": "250"},
+                                {"targetWidth": "640", "targetBitrate": "500"}]},
+    }
+
+
+def mdat(size: int) -> bytes:
+    # a complete CMAF fragment as far as the segment index is concerned
+    return struct.pack(">I4s", size, b"mdat") + bytes(size - 8)
+
+
+def request(path: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": path, "headers": [], "query_string": b""})
+
+
+def whole_body(message: bytes):
+    async def receive():
+        return {"type": "http.request", "body": message, "more_body": False}
+    return receive
+
+
+async def chunks(count: int, chunk: bytes):
+    for _ in range(count):
+        yield chunk
+        await asyncio.sleep(0)
+
+
+async def view(stream: str, client: str, name: str) -> int:
+    response = await fastll.outgoing_data(request(f"/{stream}-{client}/{name}"), f"{stream}-{client}", name)
+    if hasattr(response, "body_iterator"):
+        received = 0
+        async for data in response.body_iterator:
+            received += len(data)
+        return received
+    return len(response.body)
+
+
+async def run_stream(stream: str, cycle: int, args):
+    fll_stream = fastll.get_stream(stream)
+    fastll.update_access_time(fll_stream)
+    await fastll.start_ffmpeg(fll_stream)
+    # the first manifests are skipped
+    for _ in range(6):
+        await fastll.process_incoming(stream, "manifest.mpd", None, whole_body(MANIFEST.encode()))
+    for representation in fll_stream.qualities:
+        await fastll.process_incoming(stream, f"init-stream{representation}.m4s", None,
+                                      whole_body(mdat(1024)))
+
+    chunk = mdat(args.chunk_size)
+    for number in range(1, args.segments + 1):
+        fastll.update_access_time(fll_stream)
+        representation = number % len(fll_stream.qualities)
+        name = f"chunk-stream{representation}-{number:05d}.m4s"
+        # viewers come and go, each one with a new client id
+        viewers = [asyncio.ensure_future(view(stream, f"c{cycle}x{number}x{i}", name)) for i in range(args.viewers)]
+        # far-ahead requests leave placeholders of segments that never arrive
+        await fastll.segment_placeholder(fll_stream, f"chunk-stream0-{number + 1000:05d}.m4s", time.time())
+        await asyncio.sleep(0)
+        await fastll.process_incoming(stream, name, chunks(args.chunks, chunk), None)
+        await asyncio.gather(*viewers)
+        if number > 3:
+            previous = number - 3
+            await fastll.delete_data(stream, f"chunk-stream{previous % len(fll_stream.qualities)}-{previous:05d}.m4s")
+        await asyncio.sleep(0.06)
+        await fastll.StreamCheckTask.check_streams()
+
+
+async def run_cycle(streams, cycle: int, args):
+    await asyncio.gather(*[run_stream(stream, cycle, args) for stream in streams])
+    # no viewers left: the check task stops the streams and then releases them
+    no_client_wait_time = fastll.NO_CLIENT_WAIT_TIME
+    fastll.NO_CLIENT_WAIT_TIME = -1
+    try:
+        await fastll.StreamCheckTask.check_streams()
+        await fastll.StreamCheckTask.check_streams()
+    finally:
+        fastll.NO_CLIENT_WAIT_TIME = no_client_wait_time
+    assert len(fastll.fll_streams) == 0, "streams not released"
+
+
+def live_objects():
+    gc.collect()
+    counts = {Segment: 0, Session: 0, Stream: 0}
+    for obj in gc.get_objects():
+        if type(obj) in counts:
+            counts[type(obj)] += 1
+    return {kind.__name__: count for kind, count in counts.items()}
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return 0
+
+
+async def soak(args, storage_dir: str) -> bool:
+    streams = [f"soak{i}" for i in range(args.streams)]
+    fastll.fastll_conf.update({"host": "localhost", "port": 8000, "https": False, "timeDisplacement": 0,
+                               "storageDir": storage_dir, "streams": []})
+    for stream in streams:
+        fastll.conf_streams[stream] = stream_config(stream, args.storage)
+
+    for cycle in range(args.warmup):
+        await run_cycle(streams, cycle, args)
+    baseline_objects = live_objects()
+    baseline_rss = rss_kb()
+    tracemalloc.start(25)
+    baseline = tracemalloc.take_snapshot()
+
+    start = time.perf_counter()
+    for cycle in range(args.warmup, args.warmup + args.cycles):
+        await run_cycle(streams, cycle, args)
+    elapsed = time.perf_counter() - start
+
+    objects = live_objects()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    statistics = snapshot.filter_traces(filters).compare_to(baseline.filter_traces(filters), "lineno")
+    growth = sum(stat.size_diff for stat in statistics)
+
+    print(f"{args.cycles} cycles of {len(streams)} streams, {args.segments} segments and {args.viewers} viewers "
+          f"per segment, {args.storage} storage: {elapsed:.1f} s")
+    print(f"traced memory growth: {growth / 1024:.1f} KiB (limit {args.max_growth_kb} KiB), "
+          f"rss: {baseline_rss} -> {rss_kb()} KiB")
+    print(f"live objects: {baseline_objects} -> {objects}")
+    for stat in statistics[:args.top]:
+        print(f"  {stat}")
+
+    leaked = objects != baseline_objects
+    if leaked:
+        print("LEAK: live objects grew")
+    if growth > args.max_growth_kb * 1024:
+        print("LEAK: traced memory grew over the limit")
+        leaked = True
+    return not leaked
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=20, help="measured stream lifetimes")
+    parser.add_argument("--warmup", type=int, default=3, help="stream lifetimes before measuring")
+    parser.add_argument("--streams", type=int, default=2)
+    parser.add_argument("--segments", type=int, default=10, help="segments per stream lifetime")
+    parser.add_argument("--viewers", type=int, default=10, help="viewers per segment")
+    parser.add_argument("--chunks", type=int, default=10, help="chunks per segment")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--storage", default="memory", choices=["memory", "sharedMemory", "mmap"])
+    parser.add_argument("--max-growth-kb", type=int, default=256, help="allowed traced memory growth")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites with the largest growth shown")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    # retired segments and placeholders are purged on the next check, not seconds later
+    fastll_stream.SEGMENT_GRACE_PERIOD = 0
+    fastll_stream.PLACEHOLDER_MAX_AGE = 0
+    fastll.subprocess.Popen = FakeFfmpeg
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        passed = asyncio.run(soak(args, storage_dir))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
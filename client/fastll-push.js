@@ -0,0 +1,205 @@
+/*
+ * Fast-ll push channel adapter for dash.js.
+ *
+ * Opens http[s]://host:port/push/{stream}-{client}/{representation} and answers the segment requests of dash.js
+ * with the objects pushed by the server, while their chunks are still arriving. Any other request goes to the
+ * network. dash.js must request segments with fetch, which it does in low latency mode:
+ *
+ *   FastllPush.attach("https://host:port", "stream", "client", 0);
+ *   const player = dashjs.MediaPlayer().create();
+ *   player.updateSettings({streaming: {lowLatencyEnabled: true}});
+ *   player.initialize(video, "https://host:port/stream-client/manifest.mpd", true);
+ */
+(function (global) {
+    "use strict";
+
+    // frame header: name length (2 bytes) and data length (4 bytes), big endian
+    const HEADER_SIZE = 6;
+    const MAX_OBJECTS = 8;
+    const RECONNECT_DELAY_MS = 1000;
+
+    const nativeFetch = global.fetch.bind(global);
+    const decoder = new TextDecoder();
+    const channels = [];
+
+    class PushedObject {
+        constructor() {
+            this.chunks = [];
+            this.done = false;
+            this.readers = [];
+        }
+
+        push(chunk) {
+            this.chunks.push(chunk);
+            this.readers.forEach(reader => reader.enqueue(chunk));
+        }
+
+        end() {
+            this.done = true;
+            this.readers.forEach(reader => reader.close());
+            this.readers = [];
+        }
+
+        abort() {
+            this.readers.forEach(reader => reader.error(new Error("Fast-ll push channel closed")));
+            this.readers = [];
+        }
+
+        stream() {
+            const object = this;
+            return new ReadableStream({
+                start(controller) {
+                    object.chunks.forEach(chunk => controller.enqueue(chunk));
+                    if (object.done) {
+                        controller.close();
+                    } else {
+                        object.readers.push(controller);
+                    }
+                }
+            });
+        }
+    }
+
+    class FastllPush {
+        constructor(baseUrl, stream, client, representation) {
+            this.baseUrl = baseUrl;
+            this.stream = stream;
+            this.client = client;
+            this.representation = representation;
+            this.objects = new Map();
+            this.closed = false;
+        }
+
+        static attach(baseUrl, stream, client, representation) {
+            const channel = new FastllPush(baseUrl, stream, client, representation);
+            channels.push(channel);
+            channel.open();
+            return channel;
+        }
+
+        close() {
+            this.closed = true;
+            if (this.reader) {
+                this.reader.cancel();
+            }
+            channels.splice(channels.indexOf(this), 1);
+        }
+
+        async open() {
+            const url = `${this.baseUrl}/push/${this.stream}-${this.client}/${this.representation}`;
+            try {
+                const response = await nativeFetch(url);
+                if (response.ok) {
+                    this.reader = response.body.getReader();
+                    await this.read(this.reader);
+                }
+            } catch (e) {
+                console.warn(`Fast-ll push channel of ${this.stream} closed: ${e}`);
+            }
+            // objects cut short are requested to the network again
+            for (const [name, object] of this.objects) {
+                if (!object.done) {
+                    object.abort();
+                    this.objects.delete(name);
+                }
+            }
+            // the server ends the channel when the viewer falls behind, a new one starts at the live edge
+            if (!this.closed) {
+                setTimeout(() => this.open(), RECONNECT_DELAY_MS);
+            }
+        }
+
+        async read(reader) {
+            let buffer = new Uint8Array(0);
+            let object = null;
+            let remaining = 0;
+            for (;;) {
+                const {value, done} = await reader.read();
+                if (done) {
+                    return;
+                }
+                buffer = concat(buffer, value);
+                let position = 0;
+                for (;;) {
+                    if (remaining > 0) {
+                        const size = Math.min(remaining, buffer.length - position);
+                        if (size === 0) {
+                            break;
+                        }
+                        object.push(buffer.slice(position, position + size));
+                        position += size;
+                        remaining -= size;
+                        continue;
+                    }
+                    if (buffer.length - position < HEADER_SIZE) {
+                        break;
+                    }
+                    const header = new DataView(buffer.buffer, buffer.byteOffset + position, HEADER_SIZE);
+                    const nameLength = header.getUint16(0);
+                    const size = header.getUint32(2);
+                    if (buffer.length - position < HEADER_SIZE + nameLength) {
+                        break;
+                    }
+                    const name = decoder.decode(buffer.subarray(position + HEADER_SIZE,
+                        position + HEADER_SIZE + nameLength));
+                    position += HEADER_SIZE + nameLength;
+                    object = this.object(name);
+                    if (size === 0) {
+                        object.end();
+                    } else {
+                        remaining = size;
+                    }
+                }
+                buffer = buffer.slice(position);
+            }
+        }
+
+        object(name) {
+            let object = this.objects.get(name);
+            if (object === undefined) {
+                object = new PushedObject();
+                this.objects.set(name, object);
+                if (this.objects.size > MAX_OBJECTS) {
+                    // the oldest one
+                    this.objects.delete(this.objects.keys().next().value);
+                }
+            }
+            return object;
+        }
+
+        lookup(url) {
+            const path = new URL(url, global.location.href).pathname.split("/");
+            const streamData = path[path.length - 2];
+            if (streamData !== this.stream && !streamData.startsWith(`${this.stream}-`)) {
+                return undefined;
+            }
+            return this.objects.get(path[path.length - 1]);
+        }
+    }
+
+    function concat(a, b) {
+        if (a.length === 0) {
+            return b;
+        }
+        const result = new Uint8Array(a.length + b.length);
+        result.set(a, 0);
+        result.set(b, a.length);
+        return result;
+    }
+
+    global.fetch = function (input, init) {
+        const url = input instanceof Request ? input.url : String(input);
+        for (const channel of channels) {
+            const object = channel.lookup(url);
+            if (object !== undefined) {
+                return Promise.resolve(new Response(object.stream(), {
+                    status: 200,
+                    headers: {"Content-Type": "video/mp4"}
+                }));
+            }
+        }
+        return nativeFetch(input, init);
+    };
+
+    global.FastllPush = FastllPush;
+})(window);
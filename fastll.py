@@ -1,19 +1,42 @@
 import asyncio
+import json
 import re
+import signal
 import subprocess
 import time
+from typing import AsyncIterator
 
-import pandas as pd
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
 from starlette.requests import ClientDisconnect
 
+import fastll_admission
+import fastll_auth
+import fastll_cdn
+import fastll_cmcd
+import fastll_hls
+import fastll_latency
+import fastll_log
+import fastll_push
+import fastll_record
+import fastll_trace
 import ffmpeg_commands
+from fastll_cdn import cdn_origin, CdnOriginMiddleware
+from fastll_clock import clock, DateMiddleware
+from fastll_cmcd import Cmcd
 from fastll_conf import fastll_conf
+from fastll_latency import LatencyStats
+from fastll_log import hot_path_log
+from fastll_monitor import loop_monitor, profiler
+from fastll_record import Recording, recorder, VodResponse
+from fastll_session import Session
+from fastll_stats import StatsWriter, stats_exporter
+from fastll_storage import SegmentStorageError, create_storage
+from fastll_trace import VIEWER_FIRST_BYTE, VIEWER_LAST_BYTE
+from fastll_version import VERSION
 from fastll_stream import *
 
-VERSION = "Fastll 0.7.1"
 
 tags_metadata = [
     {
@@ -51,6 +74,18 @@ tags_metadata = [
         "description": """
         Sets an adaptation set to force to all clients
         """,
+    },
+    {
+        "name": "Administration",
+        "description": """
+        Adds, removes and reloads streams without restarting the server
+        """,
+    },
+    {
+        "name": "Latency",
+        "description": """
+        End-to-end latency distributions measured from the prft boxes of incoming segments
+        """,
     }
 ]
 
@@ -75,28 +110,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CdnOriginMiddleware)
+app.add_middleware(DateMiddleware)
 
 NO_CLIENT_WAIT_TIME = 15  # seconds
 
 host: str = ""
 port: str = ""
 http_url: str = ""
+ingest_url: str = None
 timeDisplacement: int = 0
 waitForAbsentSegment: bool = True
+latencyFile: str = None
+# segment timeline tracer, only set when tracing is enabled
+tracer = None
 
 ffmpeg_lock = asyncio.Lock()
+streams_lock = asyncio.Lock()
 fll_streams: Dict[str, Stream] = {}
 fll_streams_adaptation_set_override = {}
 
 stream_pattern = r"stream(\d+)"
 segment_number_pattern = r'-(\d+)\.m4s$'
 conf_streams = {}
-inits = {}
-segments = {}
-ffmpeg_status = {}  # 0:starting, 1: started
-ffmpeg_pids = {}
-stream_last_access = {}
-request_stats = {}
 
 
 class StreamCheckTask:
@@ -107,91 +143,83 @@ class StreamCheckTask:
     async def check():
         while True:
             await asyncio.sleep(2)
-            dt = datetime.utcnow()
-            now = datetime.timestamp(dt)
-            for fll_stream in fll_streams.values():
-                if fll_stream.status == StreamStatus.STARTED:
-                    stream_last_access_time = fll_stream.last_access
-                    delta = now - stream_last_access_time
-                    if delta > NO_CLIENT_WAIT_TIME:
-                        logger.debug(f"Stop stream: {fll_stream.name}")
-                        fll_stream.stop()
-                        if fll_stream.save_stats:
-                            ClientStats.summary_stats(client_stats)
+            try:
+                await StreamCheckTask.check_streams()
+            except Exception:
+                # the task keeps running, otherwise idle streams are never stopped again
+                logger.exception("Stream check failed")
+
+    @staticmethod
+    async def check_streams():
+        dt = datetime.utcnow()
+        now = datetime.timestamp(dt)
+        # streams may be added or removed while stopping one
+        for fll_stream in list(fll_streams.values()):
+            if fll_streams.get(fll_stream.name) is not fll_stream:
+                # removed or replaced in the meantime, the reload takes care of it
+                continue
+            fll_stream.sessions.expire()
+            fll_stream.purge_retired_segments()
+            for segment in fll_stream.purge_placeholders():
+                if tracer is not None:
+                    tracer.finish(segment.timeline)
+            if fll_stream.status == StreamStatus.STARTED:
+                stream_last_access_time = fll_stream.last_access
+                delta = now - stream_last_access_time
+                if delta > NO_CLIENT_WAIT_TIME:
+                    logger.debug(f"Stop stream: {fll_stream.name}")
+                    await stop_stream(fll_stream)
+            elif now - fll_stream.last_access > NO_CLIENT_WAIT_TIME and fll_stream.sessions.viewers() == 0:
+                release_stream(fll_stream)
 
 
 runner = StreamCheckTask()
 
 
-class ClientStats:
-    def __init__(self):
-        self.stats = pd.DataFrame(columns=['timestamp', 'delta', 'jitter', 'users'])
-
-    def update_timestamp(self, timestamp, users):
-        # Add timestamp
-        self.stats.loc[len(self.stats), ['timestamp', 'users']] = [timestamp, users]
-
-        length = len(self.stats)
-        if length > 1:
-            # Calculate delta
-            self.stats.loc[length - 1, 'delta'] = self.stats.loc[length - 1, 'timestamp'] - self.stats.loc[length - 2, 'timestamp']
-        if length > 2:
-            # Calculate jitter
-            self.stats.loc[length - 1, 'jitter'] = abs(self.stats.loc[length - 1, 'delta'] - self.stats.loc[length - 2, 'delta'])
-
-    def last_delta(self):
-        delta = self.stats.loc[len(self.stats) - 1, 'delta']
-        return delta if not pd.isna(delta) else 0
-
-    def last_jitter(self):
-        jitter = self.stats.loc[len(self.stats) - 1, 'jitter']
-        return jitter if not pd.isna(jitter) else 0
-
-    def average_jitter(self, count=10):
-        return self.stats['jitter'][-count:].dropna().mean()
-
-    def deltas(self, count=0, dropna=True):
-        if 0 < count < len(self.stats):
-            return self.stats['delta'][-count:].dropna() if dropna else self.stats['delta'][-count:]
-        return self.stats['delta'].dropna() if dropna else self.stats['delta']
-
-    def jitters(self, count=0, dropna=True):
-        if 0 < count < len(self.stats):
-            return self.stats['jitter'][-count:].dropna() if dropna else self.stats['jitter'][-count:]
-        return self.stats['jitter'].dropna() if dropna else self.stats['jitter']
-
-    def users(self, count=0, dropna=True):
-        if 0 < count < len(self.stats):
-            return self.stats.dropna()['users'][-count:] if dropna else self.stats['users'][-count:]
-        return self.stats.dropna()['users'] if dropna else self.stats['users']
+class StatsFlushTask:
+    @staticmethod
+    async def flush():
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            for fll_stream in fll_streams.values():
+                if fll_stream.stats_writer is not None:
+                    stats_exporter.flush(fll_stream.stats_writer)
+
 
+class LogSummaryTask:
     @staticmethod
-    def summary_stats(stats):
-        names = list(stats.keys())
-        # Data
-        data = {}
-        cols = []
-        for name in names:
-            # Columns with client id for jitter values
-            hdr = name + '_jitter'
-            data[hdr] = stats[name].jitters().to_list()
-            cols.append(hdr)
-            # Columns with client id for delay values
-            hdr = name + '_delta'
-            data[hdr] = stats[name].deltas().to_list()
-            cols.append(hdr)
-            # Columns with client id for concurrent users
-            hdr = name + '_users'
-            data[hdr] = stats[name].users().to_list()
-            cols.append(hdr)
-
-        print(data)
-        # Dataset
-        df = pd.DataFrame.from_dict(data=data, orient='index').transpose()
-        df.to_csv('summary_jitter.csv')
-
-
-client_stats = {}
+    async def report():
+        while True:
+            await asyncio.sleep(LOG_SUMMARY_INTERVAL)
+            logger.info("Hot path events: {}", hot_path_log.take_counts())
+
+
+class TraceFileTask:
+    @staticmethod
+    async def write():
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            timelines = tracer.take()
+            if len(timelines) > 0:
+                # serialization and file writes never block the event loop
+                await loop.run_in_executor(None, fastll_trace.write_trace_file, tracer.path, timelines)
+
+
+class LatencyFileTask:
+    @staticmethod
+    async def write():
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(LATENCY_FILE_INTERVAL)
+            now = time.time()
+            for fll_stream in fll_streams.values():
+                if fll_stream.latency_stats and len(fll_stream.latency) > 0:
+                    line = fastll_latency.latency_line(now, fll_stream.name, fll_stream.latency)
+                    # file writes never block the event loop
+                    await loop.run_in_executor(None, fastll_latency.write_latency_file, latencyFile, line)
+
+
 
 
 @app.on_event("startup")
@@ -201,6 +229,9 @@ async def startup_event():
     global http_url
     global timeDisplacement
     global waitForAbsentSegment
+    global latencyFile
+    global ingest_url
+    global tracer
 
     logger.debug("Fast-ll starting...")
     logger.debug(f"Fast-ll time...{datetime.timestamp(datetime.utcnow())}")
@@ -213,24 +244,257 @@ async def startup_event():
         http_protocol = "https"
     http_url = f"{http_protocol}://{host}:{port}"
     logger.debug(f"Fast-ll http url: {http_url}")
-    streams = fastll_conf["streams"]
+    streams = owned_streams(fastll_conf["streams"])
+    fastll_conf["streams"] = streams
     logger.debug(f"Fast-ll streams: {streams}")
     timeDisplacement = fastll_conf["timeDisplacement"]
+    latencyFile = fastll_conf.get("latencyFile")
 
-    # index streams by stream id
+    # index streams by stream id, their runtime state is built when they are first requested. Every entry is
+    # built once here anyway, so a bad configuration fails the startup and not the first request of a viewer
     for i in streams:
+        Stream(i)
         conf_streams[i["stream"]] = i
-        fll_stream = Stream(i)
-        fll_streams[fll_stream.name] = fll_stream
+
+    # dedicated ingest listener
+    if fastll_conf.get("ingestPort") is not None:
+        ingest_host = fastll_conf.get("ingestHost", DEFAULT_INGEST_HOST)
+        ingest_url = f"http://{ingest_host}:{fastll_conf['ingestPort']}"
+        logger.debug(f"Fast-ll ingest url: {ingest_url}")
+        import fastll_ingest
+        fastll_ingest.start_ingest_server(ingest_host, fastll_conf["ingestPort"], asyncio.get_running_loop(),
+                                          process_incoming, open_incoming_segment, delete_data)
 
     # start check task
     asyncio.create_task(runner.check())
 
+    # event loop lag and slow callbacks
+    loop_monitor.start()
+
+    # cache semantics for a CDN
+    cdn_origin.enabled = fastll_conf.get("cdnOrigin", DEFAULT_CDN_ORIGIN)
+    cdn_origin.manifest_max_age = fastll_conf.get("cdnManifestMaxAge", CDN_MANIFEST_MAX_AGE)
+    cdn_origin.segment_max_age = fastll_conf.get("cdnSegmentMaxAge", CDN_SEGMENT_MAX_AGE)
+
+    # server admission limits
+    fastll_admission.server_limits.max_viewers = fastll_conf.get("maxViewers")
+    fastll_admission.server_limits.max_egress_kbps = fastll_conf.get("maxEgressKbps")
+
+    # start stats flush task
+    asyncio.create_task(StatsFlushTask.flush())
+
+    # hot path log sampling
+    if fastll_conf.get("logSampling") is not None:
+        hot_path_log.configure(fastll_conf["logSampling"])
+        asyncio.create_task(LogSummaryTask.report())
+
+    # start segment timeline tracing
+    if fastll_conf.get("traceFile") is not None:
+        tracer = fastll_trace.tracer
+        tracer.configure(fastll_conf["traceFile"], fastll_conf.get("traceSampleRate", DEFAULT_TRACE_SAMPLE_RATE))
+        asyncio.create_task(TraceFileTask.write())
+
+    # start latency file task
+    if latencyFile is not None:
+        asyncio.create_task(LatencyFileTask.write())
+
+    # reload streams configuration on SIGHUP
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP,
+                                                      lambda: asyncio.create_task(reload_streams()))
+
     # to start a stream on startup (comment the line above to avoid stopping it)
     # fll_stream = fll_streams["hik"]
     # await start_ffmpeg(fll_stream)
 
 
+async def reload_streams():
+    try:
+        with open(fastll_conf["streamsFile"]) as json_file:
+            streams = json.load(json_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"Stream configuration file can't be read: {e}")
+        return None
+    try:
+        return await apply_streams(streams)
+    except KeyError as e:
+        logger.error(f"Stream configuration is missing {e}")
+        return None
+    except ValueError as e:
+        logger.error(f"Stream configuration is not valid: {e}")
+        return None
+
+
+async def apply_streams(streams):
+    """Diffs a streams configuration against the running one. New streams are added, removed streams are stopped
+    and changed streams are replaced restarting only their FFmpeg. Unaffected streams keep serving."""
+    streams = owned_streams(streams)
+    new_conf_streams = {i["stream"]: i for i in streams}
+
+    await streams_lock.acquire()
+    try:
+        # build every new or changed stream before touching the running ones, so a bad entry changes nothing
+        new_streams = {name: Stream(i) for name, i in new_conf_streams.items() if conf_streams.get(name) != i}
+        added = []
+        changed = []
+        removed = [name for name in conf_streams if name not in new_conf_streams]
+        for name in removed:
+            await remove_stream(name)
+        for name, fll_stream in new_streams.items():
+            if name in conf_streams:
+                changed.append(name)
+            else:
+                added.append(name)
+            await replace_stream(new_conf_streams[name], fll_stream)
+        fastll_conf["streams"] = streams
+    finally:
+        streams_lock.release()
+
+    logger.info(f"Streams reloaded, added: {added}, changed: {changed}, removed: {removed}")
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+async def replace_stream(config_stream, fll_stream: Stream):
+    old_stream = fll_streams.get(fll_stream.name)
+    conf_streams[fll_stream.name] = config_stream
+    fll_streams_adaptation_set_override.pop(fll_stream.name, None)
+    if old_stream is None:
+        # not in use, it is built from the new configuration when requested
+        return
+    fll_streams[fll_stream.name] = fll_stream
+    old_stream.sessions.clear()
+    if old_stream.status == StreamStatus.STARTED:
+        # viewers of the old stream keep receiving the segments they already have
+        await stop_stream(old_stream)
+        fll_stream.last_access = old_stream.last_access
+        await start_ffmpeg(fll_stream)
+    old_stream.close_storage()
+
+
+async def remove_stream(name: str):
+    # new requests get 404 from now on, in-flight responses hold their own segment references
+    fll_stream = fll_streams.pop(name, None)
+    del conf_streams[name]
+    fll_streams_adaptation_set_override.pop(name, None)
+    if fll_stream is None:
+        return
+    if fll_stream.status == StreamStatus.STARTED:
+        await stop_stream(fll_stream)
+    fll_stream.sessions.clear()
+    fll_stream.close_storage()
+
+
+def owned_streams(streams):
+    # in sharded mode only the streams owned by this worker are served
+    if fastll_conf.get("worker") is None:
+        return streams
+    import fastll_shard
+    return fastll_shard.owned_streams(streams, fastll_conf["worker"], fastll_conf.get("workers", 1))
+
+
+def get_stream(name: str) -> Stream:
+    """Runtime state of a configured stream, built on first use. Raises KeyError if it is not configured"""
+    fll_stream = fll_streams.get(name)
+    if fll_stream is None:
+        fll_stream = Stream(conf_streams[name])
+        fll_streams[name] = fll_stream
+    return fll_stream
+
+
+def release_stream(fll_stream: Stream):
+    # idle streams go back to their configuration only
+    logger.debug(f"Release stream: {fll_stream.name}")
+    # it may have been removed or replaced by a reload while the check task was stopping another one
+    if fll_streams.get(fll_stream.name) is fll_stream:
+        del fll_streams[fll_stream.name]
+    fll_stream.close_storage()
+
+
+async def stop_stream(fll_stream: Stream):
+    await ffmpeg_lock.acquire()
+    try:
+        if tracer is not None:
+            for segment in fll_stream.segments.values():
+                tracer.finish(segment.timeline)
+        if fll_stream.stats_writer is not None:
+            # pending rows are written and the session file closed by the stats thread
+            stats_exporter.flush(fll_stream.stats_writer, close=True)
+            fll_stream.stats_writer = None
+        if fll_stream.recording is not None:
+            # the recording is closed with a static version of the last manifest
+            recorder.finish(fll_stream.recording, fll_stream.manifest.get_manifest())
+            fll_stream.recording = None
+        fll_stream.stop()
+    finally:
+        ffmpeg_lock.release()
+
+
+def admin_authorized(request: Request):
+    client_host = request.client.host if request.client is not None else None
+    return fastll_auth.admin_authorized(fastll_conf.get("adminToken"), request.headers.get("authorization"),
+                                        client_host)
+
+
+@app.post("/admin/reload", tags=["Administration"],
+          description="Reloads the streams configuration file")
+async def admin_reload(request: Request):
+    if not admin_authorized(request):
+        return Response(status_code=401)
+    result = await reload_streams()
+    if result is None:
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=400)
+    return JSONResponse(content=result)
+
+
+@app.get("/admin/loop", tags=["Administration"],
+         description="Event loop lag histogram and last slow callbacks with their stacks")
+async def admin_loop(request: Request):
+    if not admin_authorized(request):
+        return Response(status_code=401)
+    return JSONResponse(content=loop_monitor.summary())
+
+
+@app.post("/admin/profile", tags=["Administration"],
+          description="Samples the event loop for some seconds and returns its stacks in collapsed format")
+async def admin_profile(request: Request, seconds: float = 10):
+    if not admin_authorized(request):
+        return Response(status_code=401)
+    if seconds <= 0 or seconds > PROFILE_MAX_SECONDS:
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=400)
+    result = await asyncio.get_running_loop().run_in_executor(None, profiler.profile, loop_monitor.loop_thread,
+                                                              seconds)
+    if result is None:
+        # only one profile at a time
+        return Response(content="Busy", media_type="text/plain;charset=UTF-8", status_code=409)
+    return Response(content=result, media_type="text/plain;charset=UTF-8", status_code=200)
+
+
+@app.put("/admin/streams/{stream}", tags=["Administration"],
+         description="Adds or replaces a stream")
+async def admin_put_stream(request: Request, stream: str):
+    if not admin_authorized(request):
+        return Response(status_code=401)
+    try:
+        config_stream = await request.json()
+        config_stream["stream"] = stream
+        streams = [i for i in fastll_conf["streams"] if i["stream"] != stream]
+        streams.append(config_stream)
+        return JSONResponse(content=await apply_streams(streams))
+    except (KeyError, ValueError, TypeError):
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=400)
+
+
+@app.delete("/admin/streams/{stream}", tags=["Administration"],
+            description="Removes a stream")
+async def admin_delete_stream(request: Request, stream: str):
+    if not admin_authorized(request):
+        return Response(status_code=401)
+    if stream not in conf_streams:
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=404)
+    streams = [i for i in fastll_conf["streams"] if i["stream"] != stream]
+    return JSONResponse(content=await apply_streams(streams))
+
+
 @app.get("/")
 @app.get("/version", tags=["Service Information"],
          description="Display version information")
@@ -247,9 +511,18 @@ async def conf():
 @app.get("/isotime", tags=["Time Synchronization"],
          description="Server time in ISO format")
 async def iso_time():
-    time_format = '%Y-%m-%dT%H:%M:%S.%fZ'
-    t = datetime.utcnow() - timedelta(seconds=timeDisplacement)
-    return Response(content=t.strftime(time_format), media_type="text/plain;charset=UTF-8", status_code=200)
+    return Response(content=clock.iso(timeDisplacement), media_type="text/plain;charset=UTF-8", status_code=200)
+
+
+@app.api_route("/isotime/{stream}", methods=["GET", "HEAD"], tags=["Time Synchronization"],
+               description="Stream time in ISO format (http-xsdate and http-iso) and in the Date header (http-head)")
+async def stream_iso_time(stream: str):
+    if stream not in conf_streams:
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=404)
+    # read from the configuration, polling the time doesn't build the stream
+    displacement = conf_streams[stream].get("timeDisplacement", timeDisplacement)
+    return Response(content=clock.iso(displacement), media_type="text/plain;charset=UTF-8", status_code=200,
+                    headers={"Date": clock.http_date(displacement)})
 
 
 @app.get("/ssss/{stream}/{adaptation_set_id}", tags=["Server Side Streaming Switching Request"],
@@ -257,7 +530,7 @@ async def iso_time():
 async def ssss_stream_selection(stream: str, adaptation_set_id: int):
     if stream in conf_streams:
         # stream
-        fll_stream = fll_streams[stream]
+        fll_stream = get_stream(stream)
         if adaptation_set_id < 0 or adaptation_set_id >= fll_stream.max_adaptation_set():
             return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=404)
         fll_streams_adaptation_set_override[stream] = adaptation_set_id
@@ -266,23 +539,84 @@ async def ssss_stream_selection(stream: str, adaptation_set_id: int):
         return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=404)
 
 
+@app.get("/sessions/{stream}", tags=["Service Information"],
+         description="Live viewers of a stream and bytes delivered to them")
+async def stream_sessions(stream: str):
+    if stream in fll_streams:
+        return JSONResponse(content=fll_streams[stream].sessions.summary())
+    elif stream in conf_streams:
+        # not in use
+        return JSONResponse(content={"viewers": 0, "egress_kbps": 0, "delivered_bytes": 0})
+    else:
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=404)
+
+
+@app.get("/latency/{stream}", tags=["Latency"],
+         description="Encoder to origin and origin to client latency distributions by representation")
+async def stream_latency(stream: str):
+    if stream in fll_streams:
+        fll_stream = fll_streams[stream]
+        return JSONResponse(content={representation: stats.summary()
+                                     for representation, stats in fll_stream.latency.items()})
+    elif stream in conf_streams:
+        # not in use
+        return JSONResponse(content={})
+    else:
+        return Response(content="Error", media_type="text/plain;charset=UTF-8", status_code=404)
+
+
+@app.get("/vod/{stream}", tags=["Video on Demand"],
+         description="Recorded sessions of a stream")
+async def vod_recordings(stream: str):
+    return JSONResponse(content=vod_library().recordings(stream))
+
+
+@app.get("/vod/{stream}/{session}/{name}", tags=["Video on Demand"],
+         description="Objects of a recorded session")
+async def vod_data(stream: str, session: str, name: str):
+    vod_session = await vod_library().session(stream, session)
+    if vod_session is None:
+        return Response(status_code=404)
+    data = vod_session.get(name)
+    if data is None:
+        return Response(status_code=404)
+    cache_headers = None
+    if cdn_origin.enabled:
+        # recorded sessions never change
+        cache_headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    if name.endswith(".mpd"):
+        return VodResponse(content=data, media_type="application/dash+xml", status_code=200, headers=cache_headers)
+    return VodResponse(content=data, media_type="video/mp4", status_code=200, headers=cache_headers)
+
+
+def vod_library():
+    # recorded sessions are loaded with the first request for them
+    library = fastll_record.vod_library
+    if library.record_dir is None:
+        library.configure(fastll_conf.get("recordDir", DEFAULT_RECORD_DIR))
+    return library
+
+
 @app.get("/{stream_data}/{name}", tags=["Object Request"],
          description="Handles HTTP GET request to stream objects")
-async def outgoing_data(stream_data: str, name: str):
+async def outgoing_data(request: Request, stream_data: str, name: str):
     request_incoming_time = time.time()
 
-    if "-" in stream_data:
-        stream_components = stream_data.split("-")
-        stream = stream_components[0]
-        request_client = stream_components[1]
-    else:
-        stream = stream_data
-        request_client = "unknown"
+    stream, request_client = stream_viewer(stream_data)
 
     if stream in conf_streams:
         # stream
-        fll_stream = fll_streams[stream]
+        fll_stream = get_stream(stream)
         update_access_time(fll_stream)
+        if fll_stream.sessions.get(request_client) is None and not fastll_admission.admit_viewer(fll_stream):
+            logger.warning(f"Viewer {request_client} of {stream} not admitted, viewer limit reached")
+            return Response(status_code=503)
+        session = fll_stream.sessions.touch(request_client)
+
+        if name.endswith(".m3u8") and fll_stream.ll_hls:
+            # start ffmpeg
+            await start_ffmpeg(fll_stream)
+            return await hls_playlist(request, fll_stream, name)
 
         if name.startswith("manifest"):
             # start ffmpeg
@@ -291,6 +625,10 @@ async def outgoing_data(stream_data: str, name: str):
             # return manifest when available
             try:
                 await asyncio.wait_for(fll_stream.manifest.event.wait(), 10.0)
+                if cdn_origin.enabled:
+                    # precompressed, revalidated by the CDN every few seconds
+                    body = fastll_cdn.manifest_body(fll_stream.manifest, fll_stream.server_side_streaming_switching)
+                    return fastll_cdn.manifest_response(request, body)
                 if fll_stream.server_side_streaming_switching:
                     return Response(content=fll_stream.manifest.get_ssss_manifest(), media_type="text/plain;charset=UTF-8", status_code=200)
                 else:
@@ -303,50 +641,77 @@ async def outgoing_data(stream_data: str, name: str):
             stream_id = int(re.search(stream_pattern, name).group(1))
             try:
                 await asyncio.wait_for(fll_stream.init_segments[stream_id].event.wait(), 5.0)
-                return Response(content=fll_stream.init_segments[stream_id].data, status_code=200)
+                init_segment = fll_stream.init_segments[stream_id]
+                cache_headers = None
+                if cdn_origin.enabled:
+                    cache_headers = fastll_cdn.object_headers(name, init_segment.modified)
+                    if fastll_cdn.not_modified(request, cache_headers):
+                        return Response(status_code=304, headers=cache_headers)
+                return Response(content=init_segment.data, status_code=200, headers=cache_headers)
             except asyncio.TimeoutError:
                 return Response(status_code=404)
 
         if name.startswith("chunk"):
 
+            # LL-HLS partial segment
+            if "part" in request.query_params and fll_stream.ll_hls:
+                return await hls_part(fll_stream, name, int(request.query_params["part"]))
+
+            session.last_segment = name
+            requested_name = name
+
             # stats
-            if fll_stream.save_stats:
-                if request_client not in client_stats:
-                    client_stats[request_client] = ClientStats()
-                client_stats[request_client].update_timestamp(request_incoming_time, len(client_stats))
-                logger.debug(f"Clients: {len(client_stats)}, avg. jitter: {request_client}/{client_stats[request_client].average_jitter()}")
+            if session.stats is not None:
+                session.stats.update_timestamp(request_incoming_time)
+                viewers = fll_stream.sessions.viewers()
+                if fll_stream.stats_writer is not None:
+                    fll_stream.stats_writer.add((request_incoming_time, request_client, session.stats.delta,
+                                                 session.stats.jitter, viewers))
+                if hot_path_log.sampled(fastll_log.CLIENT_STATS):
+                    logger.debug("Clients: {}, avg. jitter: {}/{}", viewers, request_client,
+                                 session.stats.average_jitter())
 
             # get segment number
             if fll_stream.server_side_streaming_switching:
                 segment_number = int(re.search(segment_number_pattern, name).group(1))
-                delta_segments = fll_stream.current_segment - segment_number
-                target_adaptation_set = fll_stream.max_adaptation_set()
-                representation_ratio = int(delta_segments)
-
-                # SSRS algorithm
-                target_adaptation_set = target_adaptation_set - representation_ratio
-                if target_adaptation_set < 0:
-                    target_adaptation_set = 0
-
-                logger.debug(f"SSRS Segment name: {name} -> adaptation set: {target_adaptation_set}")
+                cmcd_data = None
+                if fll_stream.cmcd:
+                    cmcd_data = fastll_cmcd.request_cmcd(request.query_params, request.headers)
+                target_adaptation_set = ssrs_adaptation_set(fll_stream, session, segment_number, cmcd_data)
+
+                ssrs_sampled = hot_path_log.sampled(fastll_log.SSRS)
+                if ssrs_sampled:
+                    logger.debug("SSRS Segment name: {} -> adaptation set: {}", name, target_adaptation_set)
                 if target_adaptation_set <= fll_stream.max_adaptation_set():
                     old_name = name
                     name = re.sub(r"\d", str(target_adaptation_set), name, count=1)
-                    logger.debug(f"SSRS Rewrite segment request: {old_name}->{name}")
+                    if ssrs_sampled:
+                        logger.debug("SSRS Rewrite segment request: {}->{}", old_name, name)
+
+            # egress bandwidth budget
+            if fastll_admission.egress_limited(fll_stream):
+                representation = int(re.search(stream_pattern, name).group(1))
+                allowed_representation = fastll_admission.egress_representation(fll_stream, session, representation)
+                if allowed_representation is None:
+                    logger.warning(f"--> {name} - Egress budget exceeded!")
+                    return Response(status_code=503)
+                if allowed_representation != representation:
+                    # another representation through the SSRS rewrite
+                    name = re.sub(r"\d", str(allowed_representation), name, count=1)
+                fll_stream.sessions.set_representation(session, allowed_representation,
+                                                       fll_stream.representation_kbps(allowed_representation))
 
             # return chunk
             waiting_time = 0
             if name not in fll_stream.segments:
                 # segment is not in the server
                 found = False
+                if name in fll_stream.retired_segments:
+                    # it has been removed, don't wait for it to arrive again
+                    return Response(status_code=404)
                 if waitForAbsentSegment:
                     # create new segment
-                    await fll_stream.segments_lock.acquire()
-                    try:
-                        fll_segment = Segment(name)
-                        fll_stream.segments[name] = fll_segment
-                    finally:
-                        fll_stream.segments_lock.release()
+                    fll_segment = await segment_placeholder(fll_stream, name, request_incoming_time)
 
                     # wait for the segment to start arriving
                     try:
@@ -366,85 +731,410 @@ async def outgoing_data(stream_data: str, name: str):
                 found = True
                 fll_segment = fll_stream.segments[name]
 
+            latency = None
+            if fll_stream.latency_stats:
+                latency = fll_stream.representation_latency(int(re.search(stream_pattern, name).group(1)))
+            viewer = None
+            if fll_segment.timeline is not None:
+                viewer = fll_segment.timeline.viewer(request_client, request_incoming_time)
+            delivery = Delivery(fll_segment, request_incoming_time, latency, viewer, session)
+
+            # with SSRS the representation behind a URL depends on each viewer, it is not cached. Neither are
+            # rewritten requests nor segments that haven't started arriving yet
+            cache_headers = None
+            if cdn_origin.enabled and not fll_stream.server_side_streaming_switching and name == requested_name \
+                    and fll_segment.arrival_time is not None:
+                cache_headers = fastll_cdn.object_headers(name, fll_segment.arrival_time)
+
             if fll_segment.completed:
+                data = fll_segment.data()
+                if data is None:
+                    return Response(status_code=404)
                 log_outgoing_chunk(name, found, waiting_time, 'y')
-                # return StreamingResponse(generate_segment(fll_segment.chunks))
-                return Response(content=fll_segment.completed_data)
+                if fastll_cdn.not_modified(request, cache_headers):
+                    return Response(status_code=304, headers=cache_headers)
+                delivery.first_byte()
+                delivery.sent(len(data))
+                delivery.finished()
+                return Response(content=data, headers=cache_headers)
             else:
                 log_outgoing_chunk(name, found, waiting_time, 'n')
-                return StreamingResponse(generate_partial_segment(fll_segment))
+                offset = 0
+                if fll_stream.fragment_join:
+                    # join at the last complete keyframe fragment instead of the segment start
+                    offset = fll_segment.join_offset()
+                    if offset > 0:
+                        # not the whole segment, it must not be cached
+                        cache_headers = None
+                return StreamingResponse(generate_partial_segment(fll_segment, offset, delivery),
+                                         headers=cache_headers)
 
     logger.warning(f"Can't serve {name}!")
     return Response(status_code=404)
 
 
+def stream_viewer(stream_data: str):
+    # objects are requested as {stream}-{client}/{name} or {stream}/{name}
+    if "-" in stream_data:
+        stream_components = stream_data.split("-")
+        return stream_components[0], stream_components[1]
+    return stream_data, "unknown"
+
+
+def ssrs_adaptation_set(fll_stream: Stream, session: Session, segment_number: int, cmcd_data) -> int:
+    """Adaptation set served to a viewer for a segment by server side representation switching. It can be over
+    the highest one for segments ahead of the ingest"""
+    delta_segments = fll_stream.current_segment - segment_number
+    target_adaptation_set = fll_stream.max_adaptation_set()
+    representation_ratio = int(delta_segments)
+
+    # SSRS algorithm
+    target_adaptation_set = target_adaptation_set - representation_ratio
+    if target_adaptation_set < 0:
+        target_adaptation_set = 0
+
+    # CMCD rule, next to the delay based one
+    if fll_stream.cmcd:
+        if cmcd_data is not None:
+            if session.cmcd is None:
+                session.cmcd = Cmcd()
+            session.cmcd.update(cmcd_data)
+        if session.cmcd is not None:
+            target_adaptation_set = fastll_cmcd.cmcd_representation(fll_stream, session.cmcd, target_adaptation_set)
+    return target_adaptation_set
+
+
+async def segment_placeholder(fll_stream: Stream, name: str, request_time: float) -> Segment:
+    """Segment requested before it arrives, requests wait on its event"""
+    await fll_stream.segments_lock.acquire()
+    try:
+        fll_segment = Segment(name, segment_storage(fll_stream))
+        if tracer is not None:
+            fll_segment.timeline = tracer.start(fll_stream.name, name)
+            if fll_segment.timeline is not None:
+                fll_segment.timeline.placeholder = request_time
+        fll_stream.segments[name] = fll_segment
+    finally:
+        fll_stream.segments_lock.release()
+    return fll_segment
+
+
+@app.get("/push/{stream_data}/{representation}", tags=["Object Request"],
+         description="Pushes the init segment and then every segment of a representation as its chunks arrive")
+async def push_channel(stream_data: str, representation: int):
+    stream, request_client = stream_viewer(stream_data)
+    if stream not in conf_streams:
+        return Response(status_code=404)
+    fll_stream = get_stream(stream)
+    if representation < 0 or representation > fll_stream.max_adaptation_set():
+        return Response(status_code=404)
+    update_access_time(fll_stream)
+    if fll_stream.sessions.get(request_client) is None and not fastll_admission.admit_viewer(fll_stream):
+        logger.warning(f"Viewer {request_client} of {stream} not admitted, viewer limit reached")
+        return Response(status_code=503)
+    fll_stream.sessions.touch(request_client)
+
+    # start ffmpeg, the channel starts at the live edge once the stream is running
+    await start_ffmpeg(fll_stream)
+    try:
+        await asyncio.wait_for(fll_stream.manifest.event.wait(), 10.0)
+        await asyncio.wait_for(fll_stream.init_segments[representation].event.wait(), 5.0)
+    except asyncio.TimeoutError:
+        return Response(status_code=404)
+    return StreamingResponse(generate_push(fll_stream, request_client, representation),
+                             media_type=fastll_push.MEDIA_TYPE)
+
+
+async def generate_push(fll_stream: Stream, request_client: str, representation: int):
+    """Push channel of a viewer. Segments are chosen one at a time, so SSRS and the egress budget apply between
+    them, and are framed with the names the player requests. It ends when a segment doesn't arrive in time"""
+    init_name = fastll_hls.init_segment_name.format(rendition=representation)
+    init_data = fll_stream.init_segments[representation].data
+    yield fastll_push.frame_header(init_name, len(init_data))
+    yield init_data
+    yield fastll_push.end_frame(init_name)
+
+    segment_wait = float(fll_stream.segment_duration) + 2
+    segment_number = max(fll_stream.current_segment, 1)
+    first_segment = True
+    while True:
+        request_time = time.time()
+        update_access_time(fll_stream)
+        session = fll_stream.sessions.touch(request_client)
+
+        served_representation = representation
+        if fll_stream.server_side_streaming_switching:
+            # a channel waiting for the next segment is at the live edge, not ahead of it
+            target_adaptation_set = ssrs_adaptation_set(fll_stream, session,
+                                                        min(segment_number, fll_stream.current_segment), None)
+            if target_adaptation_set <= fll_stream.max_adaptation_set():
+                served_representation = target_adaptation_set
+        if fastll_admission.egress_limited(fll_stream):
+            allowed_representation = fastll_admission.egress_representation(fll_stream, session,
+                                                                            served_representation)
+            if allowed_representation is None:
+                logger.warning(f"--> push {request_client} - Egress budget exceeded!")
+                return
+            served_representation = allowed_representation
+            fll_stream.sessions.set_representation(session, allowed_representation,
+                                                   fll_stream.representation_kbps(allowed_representation))
+
+        name = fastll_hls.segment_name.format(rendition=served_representation, number=segment_number)
+        requested_name = fastll_hls.segment_name.format(rendition=representation, number=segment_number)
+        fll_segment = fll_stream.segments.get(name)
+        if fll_segment is None:
+            if name in fll_stream.retired_segments:
+                # the viewer fell out of the window, the player opens a new channel at the live edge
+                return
+            fll_segment = await segment_placeholder(fll_stream, name, request_time)
+        try:
+            await asyncio.wait_for(fll_segment.event.wait(), segment_wait)
+        except asyncio.TimeoutError:
+            logger.warning(f"--> push {name} - Segment wait timeout!")
+            return
+
+        offset = 0
+        if first_segment and fll_stream.fragment_join:
+            # join at the last complete keyframe fragment instead of the segment start
+            offset = fll_segment.join_offset()
+        latency = None
+        if fll_stream.latency_stats:
+            latency = fll_stream.representation_latency(served_representation)
+        viewer = None
+        if fll_segment.timeline is not None:
+            viewer = fll_segment.timeline.viewer(request_client, request_time)
+        delivery = Delivery(fll_segment, request_time, latency, viewer, session)
+        async for data in generate_partial_segment(fll_segment, offset, delivery):
+            yield fastll_push.frame_header(requested_name, len(data))
+            yield data
+        if not fll_segment.completed:
+            # cut short, the next segment can't follow it
+            return
+        yield fastll_push.end_frame(requested_name)
+        first_segment = False
+        segment_number = segment_number + 1
+
+
+async def hls_playlist(request: Request, fll_stream: Stream, name: str):
+    try:
+        await asyncio.wait_for(fll_stream.manifest.event.wait(), 10.0)
+    except asyncio.TimeoutError:
+        return Response(status_code=404)
+
+    if name == fastll_hls.multivariant_playlist_name:
+        return Response(content=fastll_hls.multivariant_playlist(fll_stream),
+                        media_type="application/vnd.apple.mpegurl", status_code=200)
+
+    if not name.startswith("media"):
+        return Response(status_code=404)
+    rendition_id = int(re.search(stream_pattern, name).group(1))
+    rendition = fll_stream.hls_rendition(rendition_id)
+
+    # blocking playlist reload
+    if "_HLS_msn" in request.query_params:
+        msn = int(request.query_params["_HLS_msn"])
+        part = int(request.query_params["_HLS_part"]) if "_HLS_part" in request.query_params else None
+        if len(rendition.segments) > 0 and msn > rendition.segments[-1][0] + 2:
+            return Response(status_code=400)
+        available = await fastll_hls.wait_rendition(rendition,
+                                                    lambda: fastll_hls.media_sequence_available(rendition, msn, part),
+                                                    fastll_hls.block_timeout(fll_stream))
+        if not available:
+            return Response(status_code=503)
+
+    return Response(content=fastll_hls.media_playlist(fll_stream, rendition_id),
+                    media_type="application/vnd.apple.mpegurl", status_code=200)
+
+
+async def hls_part(fll_stream: Stream, name: str, part: int):
+    rendition = fll_stream.hls_rendition(int(re.search(stream_pattern, name).group(1)))
+    # preload hinted parts are held until they are available
+    if not await fastll_hls.wait_part(fll_stream, rendition, name, part):
+        return Response(status_code=404)
+    data = fastll_hls.part_data(fll_stream.segments[name], part)
+    if data is None:
+        return Response(status_code=404)
+    return fastll_hls.PartResponse(content=data, media_type="video/mp4", status_code=200)
+
+
+class Delivery:
+    """Accounting of a segment response: latency stats, trace timeline and viewer session"""
+    __slots__ = ("segment", "request_time", "latency", "viewer", "session")
+
+    def __init__(self, segment: Segment, request_time: float, latency: LatencyStats, viewer: list, session: Session):
+        self.segment = segment
+        self.request_time = request_time
+        self.latency = latency
+        self.viewer = viewer
+        self.session = session
+
+    def first_byte(self):
+        if self.latency is not None:
+            log_outgoing_latency(self.latency, self.segment, self.request_time)
+        if self.viewer is not None:
+            self.viewer[VIEWER_FIRST_BYTE] = time.time()
+
+    def sent(self, size: int):
+        if self.session is not None:
+            self.session.delivered_bytes = self.session.delivered_bytes + size
+
+    def finished(self):
+        if self.viewer is not None:
+            self.viewer[VIEWER_LAST_BYTE] = time.time()
+
+
+def log_outgoing_latency(latency: LatencyStats, segment: Segment, request_time: float):
+    # called when the first byte of the segment is about to be sent
+    if segment.arrival_time is not None:
+        latency.add(fastll_latency.REQUEST, request_time - segment.arrival_time)
+    prft = segment.prft()
+    if prft is not None:
+        latency.add(fastll_latency.FIRST_BYTE, time.time() - prft)
+
+
 def log_outgoing_chunk(name, found, wait, completed):
-    chunk_log_found = "--> {name} - found:{found}, completed:{completed}"
-    chunk_log_not_found = "--> {name} - found:{found}, wait:{wait}"
+    # messages are formatted by loguru only when the record is emitted
+    if not hot_path_log.sampled(fastll_log.OUTGOING_CHUNK):
+        return
     if found:
-        logger.debug(chunk_log_found.format(found='y', name=name, completed=completed))
+        logger.debug("--> {} - found:y, completed:{}", name, completed)
     else:
-        logger.debug(chunk_log_not_found.format(found='n', name=name, wait='{0:.2f}'.format(wait)))
+        logger.debug("--> {} - found:n, wait:{:.2f}", name, wait)
 
 
 @app.put("/{stream}/{name}", tags=["Incoming Object"],
          description="Handles incoming objects from the packaging tool (FFmpeg)")
 async def incoming_data(request: Request, stream: str, name: str):
+    return await process_incoming(stream, name, request.stream(), request.receive)
+
+
+class IncomingSegment:
+    """A chunked segment being received from FFmpeg. Chunks are appended synchronously, so the ingest listener
+    can append a batch of them in a single callback of the main event loop"""
+
+    def __init__(self, fll_stream: Stream, name: str):
+        self.fll_stream = fll_stream
+        self.name = name
+        self.segment: Segment = None
+        self.found = 'y'
+        self.hls_rendition = None
+        self.latency = None
+        self.coalesce_window = fll_stream.ingest_coalesce_ms / 1000
+        self.number_of_chunks = 0
+
+    async def open(self):
+        fll_stream = self.fll_stream
+        name = self.name
+        segment_number = int(re.search(segment_number_pattern, name).group(1))
+        fll_stream.current_segment = segment_number
+        # create or get incoming segment
+        if name not in fll_stream.segments:
+            self.found = 'n'
+            await fll_stream.segments_lock.acquire()
+            try:
+                incoming_segment = Segment(name, segment_storage(fll_stream))
+                if tracer is not None:
+                    incoming_segment.timeline = tracer.start(fll_stream.name, name)
+                fll_stream.segments[name] = incoming_segment
+            finally:
+                fll_stream.segments_lock.release()
+        else:
+            incoming_segment = fll_stream.segments[name]
+        self.segment = incoming_segment
+
+        # incoming segment has begun to arrive
+        incoming_segment.arrival_time = time.time()
+        incoming_segment.event.set()
+        if incoming_segment.timeline is not None:
+            incoming_segment.timeline.first_put = incoming_segment.arrival_time
+
+        representation = int(re.search(stream_pattern, name).group(1))
+        if fll_stream.ll_hls:
+            self.hls_rendition = fll_stream.hls_rendition(representation)
+            self.hls_rendition.add_segment(segment_number, incoming_segment)
+            self.hls_rendition.notify()
+        if fll_stream.latency_stats:
+            self.latency = fll_stream.representation_latency(representation)
+
+    def append(self, chunk: bytes):
+        """Raises SegmentStorageError when the chunk can't be stored"""
+        incoming_segment = self.segment
+        indexed_fragments = len(incoming_segment.index.fragments)
+        incoming_segment.append(chunk, self.coalesce_window)
+        self.number_of_chunks = self.number_of_chunks + 1
+        if len(incoming_segment.index.fragments) > indexed_fragments:
+            if self.hls_rendition is not None:
+                # wake blocked playlist and part requests
+                self.hls_rendition.notify()
+            if self.latency is not None:
+                log_ingest_latency(self.latency, incoming_segment, indexed_fragments)
+        if incoming_segment.timeline is not None:
+            incoming_segment.timeline.chunk(len(chunk))
+
+    def fail(self, error: SegmentStorageError):
+        logger.warning(f"Segment {self.name} can't be stored: {error}")
+        self.segment.complete()
+        return Response(status_code=507)
+
+    def complete(self):
+        incoming_segment = self.segment
+        incoming_segment.complete()
+        if self.fll_stream.recording is not None:
+            recorder.add(self.fll_stream.recording, self.name, incoming_segment.data())
+        if incoming_segment.timeline is not None:
+            incoming_segment.timeline.put_completed = time.time()
+        if self.hls_rendition is not None:
+            self.hls_rendition.notify()
+        log_incoming_chunk(self.name, self.found, self.number_of_chunks)
+        return Response(status_code=200)
+
+
+async def open_incoming_segment(stream: str, name: str):
+    """Starts receiving a chunked segment. Returns its IncomingSegment, or the response if it can't be received"""
+    if stream not in fll_streams:
+        logger.warning(f"Stream {stream} is no longer in the server")
+        return Response(status_code=404)
+    incoming = IncomingSegment(fll_streams[stream], name)
+    await incoming.open()
+    return incoming
+
+
+async def process_incoming(stream: str, name: str, body: AsyncIterator[bytes], receive):
+    """Processes an incoming object. Chunked segments are read from the body iterator, other objects from the
+    first message returned by receive"""
     try:
-        fll_stream: Stream = fll_streams[stream]
         if name.startswith("chunk"):
             # incoming chunk
-            segment_number = int(re.search(segment_number_pattern, name).group(1))
-            fll_stream.current_segment = segment_number
-            # create or get incoming segment
-            if name not in fll_stream.segments:
-                found = 'n'
-                await fll_stream.segments_lock.acquire()
-                try:
-                    incoming_segment = Segment(name)
-                    fll_stream.segments[name] = incoming_segment
-                finally:
-                    fll_stream.segments_lock.release()
-            else:
-                found = 'y'
-                incoming_segment = fll_stream.segments[name]
-
-            # incoming segment has begun to arrive
-            incoming_segment.event.set()
-
-            async for chunk in request.stream():
-                current_number_of_chunks = len(incoming_segment.chunks)
-                current_chunk = incoming_segment.chunks[current_number_of_chunks - 1]
-                # add next chunk to let request wait on the Event
-                incoming_segment.chunks.append(Chunk())
-                # add the current chunk data
-                current_chunk.data = chunk
-                incoming_segment.completed_data = incoming_segment.completed_data + chunk
-                # set the current chunk event
-                current_chunk.event.set()
-
-            incoming_segment.chunks[len(incoming_segment.chunks) - 1].event.set()
-            incoming_segment.completed = True
-            log_incoming_chunk(name, found, len(incoming_segment.chunks) - 1)
+            incoming = await open_incoming_segment(stream, name)
+            if isinstance(incoming, Response):
+                return incoming
+            try:
+                async for chunk in body:
+                    incoming.append(chunk)
+            except SegmentStorageError as e:
+                return incoming.fail(e)
+            return incoming.complete()
 
-        else:
-            # other type of objects can be read wholly
-            if name.startswith("manifest"):
-                req = await request.receive()
-                fll_stream.manifest.set_manifest(req["body"].decode())
-                logger.debug(f"Manifest: {name}")
-
-            if name.startswith("init"):
-                stream_id = int(re.search(stream_pattern, name).group(1))
-                # This sleep is required for some cameras not having an empty init segment
-                time.sleep(0.2)
-                req = await request.receive()
-
-                if "body" in req:
-                    logger.debug(f"Init segment: {name}")
-                    fll_stream.init_segments[stream_id].set_initial_segment(req["body"])
-                else:
-                    logger.warning("Init segment has no body!!!")
+        fll_stream: Stream = fll_streams[stream]
+        # other type of objects can be read wholly
+        if name.startswith("manifest"):
+            req = await receive()
+            fll_stream.manifest.set_manifest(req["body"].decode())
+            logger.debug(f"Manifest: {name}")
+
+        if name.startswith("init"):
+            stream_id = int(re.search(stream_pattern, name).group(1))
+            # This sleep is required for some cameras not having an empty init segment
+            await asyncio.sleep(0.2)
+            req = await receive()
+
+            if "body" in req:
+                logger.debug(f"Init segment: {name}")
+                fll_stream.init_segments[stream_id].set_initial_segment(req["body"])
+                if fll_stream.recording is not None:
+                    recorder.add(fll_stream.recording, name, req["body"])
+            else:
+                logger.warning("Init segment has no body!!!")
 
         response = Response(status_code=200)
         return response
@@ -456,9 +1146,16 @@ async def incoming_data(request: Request, stream: str, name: str):
         pass
 
 
+def log_ingest_latency(latency: LatencyStats, segment: Segment, first_fragment: int):
+    now = time.time()
+    for fragment in segment.index.fragments[first_fragment:]:
+        if fragment.prft is not None:
+            latency.add(fastll_latency.INGEST, now - fragment.prft)
+
+
 def log_incoming_chunk(name, found, number_of_chunks):
-    chunk_log_found = f"<-- {name} - f:{found}, c:{number_of_chunks}"
-    logger.debug(chunk_log_found.format(name=name, found=found, number_of_chunks=number_of_chunks))
+    if hot_path_log.sampled(fastll_log.INCOMING_CHUNK):
+        logger.debug("<-- {} - f:{}, c:{}", name, found, number_of_chunks)
 
 
 @app.delete("/{stream}/{name}", tags=["Object Removal"],
@@ -475,7 +1172,9 @@ async def delete_data(stream: str, name: str):
             return Response(status_code=200)
 
         if name.startswith("chunk"):
-            del (fll_stream.segments[name])
+            if tracer is not None:
+                tracer.finish(fll_stream.segments[name].timeline)
+            fll_stream.retire_segment(name)
             return Response(status_code=200)
 
     except KeyError:
@@ -484,6 +1183,12 @@ async def delete_data(stream: str, name: str):
     return Response(status_code=404)
 
 
+def segment_storage(fll_stream: Stream):
+    if fll_stream.storage is None:
+        fll_stream.storage = create_storage(fll_stream, fastll_conf.get("storageDir", DEFAULT_STORAGE_DIR))
+    return fll_stream.storage
+
+
 def update_access_time(fll_stream: Stream):
     fll_stream.last_access = datetime.timestamp(datetime.utcnow())
 
@@ -494,7 +1199,11 @@ async def start_ffmpeg(fll_stream: Stream):
         if fll_stream.ffmpeg_state.status < FfmpegStatus.STARTING:
             fll_stream.status = StreamStatus.STARTED
             fll_stream.ffmpeg_state.status = FfmpegStatus.STARTING
-            ffmpeg_command = ffmpeg_commands.ffmpeg_command(http_url, fll_stream)
+            if fll_stream.save_stats:
+                fll_stream.stats_writer = StatsWriter(fastll_conf.get("statsDir", DEFAULT_STATS_DIR), fll_stream.name)
+            if fll_stream.record:
+                fll_stream.recording = Recording(fastll_conf.get("recordDir", DEFAULT_RECORD_DIR), fll_stream.name)
+            ffmpeg_command = ffmpeg_commands.ffmpeg_command(http_url, fll_stream, ingest_url)
             logger.debug(f"FFmpeg command: {ffmpeg_command}")
             fll_stream.ffmpeg_state.pid = subprocess.Popen(ffmpeg_command)
             fll_stream.ffmpeg_state.status = FfmpegStatus.STARTED
@@ -502,15 +1211,23 @@ async def start_ffmpeg(fll_stream: Stream):
         ffmpeg_lock.release()
 
 
-async def generate_partial_segment(segment: Segment):
-    chunks = segment.chunks
-    aux = 0
-    while aux < len(chunks):
-        try:
-            await asyncio.wait_for(chunks[aux].event.wait(), 1)
-            data = chunks[aux].data
-            if data is not None:
-                yield data
-            aux = aux + 1
-        except asyncio.TimeoutError:
-            return
+async def generate_partial_segment(segment: Segment, offset: int = 0, delivery: Delivery = None):
+    # segment data is kept while there are readers
+    segment.acquire()
+    first_byte = True
+    try:
+        # data already received is sent at once from the offset, then as it arrives
+        async for data in segment.subscribe(offset):
+            if not isinstance(data, bytes):
+                # memory storage reads are views, streamed bodies must be bytes
+                data = bytes(data)
+            if delivery is not None:
+                if first_byte:
+                    delivery.first_byte()
+                    first_byte = False
+                delivery.sent(len(data))
+            yield data
+    finally:
+        segment.release()
+        if delivery is not None:
+            delivery.finished()
@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+
+from fastll_defaults import ADMISSION_STEER
+from fastll_session import Session, egress_totals
+from fastll_stream import Stream
+
+
+@dataclass
+class AdmissionLimits:
+    max_viewers: int = None
+    max_egress_kbps: int = None
+
+
+# limits of the whole server, stream limits are stream settings
+server_limits = AdmissionLimits()
+
+
+def egress_limited(stream: Stream):
+    return stream.max_egress_kbps is not None or server_limits.max_egress_kbps is not None
+
+
+def admit_viewer(stream: Stream):
+    """Whether a new viewer fits the stream and server viewer limits"""
+    stream.sessions.expire()
+    if stream.max_viewers is not None and stream.sessions.totals.viewers >= stream.max_viewers:
+        return False
+    if server_limits.max_viewers is not None and egress_totals.viewers >= server_limits.max_viewers:
+        return False
+    return True
+
+
+def fit_representation(stream: Stream, session: Session, representation: int):
+    """Highest representation, not above the requested one, whose bitrate fits the stream and server egress
+    budgets once the session's current commitment is released. None if not even the lowest one fits"""
+    for candidate in range(representation, -1, -1):
+        extra_kbps = stream.representation_kbps(candidate) - session.kbps
+        if stream.max_egress_kbps is not None and stream.sessions.totals.kbps + extra_kbps > stream.max_egress_kbps:
+            continue
+        if server_limits.max_egress_kbps is not None and \
+                egress_totals.kbps + extra_kbps > server_limits.max_egress_kbps:
+            continue
+        return candidate
+    return None
+
+
+def egress_representation(stream: Stream, session: Session, representation: int):
+    """Representation served to a viewer requesting one under the egress budgets, None if the viewer is rejected.
+
+    Budgets are applied when a viewer starts receiving the stream: a new viewer is rejected when the requested
+    representation doesn't fit, unless the steer policy can serve it a lower one. A viewer already being served
+    is never cut off. When the requested representation doesn't fit, it keeps its current one with server side
+    representation switching, or gets the requested one otherwise"""
+    allowed = fit_representation(stream, session, representation)
+    if allowed == representation:
+        return representation
+    switching = stream.server_side_streaming_switching
+    if allowed is not None and switching and stream.admission_policy == ADMISSION_STEER:
+        return allowed
+    if session.representation is None:
+        return None
+    if switching:
+        return session.representation
+    return representation
@@ -0,0 +1,23 @@
+import hmac
+import ipaddress
+from typing import Optional
+
+
+def admin_authorized(admin_token: Optional[str], authorization: Optional[str], client_host: Optional[str]) -> bool:
+    """Whether an administration request is allowed. With an admin token configured it must carry it as a bearer
+    token, without one only requests from the loopback interface are"""
+    if admin_token is None:
+        return is_loopback(client_host)
+    if authorization is None:
+        return False
+    # constant time, the token can't be guessed from response times
+    return hmac.compare_digest(authorization.encode(), f"Bearer {admin_token}".encode())
+
+
+def is_loopback(host: Optional[str]) -> bool:
+    if host is None:
+        return False
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
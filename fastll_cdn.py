@@ -0,0 +1,100 @@
+import gzip
+import zlib
+from email.utils import formatdate
+from typing import Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from fastll_defaults import CDN_MANIFEST_MAX_AGE, CDN_SEGMENT_MAX_AGE
+
+NO_STORE = "no-store"
+
+
+class CdnOrigin:
+    """Cache semantics for a CDN in front of the server, off by default"""
+
+    def __init__(self):
+        self.enabled = False
+        self.manifest_max_age = CDN_MANIFEST_MAX_AGE
+        self.segment_max_age = CDN_SEGMENT_MAX_AGE
+
+
+class CachedBody:
+    """A manifest as served, compressed once when it is first requested"""
+    __slots__ = ("data", "gzip_data", "etag", "gzip_etag", "last_modified")
+
+    def __init__(self, data, modified: float):
+        if isinstance(data, str):
+            data = data.encode()
+        self.data = data
+        self.gzip_data = gzip.compress(data)
+        self.etag = f'"{zlib.crc32(data):08x}"'
+        # strong validators differ between content codings
+        self.gzip_etag = f'"{zlib.crc32(data):08x}-gz"'
+        self.last_modified = formatdate(modified, usegmt=True)
+
+
+def manifest_body(manifest, ssss: bool) -> CachedBody:
+    body = manifest.bodies.get(ssss)
+    if body is None:
+        data = manifest.get_ssss_manifest() if ssss else manifest.get_manifest()
+        body = CachedBody(data, manifest.modified)
+        manifest.bodies[ssss] = body
+    return body
+
+
+def manifest_response(request: Request, body: CachedBody) -> Response:
+    compressed = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "Cache-Control": f"public, max-age={cdn_origin.manifest_max_age}",
+        "ETag": body.gzip_etag if compressed else body.etag,
+        "Last-Modified": body.last_modified,
+        "Vary": "Accept-Encoding",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    if compressed:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=body.gzip_data, media_type="text/plain;charset=UTF-8", headers=headers)
+    return Response(content=body.data, media_type="text/plain;charset=UTF-8", headers=headers)
+
+
+def object_headers(name: str, modified: float) -> Dict[str, str]:
+    """Headers of objects whose content never changes once they are available: init segments and segments,
+    also while they are still arriving, so the CDN collapses concurrent requests into one origin request"""
+    return {
+        "Cache-Control": f"public, max-age={cdn_origin.segment_max_age}, immutable",
+        "ETag": f'"{name}-{int(modified * 1000)}"',
+        "Last-Modified": formatdate(modified, usegmt=True),
+    }
+
+
+def not_modified(request: Request, headers: Optional[Dict[str, str]]):
+    return headers is not None and request.headers.get("if-none-match") == headers["ETag"]
+
+
+class CdnOriginMiddleware:
+    """Responses without cache headers are not stored by the CDN when the origin mode is enabled: errors,
+    playlists and objects served differently to each viewer"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not cdn_origin.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_no_store(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if "cache-control" not in headers:
+                    headers["Cache-Control"] = NO_STORE
+            await send(message)
+
+        await self.app(scope, receive, send_no_store)
+
+
+cdn_origin = CdnOrigin()
@@ -0,0 +1,85 @@
+import time
+from email.utils import formatdate
+from typing import Dict, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+from fastll_defaults import CLOCK_ANCHOR_INTERVAL
+
+UTC_TIMING_XSDATE = "http-xsdate"
+UTC_TIMING_ISO = "http-iso"
+UTC_TIMING_HEAD = "http-head"
+UTC_TIMING_SCHEMES = {
+    UTC_TIMING_XSDATE: "urn:mpeg:dash:utc:http-xsdate:2014",
+    UTC_TIMING_ISO: "urn:mpeg:dash:utc:http-iso:2014",
+    UTC_TIMING_HEAD: "urn:mpeg:dash:utc:http-head:2014",
+}
+
+
+class Clock:
+    """Wall clock served to players and FFmpeg.
+
+    Times come from the monotonic clock, anchored to the system clock every CLOCK_ANCHOR_INTERVAL seconds.
+    They are formatted once per millisecond (ISO) or second (HTTP date) for each displacement, however many
+    players poll them.
+    """
+
+    def __init__(self):
+        self._anchor()
+        self._iso: Dict[float, Tuple[int, str]] = {}
+        self._http_date: Dict[float, Tuple[int, str]] = {}
+
+    def _anchor(self):
+        self._wall = time.time()
+        self._monotonic = time.monotonic()
+
+    def now(self, displacement: float = 0) -> float:
+        monotonic = time.monotonic()
+        if monotonic - self._monotonic > CLOCK_ANCHOR_INTERVAL:
+            self._anchor()
+            monotonic = self._monotonic
+        return self._wall + monotonic - self._monotonic - displacement
+
+    def iso(self, displacement: float = 0) -> str:
+        milliseconds = int(self.now(displacement) * 1000)
+        cached = self._iso.get(displacement)
+        if cached is not None and cached[0] == milliseconds:
+            return cached[1]
+        seconds, milliseconds_part = divmod(milliseconds, 1000)
+        value = f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{milliseconds_part:03d}Z"
+        self._iso[displacement] = (milliseconds, value)
+        return value
+
+    def http_date(self, displacement: float = 0) -> str:
+        seconds = int(self.now(displacement))
+        cached = self._http_date.get(displacement)
+        if cached is not None and cached[0] == seconds:
+            return cached[1]
+        value = formatdate(seconds, usegmt=True)
+        self._http_date[displacement] = (seconds, value)
+        return value
+
+
+class DateMiddleware:
+    """Adds the Date header from the clock to responses without one. The server's own Date header is disabled,
+    as time responses for http-head clients carry their stream's displaced date instead"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_date(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if "date" not in headers:
+                    headers["Date"] = clock.http_date()
+            await send(message)
+
+        await self.app(scope, receive, send_date)
+
+
+clock = Clock()
@@ -0,0 +1,183 @@
+import struct
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_UNIX_OFFSET = 2208988800
+
+# sample_is_non_sync_sample bit of ISO-BMFF sample flags
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+BOX_HEADER_SIZE = 8
+BOX_LARGE_HEADER_SIZE = 16
+
+
+@dataclass
+class Fragment:
+    """A CMAF fragment (optional styp/prft boxes, moof and mdat) inside a segment"""
+    offset: int
+    end: int = None
+    keyframe: bool = False
+    prft: float = None
+    media_time: int = None
+
+    @property
+    def completed(self):
+        return self.end is not None
+
+
+@dataclass
+class CmafIndex:
+    """Incremental ISO-BMFF top level box parser.
+
+    It is fed with the growing segment data as chunks arrive, and indexes fragment boundaries,
+    prft wallclock timestamps and keyframe flags. Box payloads are read through memoryviews of the
+    segment data, so nothing is copied.
+    """
+    fragments: List[Fragment] = field(default_factory=list)
+    parsed: int = 0
+    _current: Fragment = None
+
+    def feed(self, data: bytes):
+        view = memoryview(data)
+        size = len(view)
+        while self.parsed + BOX_HEADER_SIZE <= size:
+            box_size, box_type = struct.unpack_from(">I4s", view, self.parsed)
+            header_size = BOX_HEADER_SIZE
+            if box_size == 1:
+                if self.parsed + BOX_LARGE_HEADER_SIZE > size:
+                    return
+                box_size = struct.unpack_from(">Q", view, self.parsed + BOX_HEADER_SIZE)[0]
+                header_size = BOX_LARGE_HEADER_SIZE
+            elif box_size == 0:
+                # box extends to the end of the segment, can't be indexed until it is completed
+                return
+            if box_size < header_size:
+                # corrupted data, stop indexing this segment
+                self.parsed = size
+                return
+            box_end = self.parsed + box_size
+            if box_end > size:
+                return
+
+            if self._current is None:
+                self._current = Fragment(self.parsed)
+            payload = view[self.parsed + header_size:box_end]
+            if box_type == b"prft":
+                self._current.prft = parse_prft(payload)
+            elif box_type == b"moof":
+                self._current.keyframe, self._current.media_time = parse_moof(payload)
+            elif box_type == b"mdat":
+                self._current.end = box_end
+                self.fragments.append(self._current)
+                self._current = None
+            self.parsed = box_end
+
+    def last_keyframe_offset(self):
+        """Offset of the last completed fragment starting with a keyframe, or 0"""
+        for fragment in reversed(self.fragments):
+            if fragment.keyframe:
+                return fragment.offset
+        return 0
+
+    def completed_end(self):
+        """Offset of the end of the last completed fragment"""
+        if len(self.fragments) > 0:
+            return self.fragments[-1].end
+        return 0
+
+    def last_prft(self) -> Optional[float]:
+        for fragment in reversed(self.fragments):
+            if fragment.prft is not None:
+                return fragment.prft
+        return None
+
+
+def iterate_boxes(view: memoryview):
+    position = 0
+    while position + BOX_HEADER_SIZE <= len(view):
+        box_size, box_type = struct.unpack_from(">I4s", view, position)
+        header_size = BOX_HEADER_SIZE
+        if box_size == 1:
+            box_size = struct.unpack_from(">Q", view, position + BOX_HEADER_SIZE)[0]
+            header_size = BOX_LARGE_HEADER_SIZE
+        elif box_size == 0:
+            box_size = len(view) - position
+        if box_size < header_size or position + box_size > len(view):
+            return
+        yield box_type, view[position + header_size:position + box_size]
+        position = position + box_size
+
+
+def parse_prft(payload: memoryview):
+    """Returns the prft NTP wallclock as a Unix timestamp"""
+    if len(payload) < 16:
+        return None
+    seconds, fraction = struct.unpack_from(">II", payload, 8)
+    return seconds - NTP_UNIX_OFFSET + fraction / 2 ** 32
+
+
+def parse_moof(payload: memoryview):
+    """Returns whether the first sample of the fragment is a sync sample and its decode time"""
+    keyframe = False
+    media_time = None
+    for box_type, box in iterate_boxes(payload):
+        if box_type != b"traf":
+            continue
+        default_flags = None
+        first_flags = None
+        for traf_type, traf_box in iterate_boxes(box):
+            if traf_type == b"tfhd" and len(traf_box) >= 8:
+                flags = struct.unpack_from(">I", traf_box, 0)[0] & 0xFFFFFF
+                position = 8
+                for flag, length in ((0x01, 8), (0x02, 4), (0x08, 4), (0x10, 4)):
+                    if flags & flag:
+                        position = position + length
+                if flags & 0x20 and position + 4 <= len(traf_box):
+                    default_flags = struct.unpack_from(">I", traf_box, position)[0]
+            elif traf_type == b"tfdt" and len(traf_box) >= 8:
+                version = traf_box[0]
+                if version == 1 and len(traf_box) >= 12:
+                    media_time = struct.unpack_from(">Q", traf_box, 4)[0]
+                else:
+                    media_time = struct.unpack_from(">I", traf_box, 4)[0]
+            elif traf_type == b"trun" and len(traf_box) >= 8:
+                flags = struct.unpack_from(">I", traf_box, 0)[0] & 0xFFFFFF
+                position = 8
+                if flags & 0x01:
+                    position = position + 4
+                if flags & 0x04 and position + 4 <= len(traf_box):
+                    first_flags = struct.unpack_from(">I", traf_box, position)[0]
+                elif flags & 0x400:
+                    if flags & 0x100:
+                        position = position + 4
+                    if flags & 0x200:
+                        position = position + 4
+                    if position + 4 <= len(traf_box):
+                        first_flags = struct.unpack_from(">I", traf_box, position)[0]
+        sample_flags = first_flags if first_flags is not None else default_flags
+        if sample_flags is not None and not sample_flags & SAMPLE_IS_NON_SYNC:
+            keyframe = True
+    return keyframe, media_time
+
+
+def parse_timescale(init_data: bytes):
+    """Returns the media timescale of the first track of an init segment"""
+    if init_data is None:
+        return None
+    for box_type, box in iterate_boxes(memoryview(init_data)):
+        if box_type != b"moov":
+            continue
+        for moov_type, moov_box in iterate_boxes(box):
+            if moov_type != b"trak":
+                continue
+            for trak_type, trak_box in iterate_boxes(moov_box):
+                if trak_type != b"mdia":
+                    continue
+                for mdia_type, mdia_box in iterate_boxes(trak_box):
+                    if mdia_type == b"mdhd" and len(mdia_box) >= 16:
+                        # version 1 uses 64 bit creation and modification times
+                        position = 20 if mdia_box[0] == 1 else 12
+                        if position + 4 <= len(mdia_box):
+                            return struct.unpack_from(">I", mdia_box, position)[0]
+    return None
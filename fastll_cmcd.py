@@ -0,0 +1,58 @@
+from fastll_defaults import CMCD_MIN_BUFFER_MS, CMCD_THROUGHPUT_MARGIN
+
+CMCD_QUERY_PARAMETER = "CMCD"
+CMCD_HEADERS = ("cmcd-request", "cmcd-object", "cmcd-status", "cmcd-session")
+
+
+class Cmcd:
+    """Last Common Media Client Data (CTA-5004) values sent by a client. Updated in place on every request"""
+    __slots__ = ("buffer_length", "measured_throughput", "bitrate", "playback_rate", "buffer_starvation")
+
+    def __init__(self):
+        self.buffer_length = None  # bl, milliseconds
+        self.measured_throughput = None  # mtp, kbps
+        self.bitrate = None  # br, kbps
+        self.playback_rate = 1.0  # pr
+        self.buffer_starvation = False  # bs
+
+    def update(self, data: str):
+        """Updates the values from a CMCD payload like 'bl=21300,br=3200,mtp=25400,pr=1.08'"""
+        self.buffer_starvation = False
+        for item in data.split(","):
+            key, _, value = item.strip().partition("=")
+            try:
+                if key == "bl":
+                    self.buffer_length = int(value)
+                elif key == "mtp":
+                    self.measured_throughput = int(value)
+                elif key == "br":
+                    self.bitrate = int(value)
+                elif key == "pr":
+                    self.playback_rate = float(value)
+                elif key == "bs":
+                    self.buffer_starvation = value != "false"
+            except ValueError:
+                pass
+
+
+def request_cmcd(query_params, headers):
+    """CMCD payload of a request from its query parameter or headers, None if it has none"""
+    data = query_params.get(CMCD_QUERY_PARAMETER)
+    if data is not None:
+        return data
+    values = [headers[header] for header in CMCD_HEADERS if header in headers]
+    if len(values) > 0:
+        return ",".join(values)
+    return None
+
+
+def cmcd_representation(stream, cmcd: Cmcd, representation: int):
+    """Caps a representation according to the client state: clients near a stall are down-switched and the
+    representation bitrate must fit the measured throughput at the current playback rate"""
+    if cmcd.buffer_starvation or (cmcd.buffer_length is not None and cmcd.buffer_length < CMCD_MIN_BUFFER_MS):
+        return 0
+    if cmcd.measured_throughput is not None:
+        available_kbps = cmcd.measured_throughput / (CMCD_THROUGHPUT_MARGIN * max(cmcd.playback_rate, 1.0))
+        while representation > 0 and stream.representation_kbps(representation) > available_kbps:
+            representation = representation - 1
+    return representation
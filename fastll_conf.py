@@ -1 +1,14 @@
+import json
+
+from loguru import logger
+
 fastll_conf = {}
+
+
+def read_streams(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        logger.error("Stream configuration file can't be read")
+        return None
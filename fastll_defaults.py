@@ -8,4 +8,51 @@ DEFAULT_INTRA_INTERVAL = "24"
 DEFAULT_TARGET_LATENCY = "0.5"
 DEFAULT_SERVER_SIDE_REPRESENTATION_SWITCHING = False
 DEFAULT_SAVE_STATS = False
-
+DEFAULT_FRAGMENT_JOIN = False
+DEFAULT_LL_HLS = False
+HLS_WINDOW_SEGMENTS = 6
+DEFAULT_LATENCY_STATS = False
+LATENCY_SAMPLES = 1000
+LATENCY_FILE_INTERVAL = 10  # seconds
+LATENCY_FILE_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_TRACE_SAMPLE_RATE = 1.0
+TRACE_FLUSH_INTERVAL = 5  # seconds
+TRACE_BUFFER_SIZE = 10000
+LOG_SUMMARY_INTERVAL = 10  # seconds
+DEFAULT_STATS_DIR = "stats"
+STATS_FLUSH_INTERVAL = 5  # seconds
+STATS_MAX_PENDING_ROWS = 100000
+STATS_JITTER_WINDOW = 10
+DEFAULT_SESSION_TIMEOUT = 10  # seconds
+ADMISSION_REJECT = "reject"
+ADMISSION_STEER = "steer"
+DEFAULT_ADMISSION_POLICY = ADMISSION_REJECT
+DEFAULT_CMCD = False
+CMCD_MIN_BUFFER_MS = 500
+CMCD_THROUGHPUT_MARGIN = 1.2
+DEFAULT_INGEST_HOST = "127.0.0.1"
+SEGMENT_GRACE_PERIOD = 5  # seconds
+PLACEHOLDER_MAX_AGE = 10  # seconds, longer than any request waits for a segment
+DEFAULT_STORAGE = "memory"
+DEFAULT_STORAGE_DIR = "storage"
+DEFAULT_STORAGE_SLOTS = 64
+DEFAULT_STORAGE_SLOT_SIZE = 1024 * 1024
+MMAP_INITIAL_SIZE = 256 * 1024
+DEFAULT_RECORD = False
+DEFAULT_RECORD_DIR = "recordings"
+VOD_OPEN_SESSIONS = 16
+LOOP_LAG_INTERVAL = 0.1  # seconds
+LOOP_LAG_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SLOW_CALLBACK_THRESHOLD = 0.1  # seconds
+SLOW_CALLBACK_RECORDS = 20
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds
+PROFILE_MAX_SECONDS = 60
+DEFAULT_CDN_ORIGIN = False
+CDN_MANIFEST_MAX_AGE = 1  # seconds
+CDN_SEGMENT_MAX_AGE = 60  # seconds
+DEFAULT_INGEST_COALESCE_MS = 0
+DEFAULT_WORKERS = 1
+DEFAULT_UTC_TIMING = "http-xsdate"
+CLOCK_ANCHOR_INTERVAL = 10  # seconds
+DEFAULT_HTTP2 = False
+WORKER_CHECK_INTERVAL = 0.5  # seconds
@@ -0,0 +1,172 @@
+import asyncio
+import math
+import time
+from datetime import datetime
+
+from starlette.responses import Response
+
+from fastll_cmaf import parse_timescale
+from fastll_stream import Stream, Segment, HlsRendition
+
+HLS_VERSION = 9
+# segments (counting from the live edge) whose parts are listed in media playlists
+HLS_PART_SEGMENTS = 3
+# blocking requests are held at most this number of target durations
+HLS_BLOCK_TARGET_DURATIONS = 3
+
+multivariant_playlist_name = "master.m3u8"
+media_playlist_name = "media-stream{rendition}.m3u8"
+init_segment_name = "init-stream{rendition}.m4s"
+segment_name = "chunk-stream{rendition}-{number:05d}.m4s"
+
+
+def multivariant_playlist(stream: Stream):
+    lines = ["#EXTM3U", f"#EXT-X-VERSION:{HLS_VERSION}", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for rendition_id, representation in sorted(stream.manifest.representations.items()):
+        attributes = [f"BANDWIDTH={representation.get('bandwidth', '0')}"]
+        if "codecs" in representation:
+            attributes.append(f"CODECS=\"{representation['codecs']}\"")
+        if "width" in representation and "height" in representation:
+            attributes.append(f"RESOLUTION={representation['width']}x{representation['height']}")
+        if "frameRate" in representation:
+            attributes.append(f"FRAME-RATE={frame_rate(representation['frameRate']):.3f}")
+        lines.append(f"#EXT-X-STREAM-INF:{','.join(attributes)}")
+        lines.append(media_playlist_name.format(rendition=rendition_id))
+    return "\n".join(lines) + "\n"
+
+
+def media_playlist(stream: Stream, rendition_id: int):
+    rendition = stream.hls_rendition(rendition_id)
+    if rendition.timescale is None and rendition_id in stream.init_segments:
+        rendition.timescale = parse_timescale(stream.init_segments[rendition_id].data)
+    target_duration = math.ceil(float(stream.segment_duration))
+    part_target = float(stream.fragment_duration)
+    segments = list(rendition.segments)
+
+    lines = ["#EXTM3U",
+             f"#EXT-X-VERSION:{HLS_VERSION}",
+             f"#EXT-X-TARGETDURATION:{target_duration}",
+             f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * part_target:.3f}",
+             f"#EXT-X-PART-INF:PART-TARGET={part_target:.3f}"]
+    if len(segments) > 0:
+        lines.append(f"#EXT-X-MEDIA-SEQUENCE:{segments[0][0]}")
+    lines.append(f"#EXT-X-MAP:URI=\"{init_segment_name.format(rendition=rendition_id)}\"")
+
+    for idx, (number, segment) in enumerate(segments):
+        name = segment_name.format(rendition=rendition_id, number=number)
+        fragments = segment.index.fragments
+        if len(fragments) > 0 and fragments[0].prft is not None:
+            program_date_time = datetime.utcfromtimestamp(fragments[0].prft)
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{program_date_time.isoformat(timespec='milliseconds')}Z")
+        next_start = None
+        if idx + 1 < len(segments) and segments[idx + 1][0] == number + 1:
+            next_start = first_media_time(segments[idx + 1][1])
+        durations = part_durations(segment, rendition.timescale, part_target, next_start)
+        if idx >= len(segments) - HLS_PART_SEGMENTS:
+            for part, fragment in enumerate(fragments):
+                independent = ",INDEPENDENT=YES" if fragment.keyframe else ""
+                lines.append(f"#EXT-X-PART:DURATION={durations[part]:.3f},URI=\"{name}?part={part}\"{independent}")
+        if segment.completed:
+            # the configured duration when decode times are unknown
+            duration = float(stream.segment_duration)
+            if rendition.timescale and len(durations) > 0:
+                duration = sum(durations)
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(name)
+        else:
+            lines.append(f"#EXT-X-PRELOAD-HINT:TYPE=PART,URI=\"{name}?part={len(fragments)}\"")
+            break
+    else:
+        if len(segments) > 0:
+            name = segment_name.format(rendition=rendition_id, number=segments[-1][0] + 1)
+            lines.append(f"#EXT-X-PRELOAD-HINT:TYPE=PART,URI=\"{name}?part=0\"")
+    return "\n".join(lines) + "\n"
+
+
+def part_durations(segment: Segment, timescale: int, part_target: float, next_start: int = None):
+    """Durations of the parts of a segment from their decode times. The last one ends where the next segment
+    starts, when it is known, and parts whose end is unknown last part_target"""
+    fragments = segment.index.fragments
+    durations = [part_target] * len(fragments)
+    if timescale:
+        ends = [fragment.media_time for fragment in fragments[1:]] + [next_start]
+        for idx, fragment in enumerate(fragments):
+            start = fragment.media_time
+            end = ends[idx]
+            if start is not None and end is not None and end > start:
+                durations[idx] = (end - start) / timescale
+    return durations
+
+
+def first_media_time(segment: Segment):
+    fragments = segment.index.fragments
+    if len(fragments) > 0:
+        return fragments[0].media_time
+    return None
+
+
+def frame_rate(value: str):
+    if "/" in value:
+        numerator, denominator = value.split("/", 1)
+        return int(numerator) / int(denominator)
+    return float(value)
+
+
+def block_timeout(stream: Stream):
+    return HLS_BLOCK_TARGET_DURATIONS * math.ceil(float(stream.segment_duration))
+
+
+def media_sequence_available(rendition: HlsRendition, msn: int, part: int = None):
+    """Whether the playlist already contains media sequence number msn (and its part)"""
+    if len(rendition.segments) == 0:
+        return False
+    last_number, last_segment = rendition.segments[-1]
+    if last_number > msn:
+        return True
+    if last_number < msn:
+        return False
+    if part is None:
+        return last_segment.completed
+    return last_segment.completed or len(last_segment.index.fragments) > part
+
+
+async def wait_rendition(rendition: HlsRendition, available, timeout: float):
+    """Holds a blocking request until available() is true. Returns False on timeout.
+
+    All blocked requests share the rendition update event, so each fragment arrival wakes every
+    waiter once and no per request polling is needed.
+    """
+    deadline = time.monotonic() + timeout
+    while not available():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        try:
+            await asyncio.wait_for(rendition.updated.wait(), remaining)
+        except asyncio.TimeoutError:
+            return False
+    return True
+
+
+async def wait_part(stream: Stream, rendition: HlsRendition, name: str, part: int):
+    def available():
+        segment = stream.segments.get(name)
+        return segment is not None and (segment.completed or len(segment.index.fragments) > part)
+
+    return await wait_rendition(rendition, available, block_timeout(stream))
+
+
+def part_data(segment: Segment, part: int):
+    """Part data is read from the segment storage, with memory storage it is a view and not a copy"""
+    fragments = segment.index.fragments
+    if part >= len(fragments):
+        return None
+    fragment = fragments[part]
+    return segment.data(fragment.offset, fragment.end)
+
+
+class PartResponse(Response):
+    """Response whose body can be a memoryview of the segment data, so parts are sent without copies"""
+
+    def render(self, content) -> memoryview:
+        return content
@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import threading
+from collections import deque
+
+from fastapi import FastAPI, Request, Response
+from loguru import logger
+from starlette.requests import ClientDisconnect
+from uvicorn import Config, Server
+
+from fastll_storage import SegmentStorageError
+
+# Ingest listener: FFmpeg requests are read and parsed by their own event loop in a separate thread, away from
+# viewer connections. Streams are owned by the main event loop, so chunks are appended there, but without a task
+# wakeup per chunk queued behind viewer work: chunks read from every ingest connection are batched and appended
+# by a single main loop callback, within one loop iteration of being read.
+
+ingest_app = FastAPI(title="Fastll ingest")
+
+_main_loop: asyncio.AbstractEventLoop = None
+_process_incoming = None
+_open_incoming_segment = None
+_delete_data = None
+
+
+class IngestRequest:
+    """A chunked segment PUT. done holds its response once the main event loop has answered it"""
+
+    def __init__(self, incoming):
+        self.incoming = incoming
+        self.done = concurrent.futures.Future()
+
+
+class IngestQueue:
+    """Chunks read by the ingest event loop, appended in batches by the main event loop"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.scheduled = False
+
+    def put(self, request: IngestRequest, chunk):
+        """Queues a chunk of a request, None when its body has ended. Called from the ingest event loop"""
+        with self.lock:
+            self.pending.append((request, chunk))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        _main_loop.call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        # main event loop
+        with self.lock:
+            pending = self.pending
+            self.pending = deque()
+            self.scheduled = False
+        for request, chunk in pending:
+            if request.done.done():
+                # already answered, the rest of its body is discarded
+                continue
+            try:
+                if chunk is None:
+                    request.done.set_result(request.incoming.complete())
+                else:
+                    request.incoming.append(chunk)
+            except SegmentStorageError as e:
+                request.done.set_result(request.incoming.fail(e))
+            except Exception as e:
+                request.done.set_exception(e)
+
+
+ingest_queue = IngestQueue()
+
+
+def on_main_loop(coroutine):
+    return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, _main_loop))
+
+
+@ingest_app.put("/{stream}/{name}")
+async def ingest_incoming_data(request: Request, stream: str, name: str):
+    if name.startswith("chunk"):
+        incoming = await on_main_loop(_open_incoming_segment(stream, name))
+        if isinstance(incoming, Response):
+            # not received, the body is not read
+            return incoming
+        ingest_request = IngestRequest(incoming)
+        try:
+            async for chunk in request.stream():
+                if ingest_request.done.done():
+                    # answered before the body ended, i.e. it can't be stored
+                    break
+                ingest_queue.put(ingest_request, chunk)
+            else:
+                ingest_queue.put(ingest_request, None)
+        except ClientDisconnect:
+            return None
+        return await asyncio.wrap_future(ingest_request.done)
+
+    # other type of objects are forwarded wholly
+    body = b"".join([chunk async for chunk in request.stream()])
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return await on_main_loop(_process_incoming(stream, name, None, receive))
+
+
+@ingest_app.delete("/{stream}/{name}")
+async def ingest_delete_data(stream: str, name: str):
+    return await on_main_loop(_delete_data(stream, name))
+
+
+def start_ingest_server(host: str, port: int, main_loop: asyncio.AbstractEventLoop, process_incoming,
+                        open_incoming_segment, delete_data):
+    global _main_loop
+    global _process_incoming
+    global _open_incoming_segment
+    global _delete_data
+    _main_loop = main_loop
+    _process_incoming = process_incoming
+    _open_incoming_segment = open_incoming_segment
+    _delete_data = delete_data
+
+    server = Server(Config(ingest_app, host=host, port=port, lifespan="off", access_log=False))
+    # signals are handled by the main server
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, name="fastll-ingest", daemon=True)
+    thread.start()
+    logger.debug(f"Ingest listener on {host}:{port}")
+    return server
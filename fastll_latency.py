@@ -0,0 +1,65 @@
+import json
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict
+
+from fastll_defaults import LATENCY_SAMPLES, LATENCY_FILE_MAX_BYTES
+
+# encoder (prft wallclock) to fragment arrival at the origin
+INGEST = "ingest"
+# segment arrival at the origin to client request, negative when the request arrived first
+REQUEST = "request"
+# encoder (prft wallclock) to first byte sent to the client
+FIRST_BYTE = "first_byte"
+
+METRICS = (INGEST, REQUEST, FIRST_BYTE)
+
+
+@dataclass
+class LatencyStats:
+    """Rolling latency samples (seconds) of a stream representation"""
+    samples: Dict[str, Deque[float]] = field(
+        default_factory=lambda: {metric: deque(maxlen=LATENCY_SAMPLES) for metric in METRICS})
+
+    def add(self, metric: str, value: float):
+        self.samples[metric].append(value)
+
+    def summary(self):
+        return {metric: distribution(values) for metric, values in self.samples.items()}
+
+
+def distribution(values):
+    count = len(values)
+    if count == 0:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": count,
+        "min": ordered[0],
+        "p50": ordered[int(0.5 * (count - 1))],
+        "p90": ordered[int(0.9 * (count - 1))],
+        "p99": ordered[int(0.99 * (count - 1))],
+        "max": ordered[-1],
+        "mean": sum(ordered) / count,
+    }
+
+
+def write_latency_file(path: str, line: str):
+    """Appends a JSON line to path, rolling it over to path.1 when it exceeds the maximum size.
+    Blocking, must run in an executor."""
+    try:
+        if os.path.getsize(path) > LATENCY_FILE_MAX_BYTES:
+            os.replace(path, path + ".1")
+    except FileNotFoundError:
+        pass
+    with open(path, "a") as latency_file:
+        latency_file.write(line + "\n")
+
+
+def latency_line(timestamp: float, stream: str, latency: Dict[int, LatencyStats]):
+    return json.dumps({
+        "timestamp": timestamp,
+        "stream": stream,
+        "representations": {representation: stats.summary() for representation, stats in latency.items()}
+    })
@@ -0,0 +1,42 @@
+from typing import Dict
+
+# hot path event types
+OUTGOING_CHUNK = "outgoing_chunk"
+INCOMING_CHUNK = "incoming_chunk"
+SSRS = "ssrs"
+CLIENT_STATS = "client_stats"
+
+
+class HotPathLog:
+    """Per event type sampling and counting of hot path log records.
+
+    Every event is counted, but only one every N events of each type is logged. Counts are aggregated
+    and reported periodically, so diagnostics can stay on without logging every chunk.
+    """
+
+    def __init__(self):
+        self.sampling: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.reported: Dict[str, int] = {}
+
+    def configure(self, sampling: Dict[str, int]):
+        for event, every in sampling.items():
+            if not isinstance(every, int) or every < 0:
+                raise ValueError(f"Log sampling of {event} must be a non negative integer")
+        self.sampling = dict(sampling)
+
+    def sampled(self, event: str):
+        count = self.counts.get(event, 0) + 1
+        self.counts[event] = count
+        every = self.sampling.get(event, 1)
+        # events sampled with 0 are counted but never logged
+        return every > 0 and count % every == 0
+
+    def take_counts(self):
+        """Number of events of each type since the last call"""
+        counts = {event: count - self.reported.get(event, 0) for event, count in self.counts.items()}
+        self.reported = dict(self.counts)
+        return counts
+
+
+hot_path_log = HotPathLog()
@@ -0,0 +1,115 @@
+import asyncio
+import bisect
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from loguru import logger
+
+from fastll_defaults import LOOP_LAG_INTERVAL, LOOP_LAG_BUCKETS_MS, SLOW_CALLBACK_THRESHOLD, SLOW_CALLBACK_RECORDS, \
+    PROFILE_SAMPLE_INTERVAL
+
+
+class LoopMonitor:
+    """Event loop lag histogram and slow callback detection.
+
+    A task measures how late the loop wakes it up. A watchdog thread checks that the task keeps running and,
+    when the loop is blocked for longer than SLOW_CALLBACK_THRESHOLD, records the stack of the blocking call.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LOOP_LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls = deque(maxlen=SLOW_CALLBACK_RECORDS)
+        self.loop_thread = None
+        self._heartbeat = None
+
+    def start(self):
+        # called from the event loop thread, lag is measured from now on
+        self.loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        asyncio.create_task(self._sample())
+        threading.Thread(target=self._watch, name="fastll-watchdog", daemon=True).start()
+
+    async def _sample(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.add(now - start - LOOP_LAG_INTERVAL)
+
+    def add(self, lag: float):
+        lag = max(lag, 0.0)
+        self.counts[bisect.bisect_left(LOOP_LAG_BUCKETS_MS, lag * 1000)] += 1
+        self.samples = self.samples + 1
+        self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(SLOW_CALLBACK_THRESHOLD / 2)
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - LOOP_LAG_INTERVAL
+            if blocked < SLOW_CALLBACK_THRESHOLD or heartbeat == reported:
+                continue
+            # one record for every stall
+            reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            self.stalls.append({"time": time.time(), "blocked_ms": round(blocked * 1000), "stack": stack})
+            logger.warning("Event loop blocked for {} ms at {}", round(blocked * 1000), stack[-1].strip())
+
+    def summary(self):
+        buckets = {f"<={bucket}ms": count for bucket, count in zip(LOOP_LAG_BUCKETS_MS, self.counts)}
+        buckets[f">{LOOP_LAG_BUCKETS_MS[-1]}ms"] = self.counts[-1]
+        return {
+            "samples": self.samples,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "lag_histogram": buckets,
+            "slow_callbacks": list(self.stalls),
+        }
+
+
+class Profiler:
+    """Sampling profiler of the event loop thread. Stacks are returned in collapsed format (one line per
+    stack with its number of samples), as used by flame graph tools"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def profile(self, thread_id: int, seconds: float):
+        """Samples the thread for some seconds, None if a profile is already running. Blocks, it is meant to
+        run in a worker thread"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            samples = Counter()
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    samples[collapse_stack(frame)] += 1
+                time.sleep(PROFILE_SAMPLE_INTERVAL)
+            return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+        finally:
+            self._lock.release()
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+loop_monitor = LoopMonitor()
+profiler = Profiler()
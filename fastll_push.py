@@ -0,0 +1,17 @@
+import struct
+
+# Push channel: a long lived response carrying the init segment and then consecutive segments of a viewer as
+# their chunks arrive. Objects are sent in frames: name length (2 bytes), data length (4 bytes), name and data,
+# all big endian. A frame without data ends its object.
+
+MEDIA_TYPE = "application/vnd.fastll.push"
+FRAME_HEADER = struct.Struct("!HI")
+
+
+def frame_header(name: str, size: int) -> bytes:
+    encoded_name = name.encode()
+    return FRAME_HEADER.pack(len(encoded_name), size) + encoded_name
+
+
+def end_frame(name: str) -> bytes:
+    return frame_header(name, 0)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import mmap
+import os
+import queue
+import re
+import threading
+import xml.etree.ElementTree as eT
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from starlette.responses import Response
+
+from fastll_defaults import VOD_OPEN_SESSIONS
+
+DATA_FILE = "media.dat"
+INDEX_FILE = "index.jsonl"
+MANIFEST_NAME = "manifest.mpd"
+
+MPD_NAMESPACE = "urn:mpeg:dash:schema:mpd:2011"
+# elements that only make sense for live presentations
+LIVE_ELEMENTS = ("UTCTiming", "ServiceDescription", "ProducerReferenceTime")
+LIVE_ATTRIBUTES = ("minimumUpdatePeriod", "timeShiftBufferDepth", "suggestedPresentationDelay",
+                   "availabilityStartTime")
+
+number_pattern = re.compile(r"-(\d+)\.m4s$")
+name_pattern = re.compile(r"^[\w-]+(\.[\w]+)?$")
+
+
+class Recording:
+    """A recorded stream session. Objects are appended to one data file and their positions to an index
+    file. When the stream stops a static version of its last manifest is appended too"""
+
+    def __init__(self, record_dir: str, stream: str):
+        session = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self.path = os.path.join(record_dir, stream, session)
+
+
+class _RecordingFiles:
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.data = open(os.path.join(path, DATA_FILE), "ab")
+        self.index = open(os.path.join(path, INDEX_FILE), "a")
+        self.offset = self.data.tell()
+        # first and last segment numbers recorded
+        self.numbers: Optional[Tuple[int, int]] = None
+
+    def write(self, objects: List[Tuple[str, bytes]]):
+        lines = []
+        for name, data in objects:
+            lines.append(json.dumps({"name": name, "offset": self.offset, "size": len(data)}) + "\n")
+            self.offset = self.offset + len(data)
+            number = number_pattern.search(name)
+            if number is not None and name.startswith("chunk"):
+                number = int(number.group(1))
+                if self.numbers is None:
+                    self.numbers = (number, number)
+                else:
+                    self.numbers = (min(self.numbers[0], number), max(self.numbers[1], number))
+        # one write for every object of the batch
+        self.data.writelines(data for _, data in objects)
+        self.data.flush()
+        self.index.writelines(lines)
+        self.index.flush()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class Recorder:
+    """Worker thread appending recorded objects in bulk, so ingest never waits on files"""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def add(self, recording: Recording, name: str, data: bytes):
+        self._put((recording.path, name, data))
+
+    def finish(self, recording: Recording, manifest: Optional[str]):
+        """Closes a recording, the manifest is converted to a static one by the worker thread"""
+        self._put((recording.path, None, manifest))
+
+    def _put(self, item):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fastll-recorder", daemon=True)
+            self._thread.start()
+        self._queue.put(item)
+
+    def _run(self):
+        files: Dict[str, _RecordingFiles] = {}
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            pending: Dict[str, List[Tuple[str, bytes]]] = {}
+            for path, name, data in items:
+                try:
+                    if path not in files:
+                        files[path] = _RecordingFiles(path)
+                    if name is not None:
+                        pending.setdefault(path, []).append((name, data))
+                        continue
+                    recording_files = files.pop(path)
+                    recording_files.write(pending.pop(path, []))
+                    if data is not None and recording_files.numbers is not None:
+                        manifest = static_manifest(data, *recording_files.numbers)
+                        if manifest is not None:
+                            recording_files.write([(MANIFEST_NAME, manifest)])
+                    recording_files.close()
+                except OSError as e:
+                    logger.warning(f"Recording {path} can't be written: {e}")
+            for path, objects in pending.items():
+                try:
+                    files[path].write(objects)
+                except OSError as e:
+                    logger.warning(f"Recording {path} can't be written: {e}")
+
+
+def static_manifest(manifest: str, first_number: int, last_number: int) -> Optional[bytes]:
+    """Static MPD of the recorded segments from the last live MPD"""
+    eT.register_namespace("", MPD_NAMESPACE)
+    try:
+        root = eT.fromstring(manifest)
+    except eT.ParseError as e:
+        logger.warning(f"Manifest can't be parsed for recording: {e}")
+        return None
+    ns = {"mpd": MPD_NAMESPACE}
+
+    root.set("type", "static")
+    for attribute in LIVE_ATTRIBUTES:
+        root.attrib.pop(attribute, None)
+    for parent in root.iter():
+        for child in list(parent):
+            if child.tag.split("}")[-1] in LIVE_ELEMENTS:
+                parent.remove(child)
+
+    duration = 0
+    for template in root.iterfind(".//mpd:SegmentTemplate", ns):
+        timescale = int(template.get("timescale", "1"))
+        segment_duration = int(template.get("duration", "0"))
+        start_number = int(template.get("startNumber", "1"))
+        # segments keep their media times, the presentation starts at the first recorded one
+        template.set("startNumber", str(first_number))
+        template.set("presentationTimeOffset", str((first_number - start_number) * segment_duration))
+        template.attrib.pop("availabilityTimeOffset", None)
+        template.attrib.pop("availabilityTimeComplete", None)
+        duration = max(duration, (last_number - first_number + 1) * segment_duration / timescale)
+    for period in root.iterfind("mpd:Period", ns):
+        period.set("start", "PT0S")
+    root.set("mediaPresentationDuration", f"PT{duration:.3f}S")
+    return eT.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+class VodSession:
+    """A finished recording served from a read only memory mapping of its data file"""
+
+    def __init__(self, path: str):
+        self.objects: Dict[str, Tuple[int, int]] = {}
+        with open(os.path.join(path, INDEX_FILE)) as index_file:
+            for line in index_file:
+                entry = json.loads(line)
+                self.objects[entry["name"]] = (entry["offset"], entry["size"])
+        with open(os.path.join(path, DATA_FILE), "rb") as data_file:
+            self.data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, name: str) -> Optional[memoryview]:
+        if name not in self.objects:
+            return None
+        offset, size = self.objects[name]
+        return memoryview(self.data)[offset:offset + size]
+
+
+class VodLibrary:
+    """Recorded sessions, the most recently used ones are kept open"""
+
+    def __init__(self):
+        self.record_dir = None
+        self.sessions: OrderedDict = OrderedDict()
+
+    def configure(self, record_dir: str):
+        self.record_dir = record_dir
+
+    def recordings(self, stream: str) -> List[str]:
+        """Recorded sessions of a stream, the ones still being recorded have no manifest yet"""
+        if not valid_name(stream):
+            return []
+        path = os.path.join(self.record_dir, stream)
+        try:
+            sessions = sorted(os.listdir(path))
+        except OSError:
+            return []
+        return [i for i in sessions if os.path.exists(os.path.join(path, i, INDEX_FILE))]
+
+    async def session(self, stream: str, session: str) -> Optional[VodSession]:
+        key = (stream, session)
+        vod_session = self.sessions.get(key)
+        if vod_session is not None:
+            self.sessions.move_to_end(key)
+            return vod_session
+        if not valid_name(stream) or not valid_name(session):
+            return None
+        try:
+            # the index is read by a worker thread
+            vod_session = await asyncio.get_running_loop().run_in_executor(
+                None, VodSession, os.path.join(self.record_dir, stream, session))
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug(f"Recording {stream}/{session} can't be opened: {e}")
+            return None
+        if MANIFEST_NAME not in vod_session.objects:
+            # still being recorded
+            return None
+        if key in self.sessions:
+            # opened by another request meanwhile
+            return self.sessions[key]
+        self.sessions[key] = vod_session
+        if len(self.sessions) > VOD_OPEN_SESSIONS:
+            # the mapping is released when responses still sending from it are done
+            self.sessions.popitem(last=False)
+        return vod_session
+
+
+def valid_name(name: str):
+    return name_pattern.match(name) is not None
+
+
+class VodResponse(Response):
+    """Response whose body is a memoryview of the recording mapping, so objects are sent without copies"""
+
+    def render(self, content) -> memoryview:
+        return content
+
+
+recorder = Recorder()
+vod_library = VodLibrary()
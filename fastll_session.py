@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+
+from fastll_stats import ClientStats
+
+
+class Session:
+    """A viewer of a stream, identified by the client id of its request paths"""
+    __slots__ = ("client", "deadline", "last_segment", "delivered_bytes", "representation", "kbps", "cmcd",
+                 "stats")
+
+    def __init__(self, client: str):
+        self.client = client
+        self.deadline = 0.0
+        self.last_segment = None
+        self.delivered_bytes = 0
+        self.representation = None
+        self.kbps = 0
+        self.cmcd = None
+        self.stats = None
+
+
+class EgressTotals:
+    """Live viewers and committed egress bitrate (bitrate of the representation each viewer receives)"""
+    __slots__ = ("viewers", "kbps")
+
+    def __init__(self):
+        self.viewers = 0
+        self.kbps = 0
+
+    def add(self, viewers: int, kbps: int):
+        self.viewers = self.viewers + viewers
+        self.kbps = self.kbps + kbps
+
+
+class SessionTable:
+    """Sessions of a stream ordered by expiry deadline.
+
+    Touching a session moves it to the end, so expired sessions are always at the beginning and expiring
+    them costs nothing for the sessions that are still alive.
+    """
+
+    def __init__(self, timeout: float, save_stats: bool = False, server_totals: EgressTotals = None):
+        self.timeout = timeout
+        self.save_stats = save_stats
+        self.sessions = OrderedDict()
+        self.totals = EgressTotals()
+        self.server_totals = server_totals if server_totals is not None else egress_totals
+
+    def touch(self, client: str) -> Session:
+        now = time.monotonic()
+        self.expire(now)
+        session = self.sessions.get(client)
+        if session is None:
+            session = Session(client)
+            if self.save_stats:
+                session.stats = ClientStats()
+            self.sessions[client] = session
+            self._account(1, 0)
+        else:
+            self.sessions.move_to_end(client)
+        session.deadline = now + self.timeout
+        return session
+
+    def expire(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        sessions = self.sessions
+        while len(sessions) > 0:
+            client, session = next(iter(sessions.items()))
+            if session.deadline > now:
+                return
+            del sessions[client]
+            self._account(-1, -session.kbps)
+
+    def clear(self):
+        self._account(-len(self.sessions), -self.totals.kbps)
+        self.sessions = OrderedDict()
+
+    def set_representation(self, session: Session, representation: int, kbps: int):
+        self._account(0, kbps - session.kbps)
+        session.representation = representation
+        session.kbps = kbps
+
+    def _account(self, viewers: int, kbps: int):
+        self.totals.add(viewers, kbps)
+        self.server_totals.add(viewers, kbps)
+
+    def viewers(self):
+        """Number of live sessions"""
+        return len(self.sessions)
+
+    def get(self, client: str):
+        return self.sessions.get(client)
+
+    def summary(self):
+        self.expire()
+        return {
+            "viewers": len(self.sessions),
+            "egress_kbps": self.totals.kbps,
+            "delivered_bytes": sum(session.delivered_bytes for session in self.sessions.values()),
+        }
+
+
+# totals of every stream in the server
+egress_totals = EgressTotals()
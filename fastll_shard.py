@@ -0,0 +1,220 @@
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from typing import List, Optional
+from urllib.parse import parse_qs
+
+from loguru import logger
+from starlette.responses import JSONResponse, RedirectResponse, Response
+
+from fastll_auth import admin_authorized
+from fastll_conf import read_streams
+from fastll_defaults import WORKER_CHECK_INTERVAL
+from fastll_version import VERSION
+
+# Sharded mode: several worker processes, each one owning the streams assigned to it by hashing their names.
+# The front router redirects requests to the worker owning their stream. Manifests use relative URLs, so
+# players request the rest of the stream objects from that worker directly.
+
+# paths whose second component is the stream, the rest have it as first component
+STREAM_PREFIXES = ("ssss", "sessions", "latency", "vod", "isotime", "push")
+# diagnostics of the event loop of one worker, chosen with the worker query parameter
+WORKER_PATHS = ("/admin/loop", "/admin/profile")
+
+
+def stream_owner(stream: str, workers: int) -> int:
+    """Index of the worker owning a stream. The same in every process and run, unlike hash()"""
+    return zlib.crc32(stream.encode()) % workers
+
+
+def owned_streams(streams: List[dict], worker: Optional[int], workers: int) -> List[dict]:
+    if worker is None or workers <= 1:
+        return streams
+    return [i for i in streams if stream_owner(i["stream"], workers) == worker]
+
+
+def worker_port(port: int, worker: int) -> int:
+    return port + 1 + worker
+
+
+def worker_file(path: Optional[str], worker: int) -> Optional[str]:
+    """Per worker version of a file written by every worker"""
+    if path is None:
+        return None
+    root, extension = os.path.splitext(path)
+    return f"{root}-{worker}{extension}"
+
+
+def path_stream(path: str) -> Optional[str]:
+    components = path.strip("/").split("/")
+    if len(components) >= 2 and components[0] in STREAM_PREFIXES:
+        return components[1]
+    if len(components) >= 3 and components[0] == "admin" and components[1] == "streams":
+        return components[2]
+    if len(components) == 2 and components[0] != "admin":
+        # stream objects, optionally with the viewer id: {stream}-{client}/{name}
+        return components[0].split("-")[0]
+    return None
+
+
+class ShardRouter:
+    """Front router of the sharded mode. Requests of a stream are redirected to the worker owning it, event loop
+    diagnostics to the worker in their worker query parameter (the first one by default) and any other request to
+    the first available worker. While a worker is not available, its requests are answered with 503 status code.
+    The configuration and version are answered by the router, and reloads are sent to every worker.
+
+    The supervisor runs the workers: available(worker) tells whether a worker is running and done with its
+    startup, reload() sends a reload to every available worker and streams() returns the configured streams."""
+
+    def __init__(self, host: str, port: int, https: bool, workers: int, admin_token: Optional[str], supervisor):
+        self.host = host
+        self.port = port
+        self.scheme = "https" if https else "http"
+        self.workers = workers
+        self.admin_token = admin_token
+        self.supervisor = supervisor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        path = scope["path"]
+        if path == "/admin/reload" and scope["method"] == "POST":
+            response = self.reload_workers(scope)
+        elif path == "/conf":
+            # every worker only knows its own streams
+            response = JSONResponse(content=self.supervisor.streams())
+        elif path in ("/", "/version"):
+            response = Response(content=VERSION, media_type="text/plain;charset=UTF-8", status_code=200)
+        else:
+            worker = self.request_worker(scope)
+            if worker is None:
+                response = Response(status_code=404)
+            elif not self.supervisor.available(worker):
+                # restarting, players retry
+                response = Response(status_code=503, headers={"Retry-After": "1"})
+            else:
+                url = f"{self.scheme}://{self.request_host(scope)}:{worker_port(self.port, worker)}{path}"
+                if scope["query_string"]:
+                    url = f"{url}?{scope['query_string'].decode('latin-1')}"
+                # 307 keeps the method and body of the request
+                response = RedirectResponse(url, status_code=307)
+        await response(scope, receive, send)
+
+    def request_worker(self, scope) -> Optional[int]:
+        """Worker a request goes to, None if it names a worker that doesn't exist"""
+        path = scope["path"]
+        stream = path_stream(path)
+        if stream:
+            return stream_owner(stream, self.workers)
+        if path in WORKER_PATHS:
+            query = parse_qs(scope["query_string"].decode("latin-1"))
+            try:
+                worker = int(query.get("worker", ["0"])[0])
+            except ValueError:
+                return None
+            return worker if 0 <= worker < self.workers else None
+        return next((i for i in range(self.workers) if self.supervisor.available(i)), 0)
+
+    def request_host(self, scope) -> str:
+        # the address clients used to reach the router, without its port
+        for key, value in scope["headers"]:
+            if key == b"host":
+                host = value.decode("latin-1")
+                if host.startswith("["):
+                    return host[:host.index("]") + 1]
+                return host.split(":")[0]
+        return self.host
+
+    def reload_workers(self, scope) -> Response:
+        authorization = dict(scope["headers"]).get(b"authorization")
+        client = scope.get("client")
+        if not admin_authorized(self.admin_token, authorization.decode("latin-1") if authorization else None,
+                                client[0] if client else None):
+            return Response(status_code=401)
+        # every worker reloads the configuration file and keeps its own streams
+        self.supervisor.reload()
+        return JSONResponse(content={"workers": self.workers}, status_code=202)
+
+
+class WorkerSupervisor:
+    """Runs the workers of the sharded mode in child processes and restarts the ones that exit. A worker is
+    available from the end of its startup until it exits"""
+
+    def __init__(self, run_worker, conf, workers, log_level, ssl_key, ssl_cert):
+        # entry point of the child processes, called with the worker configuration, its number, the log level,
+        # the certificate files and its ready event
+        self.run_worker = run_worker
+        self.conf = conf
+        self.workers = workers
+        self.log_level = log_level
+        self.ssl_key = ssl_key
+        self.ssl_cert = ssl_cert
+        self.processes = [None] * workers
+        self.ready = [multiprocessing.Event() for _ in range(workers)]
+        # updated by the supervision thread, so requests don't wait on the child processes
+        self.running = [False] * workers
+        # configuration reloads, and the ones each worker has got
+        self.reloads = 0
+        self.worker_reloads = [0] * workers
+        self.stopped = threading.Event()
+
+    def start(self):
+        for worker in range(self.workers):
+            self.start_worker(worker)
+        threading.Thread(target=self._watch, name="fastll-supervisor", daemon=True).start()
+
+    def start_worker(self, worker):
+        self.ready[worker].clear()
+        self.worker_reloads[worker] = self.reloads
+        process = multiprocessing.Process(target=self.run_worker, name=f"fastll-worker-{worker}",
+                                          args=(dict(self.conf), worker, self.log_level, self.ssl_key,
+                                                self.ssl_cert, self.ready[worker]))
+        process.start()
+        self.processes[worker] = process
+
+    def _watch(self):
+        while not self.stopped.wait(WORKER_CHECK_INTERVAL):
+            for worker, process in enumerate(self.processes):
+                if process.is_alive():
+                    self.running[worker] = self.ready[worker].is_set()
+                    if self.running[worker] and self.worker_reloads[worker] < self.reloads:
+                        # reloaded while it was starting
+                        self.reload_worker(worker)
+                    continue
+                self.running[worker] = False
+                if self.stopped.is_set():
+                    return
+                logger.warning(f"Worker {worker} exited with code {process.exitcode}, restarting it")
+                process.join()
+                self.start_worker(worker)
+
+    def available(self, worker) -> bool:
+        return self.running[worker]
+
+    def streams(self):
+        return self.conf["streams"]
+
+    def reload(self):
+        # workers started from now on get the new streams
+        streams = read_streams(self.conf["streamsFile"])
+        if streams is not None:
+            self.conf["streams"] = streams
+        self.reloads = self.reloads + 1
+        # the ones still starting are reloaded once they are done
+        for worker in range(self.workers):
+            if self.running[worker]:
+                self.reload_worker(worker)
+
+    def reload_worker(self, worker):
+        self.worker_reloads[worker] = self.reloads
+        os.kill(self.processes[worker].pid, signal.SIGHUP)
+
+    def stop(self):
+        # workers shut down as a single server does
+        self.stopped.set()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List, Tuple
+
+from loguru import logger
+
+from fastll_defaults import STATS_MAX_PENDING_ROWS, STATS_JITTER_WINDOW
+
+STATS_COLUMNS = ['timestamp', 'client', 'delta', 'jitter', 'users']
+
+
+class ClientStats:
+    """Request timing of a client. Only the last values are kept, rows are exported as they are produced"""
+    __slots__ = ("last_timestamp", "delta", "jitter", "recent_jitters")
+
+    def __init__(self):
+        self.last_timestamp = None
+        self.delta = None
+        self.jitter = None
+        self.recent_jitters = deque(maxlen=STATS_JITTER_WINDOW)
+
+    def update_timestamp(self, timestamp):
+        if self.last_timestamp is not None:
+            delta = timestamp - self.last_timestamp
+            if self.delta is not None:
+                self.jitter = abs(delta - self.delta)
+                self.recent_jitters.append(self.jitter)
+            self.delta = delta
+        self.last_timestamp = timestamp
+
+    def last_delta(self):
+        return self.delta if self.delta is not None else 0
+
+    def last_jitter(self):
+        return self.jitter if self.jitter is not None else 0
+
+    def average_jitter(self):
+        if len(self.recent_jitters) == 0:
+            return 0
+        return sum(self.recent_jitters) / len(self.recent_jitters)
+
+
+class StatsWriter:
+    """Stats rows of a stream session waiting to be written to its own CSV file"""
+
+    def __init__(self, stats_dir: str, stream: str):
+        session = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self.path = os.path.join(stats_dir, f"{stream}_{session}.csv")
+        self.rows: List[Tuple] = []
+        self.dropped = 0
+
+    def add(self, row: Tuple):
+        if len(self.rows) >= STATS_MAX_PENDING_ROWS:
+            self.dropped = self.dropped + 1
+            return
+        self.rows.append(row)
+
+    def take(self):
+        rows = self.rows
+        self.rows = []
+        return rows
+
+
+class StatsExporter:
+    """Worker thread writing stats rows, so the event loop never waits on files"""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def flush(self, writer: StatsWriter, close: bool = False):
+        # never blocks, rows are handed to the worker thread
+        rows = writer.take()
+        if len(rows) == 0 and not close:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fastll-stats", daemon=True)
+            self._thread.start()
+        self._queue.put((writer.path, rows, close))
+
+    def _run(self):
+        # only loaded when stats are saved
+        import csv
+        files = {}
+        while True:
+            path, rows, close = self._queue.get()
+            try:
+                if path not in files:
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    stats_file = open(path, "a", newline="")
+                    stats_csv = csv.writer(stats_file)
+                    if stats_file.tell() == 0:
+                        stats_csv.writerow(STATS_COLUMNS)
+                    files[path] = (stats_file, stats_csv)
+                stats_file, stats_csv = files[path]
+                stats_csv.writerows(rows)
+                stats_file.flush()
+                if close:
+                    stats_file.close()
+                    del files[path]
+            except OSError as e:
+                logger.warning(f"Stats can't be written to {path}: {e}")
+
+
+stats_exporter = StatsExporter()
@@ -0,0 +1,317 @@
+import asyncio
+import itertools
+import mmap
+import os
+import weakref
+from asyncio import Event
+from typing import Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from fastll_defaults import MMAP_INITIAL_SIZE
+
+STORAGE_MEMORY = "memory"
+STORAGE_SHARED_MEMORY = "sharedMemory"
+STORAGE_MMAP = "mmap"
+STORAGE_TYPES = (STORAGE_MEMORY, STORAGE_SHARED_MEMORY, STORAGE_MMAP)
+
+
+class SegmentStorageError(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ("size", "completed", "updated")
+
+    def __init__(self):
+        self.size = 0
+        self.completed = False
+        self.updated = Event()
+
+
+class SegmentStorage:
+    """Segment data of a stream.
+
+    Segments are written once, in order, by the packager and read by any number of viewers while they
+    arrive. Backends only keep the bytes; sizes, completion and reader wakeups are common to all of them.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, _Entry] = {}
+        self._keys = itertools.count()
+        self._closing = False
+
+    def put(self, name: str) -> int:
+        """Starts a new segment and returns its key. Keys are never reused, unlike segment names"""
+        key = next(self._keys)
+        self._entries[key] = _Entry()
+        self._allocate(key, name)
+        return key
+
+    def append(self, key: int, data: bytes, notify: bool = True) -> int:
+        """Appends data to a segment. Subscribers are woken unless notify is False, to wake them once for
+        several appends with notify()"""
+        entry = self._entries.get(key)
+        if entry is None:
+            raise SegmentStorageError(f"Segment {key} is no longer stored")
+        self._write(key, entry.size, data)
+        entry.size = entry.size + len(data)
+        if notify:
+            self._notify(entry)
+        return entry.size
+
+    def notify(self, key: int):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._notify(entry)
+
+    def complete(self, key: int):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.completed = True
+            self._complete(key)
+            self._notify(entry)
+
+    def size(self, key: int) -> int:
+        entry = self._entries.get(key)
+        return entry.size if entry is not None else 0
+
+    def read(self, key: int, start: int = 0, end: int = None):
+        """Segment data between two offsets, None if the segment is no longer stored"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if end is None or end > entry.size:
+            end = entry.size
+        if start >= end:
+            return bytes()
+        return self._read(key, start, end)
+
+    def view(self, key: int):
+        """Buffer with the data received so far, without copies. Only valid until the segment is written again"""
+        entry = self._entries.get(key)
+        if entry is None or entry.size == 0:
+            return bytes()
+        return self._view(key, entry.size)
+
+    async def subscribe(self, key: int, offset: int = 0, timeout: float = 1):
+        """Yields the segment data from an offset as it arrives. It ends when the segment is completed or
+        deleted, or when no data arrives for timeout seconds"""
+        while True:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if offset < entry.size:
+                data = self._read(key, offset, entry.size)
+                offset = entry.size
+                yield data
+                continue
+            if entry.completed:
+                return
+            try:
+                await asyncio.wait_for(entry.updated.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    def delete(self, key: int):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._free(key)
+        # subscribers wake up and find the segment gone
+        self._notify(entry)
+        if self._closing and len(self._entries) == 0:
+            self._close()
+
+    def close(self):
+        """Releases the storage once every segment still being read is deleted"""
+        self._closing = True
+        if len(self._entries) == 0:
+            self._close()
+
+    @staticmethod
+    def _notify(entry: _Entry):
+        # every subscriber waits on the current event, a new one is used for the next update
+        updated = entry.updated
+        entry.updated = Event()
+        updated.set()
+
+    def _allocate(self, key: int, name: str):
+        raise NotImplementedError
+
+    def _write(self, key: int, offset: int, data: bytes):
+        raise NotImplementedError
+
+    def _complete(self, key: int):
+        pass
+
+    def _read(self, key: int, start: int, end: int):
+        raise NotImplementedError
+
+    def _view(self, key: int, size: int):
+        raise NotImplementedError
+
+    def _free(self, key: int):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class MemoryStorage(SegmentStorage):
+    """Segment data in process memory. Segments grow in place while they arrive and are frozen when completed,
+    reads of completed segments are views of their data and nothing is copied"""
+
+    def __init__(self):
+        super().__init__()
+        self._data: Dict[int, Union[bytearray, bytes]] = {}
+
+    def _allocate(self, key: int, name: str):
+        self._data[key] = bytearray()
+
+    def _write(self, key: int, offset: int, data: bytes):
+        self._data[key] += data
+
+    def _complete(self, key: int):
+        self._data[key] = bytes(self._data[key])
+
+    def _read(self, key: int, start: int, end: int):
+        data = self._data[key]
+        if isinstance(data, bytearray):
+            # copied, a view would keep the segment from growing
+            return bytes(memoryview(data)[start:end])
+        if start == 0 and end == len(data):
+            return data
+        return memoryview(data)[start:end]
+
+    def _view(self, key: int, size: int):
+        return self._data[key]
+
+    def _free(self, key: int):
+        del self._data[key]
+
+
+class SharedMemoryRingStorage(SegmentStorage):
+    """Segment data in a shared memory ring of fixed size slots, one segment per slot.
+
+    Memory use is bounded and known in advance, and other processes can attach to the ring by its name.
+    When every slot is in use the next slot is taken from the segment using it, which is evicted.
+    """
+
+    def __init__(self, slots: int, slot_size: int):
+        super().__init__()
+        # only loaded by streams using this backend
+        from multiprocessing import shared_memory
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._slot_size = slot_size
+        self._owners: List[Optional[int]] = [None] * slots
+        self._slots: Dict[int, int] = {}
+        self._next_slot = 0
+        self._finalizer = weakref.finalize(self, _release_shared_memory, self._shm)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _allocate(self, key: int, name: str):
+        slots = len(self._owners)
+        slot = self._next_slot
+        for i in range(slots):
+            if self._owners[(self._next_slot + i) % slots] is None:
+                slot = (self._next_slot + i) % slots
+                break
+        else:
+            logger.warning(f"Shared memory ring {self.name} is full, evicting a segment for {name}")
+            self.delete(self._owners[slot])
+        self._owners[slot] = key
+        self._slots[key] = slot
+        self._next_slot = (slot + 1) % slots
+
+    def _write(self, key: int, offset: int, data: bytes):
+        if offset + len(data) > self._slot_size:
+            raise SegmentStorageError(f"Segment larger than the {self._slot_size} bytes of a ring slot")
+        start = self._slots[key] * self._slot_size + offset
+        self._shm.buf[start:start + len(data)] = data
+
+    def _read(self, key: int, start: int, end: int):
+        # copied, a view would keep the shared memory from being closed
+        base = self._slots[key] * self._slot_size
+        return bytes(self._shm.buf[base + start:base + end])
+
+    def _view(self, key: int, size: int):
+        base = self._slots[key] * self._slot_size
+        return self._shm.buf[base:base + size]
+
+    def _free(self, key: int):
+        slot = self._slots.pop(key)
+        self._owners[slot] = None
+
+    def _close(self):
+        self._finalizer()
+
+
+def _release_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # a view is still alive, the memory is released with the process
+        pass
+    shm.unlink()
+
+
+class MmapFileStorage(SegmentStorage):
+    """Segment data in memory mapped files, one per segment, so it lives in the page cache instead of the
+    process heap. Mappings grow by doubling as data arrives"""
+
+    def __init__(self, directory: str):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._files: Dict[int, Tuple[str, mmap.mmap]] = {}
+
+    def _allocate(self, key: int, name: str):
+        path = os.path.join(self._directory, f"{key}-{name}")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, MMAP_INITIAL_SIZE)
+            mapped = mmap.mmap(fd, MMAP_INITIAL_SIZE)
+        finally:
+            os.close(fd)
+        self._files[key] = (path, mapped)
+
+    def _write(self, key: int, offset: int, data: bytes):
+        mapped = self._files[key][1]
+        end = offset + len(data)
+        if end > len(mapped):
+            # the file grows with the mapping
+            mapped.resize(max(end, 2 * len(mapped)))
+        mapped[offset:end] = data
+
+    def _read(self, key: int, start: int, end: int):
+        # slicing a mapping copies, a view would keep it from growing or being closed
+        return self._files[key][1][start:end]
+
+    def _view(self, key: int, size: int):
+        return memoryview(self._files[key][1])[:size]
+
+    def _free(self, key: int):
+        path, mapped = self._files.pop(key)
+        mapped.close()
+        try:
+            os.unlink(path)
+        except OSError as e:
+            logger.warning(f"Segment file {path} can't be removed: {e}")
+
+    def _close(self):
+        try:
+            os.rmdir(self._directory)
+        except OSError:
+            pass
+
+
+def create_storage(stream, storage_dir: str) -> SegmentStorage:
+    if stream.storage_type == STORAGE_SHARED_MEMORY:
+        return SharedMemoryRingStorage(stream.storage_slots, stream.storage_slot_size)
+    if stream.storage_type == STORAGE_MMAP:
+        return MmapFileStorage(os.path.join(storage_dir, stream.name))
+    return MemoryStorage()
@@ -1,10 +1,21 @@
-from asyncio import Event, Lock
+import asyncio
+import time
+from asyncio import Event, Lock, TimerHandle
+from collections import deque
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from enum import IntEnum
 from subprocess import Popen
-from typing import List, Dict
+from typing import Dict, Deque, Tuple
 from fastll_defaults import *
+from fastll_clock import UTC_TIMING_SCHEMES, UTC_TIMING_XSDATE
+from fastll_cmaf import CmafIndex
+from fastll_latency import LatencyStats
+from fastll_trace import SegmentTimeline
+from fastll_session import SessionTable
+from fastll_record import Recording
+from fastll_stats import StatsWriter
+from fastll_storage import SegmentStorage, STORAGE_TYPES
 from loguru import logger
 import xml.etree.ElementTree as eT
 
@@ -20,27 +31,128 @@ class StreamStatus(IntEnum):
     STARTED = 1
 
 
-@dataclass
-class Chunk:
-    data: bytes = None
-    event: Event = field(default_factory=Event, init=False)
-
-
 @dataclass
 class Segment:
     name: str
     completed: bool
     event: Event
-    chunks: List[Chunk]
-    completed_data: bytes
-
-    def __init__(self, name: str):
+    storage: SegmentStorage
+    key: int
+    index: CmafIndex
+    created: float
+    arrival_time: float
+    timeline: SegmentTimeline
+    readers: int
+    retired: bool
+    flush_handle: TimerHandle
+
+    def __init__(self, name: str, storage: SegmentStorage):
         self.name = name
         self.completed = False
         self.event = Event()
-        self.chunks = list()
-        self.chunks.append(Chunk())
-        self.completed_data = bytes()
+        self.storage = storage
+        self.key = storage.put(name)
+        self.index = CmafIndex()
+        self.created = time.monotonic()
+        self.arrival_time = None
+        self.timeline = None
+        self.readers = 0
+        self.retired = False
+        self.flush_handle = None
+
+    def append(self, data: bytes, coalesce_window: float = 0):
+        """Appends data. With a coalescing window readers are woken when a CMAF fragment is completed or,
+        at the latest, coalesce_window seconds after the first data they haven't been woken for"""
+        self.storage.append(self.key, data, notify=False)
+        # index CMAF fragments as they arrive
+        indexed_fragments = len(self.index.fragments)
+        self.index.feed(self.storage.view(self.key))
+        if coalesce_window <= 0 or len(self.index.fragments) > indexed_fragments:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(coalesce_window, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.storage.notify(self.key)
+
+    def complete(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.completed = True
+        self.storage.complete(self.key)
+
+    def size(self):
+        return self.storage.size(self.key)
+
+    def data(self, start: int = 0, end: int = None):
+        """Segment data, None if it is no longer stored"""
+        return self.storage.read(self.key, start, end)
+
+    def subscribe(self, offset: int = 0):
+        return self.storage.subscribe(self.key, offset)
+
+    def join_offset(self):
+        """Offset where a viewer joining mid-segment can start receiving data"""
+        return self.index.last_keyframe_offset()
+
+    def acquire(self):
+        self.readers = self.readers + 1
+
+    def release(self):
+        self.readers = self.readers - 1
+        if self.retired and self.readers == 0:
+            self.reclaim()
+
+    def retire(self):
+        """The segment is no longer discoverable. Its data is released once the last reader is done"""
+        self.retired = True
+        if self.readers == 0:
+            self.reclaim()
+
+    def reclaim(self):
+        # readers still waiting for data are woken and find the segment gone
+        self.storage.delete(self.key)
+        self.index = CmafIndex()
+
+    def prft(self):
+        """Encoder wallclock of the first fragment, if it is known"""
+        fragments = self.index.fragments
+        if len(fragments) > 0:
+            return fragments[0].prft
+        return None
+
+
+@dataclass
+class HlsRendition:
+    segments: Deque[Tuple[int, Segment]]
+    updated: Event
+    timescale: int
+
+    def __init__(self):
+        self.segments = deque(maxlen=HLS_WINDOW_SEGMENTS)
+        self.updated = Event()
+        self.timescale = None
+
+    def add_segment(self, number: int, segment: Segment):
+        if len(self.segments) > 0 and self.segments[-1][0] >= number:
+            return
+        self.segments.append((number, segment))
+
+    def remove_segment(self, segment: Segment):
+        # retired segments are usually the oldest ones
+        if any(i is segment for _, i in self.segments):
+            self.segments = deque(((number, i) for number, i in self.segments if i is not segment),
+                                  maxlen=HLS_WINDOW_SEGMENTS)
+
+    def notify(self):
+        # every blocked request waits on the current event, a new one is used for the next update
+        updated = self.updated
+        self.updated = Event()
+        updated.set()
 
 
 @dataclass
@@ -54,15 +166,28 @@ class FfmpegState:
 
 @dataclass
 class Manifest:
+    # UTCTiming scheme announced to players, when FFmpeg's is not the one
+    utc_timing_scheme: str = None
     _skip_count = 0
     _data: str = None
     _ssss_data: str = None
+    modified: float = None
+    representations: Dict[str, Dict[str, str]] = field(default_factory=dict, init=False)
+    # bodies as served to a CDN, built when first requested
+    bodies: Dict[bool, object] = field(default_factory=dict, init=False)
     event: Event = field(default_factory=Event, init=False)
 
     def set_manifest(self, manifest: str):
         if self._skip_count <= 4:
             self._skip_count = self._skip_count + 1
             return
+        if self.utc_timing_scheme is not None:
+            # FFmpeg always announces its time server as http-xsdate
+            manifest = manifest.replace(UTC_TIMING_SCHEMES[UTC_TIMING_XSDATE], self.utc_timing_scheme)
+        if manifest == self._data:
+            return
+        self.modified = time.time()
+        self.bodies = dict()
         # unmodified manifest
         self._data = manifest
         # ssss manifest
@@ -87,6 +212,7 @@ class Manifest:
             for adaptation_set in period.findall('AdaptationSet', ns):
                 # Delete representations whose id isn't 0
                 for representation in adaptation_set.findall('Representation', ns):
+                    self.representations[representation.attrib['id']] = dict(representation.attrib)
                     if representation.attrib['id'] != '0':
                         adaptation_set.remove(representation)
 
@@ -106,10 +232,12 @@ class Manifest:
 @dataclass
 class InitialSegment:
     data: bytes = None
+    modified: float = None
     event: Event = field(default_factory=Event, init=False)
 
     def set_initial_segment(self, segment: bytes):
         self.data = segment
+        self.modified = time.time()
         self.event.set()
 
 
@@ -137,9 +265,29 @@ class Stream:
     manifest: Manifest
     init_segments: Dict[int, InitialSegment]
     segments: Dict[str, Segment]
+    retired_segments: Dict[str, Tuple[float, Segment]]
     qualities: Dict[int, Quality]
     server_side_streaming_switching: bool
+    fragment_join: bool
+    cmcd: bool
+    ll_hls: bool
+    hls_renditions: Dict[int, HlsRendition]
+    latency_stats: bool
+    latency: Dict[int, LatencyStats]
     save_stats: bool
+    session_timeout: float
+    sessions: SessionTable
+    max_viewers: int
+    max_egress_kbps: int
+    admission_policy: str
+    stats_writer: StatsWriter
+    record: bool
+    ingest_coalesce_ms: float
+    recording: Recording
+    storage_type: str
+    storage_slots: int
+    storage_slot_size: int
+    storage: SegmentStorage
     segments_lock: Lock
     ffmpeg_state: FfmpegState
     current_segment: int
@@ -193,11 +341,85 @@ class Stream:
         else:
             self.server_side_streaming_switching = DEFAULT_SERVER_SIDE_REPRESENTATION_SWITCHING
 
+        if "cmcd" in config_stream:
+            self.cmcd = config_stream["cmcd"]
+        else:
+            self.cmcd = DEFAULT_CMCD
+
+        if "fragmentJoin" in config_stream:
+            self.fragment_join = config_stream["fragmentJoin"]
+        else:
+            self.fragment_join = DEFAULT_FRAGMENT_JOIN
+
+        if "llHls" in config_stream:
+            self.ll_hls = config_stream["llHls"]
+        else:
+            self.ll_hls = DEFAULT_LL_HLS
+
+        if "latencyStats" in config_stream:
+            self.latency_stats = config_stream["latencyStats"]
+        else:
+            self.latency_stats = DEFAULT_LATENCY_STATS
+
         if "saveStats" in config_stream:
             self.save_stats = config_stream["saveStats"]
         else:
             self.save_stats = DEFAULT_SAVE_STATS
 
+        if "sessionTimeout" in config_stream:
+            self.session_timeout = config_stream["sessionTimeout"]
+        else:
+            self.session_timeout = DEFAULT_SESSION_TIMEOUT
+
+        if "maxViewers" in config_stream:
+            self.max_viewers = config_stream["maxViewers"]
+        else:
+            self.max_viewers = None
+
+        if "maxEgressKbps" in config_stream:
+            self.max_egress_kbps = config_stream["maxEgressKbps"]
+        else:
+            self.max_egress_kbps = None
+
+        if "admissionPolicy" in config_stream:
+            self.admission_policy = config_stream["admissionPolicy"]
+        else:
+            self.admission_policy = DEFAULT_ADMISSION_POLICY
+
+        if "record" in config_stream:
+            self.record = config_stream["record"]
+        else:
+            self.record = DEFAULT_RECORD
+
+        if "ingestCoalesceMs" in config_stream:
+            self.ingest_coalesce_ms = config_stream["ingestCoalesceMs"]
+        else:
+            self.ingest_coalesce_ms = DEFAULT_INGEST_COALESCE_MS
+
+        if "storage" in config_stream:
+            self.storage_type = config_stream["storage"]
+        else:
+            self.storage_type = DEFAULT_STORAGE
+        if self.storage_type not in STORAGE_TYPES:
+            raise ValueError(f"Unknown storage {self.storage_type} for stream {self.name}")
+
+        if "utcTiming" in config_stream:
+            self.utc_timing = config_stream["utcTiming"]
+        else:
+            self.utc_timing = DEFAULT_UTC_TIMING
+        if self.utc_timing not in UTC_TIMING_SCHEMES:
+            raise ValueError(f"Unknown UTCTiming scheme {self.utc_timing} for stream {self.name}")
+
+        if "storageSlots" in config_stream:
+            self.storage_slots = config_stream["storageSlots"]
+        else:
+            self.storage_slots = DEFAULT_STORAGE_SLOTS
+
+        if "storageSlotSize" in config_stream:
+            self.storage_slot_size = config_stream["storageSlotSize"]
+        else:
+            self.storage_slot_size = DEFAULT_STORAGE_SLOT_SIZE
+
         self.qualities = dict()
         if "qualities" in config_stream:
             qualities = config_stream['qualities']
@@ -215,17 +437,35 @@ class Stream:
             logger.debug(f"init_segments {idx}: {self.init_segments[idx]}")
         self.status = StreamStatus.STOPPED
         self.last_access = datetime.timestamp(datetime.utcnow() - timedelta(hours=1))
-        self.manifest = Manifest()
+        self.manifest = self.new_manifest()
         self.ffmpeg_state = FfmpegState()
         self.segments_lock = Lock()
         self.segments = dict()
+        self.retired_segments = dict()
+        self.hls_renditions = dict()
+        self.latency = dict()
+        self.sessions = SessionTable(self.session_timeout, self.save_stats)
+        self.stats_writer = None
+        self.recording = None
+        # created when the first segment arrives
+        self.storage = None
         self.current_segment = 0
 
     def max_adaptation_set(self):
         return len(self.qualities) - 1
 
+    def representation_kbps(self, representation: int):
+        if representation in self.qualities:
+            return int(self.qualities[representation].targetBitrate)
+        return int(self.bitrate)
+
+    def new_manifest(self):
+        if self.utc_timing == UTC_TIMING_XSDATE:
+            return Manifest()
+        return Manifest(UTC_TIMING_SCHEMES[self.utc_timing])
+
     def clear_manifest(self):
-        self.manifest = Manifest()
+        self.manifest = self.new_manifest()
 
     def clear_init_segments(self):
         self.init_segments = dict()
@@ -233,7 +473,55 @@ class Stream:
             self.init_segments[idx] = InitialSegment()
 
     def clear_segments(self):
+        for segment in self.segments.values():
+            segment.retire()
         self.segments = dict()
+        self.retired_segments = dict()
+
+    def retire_segment(self, name: str):
+        """Removes a segment. Requests for it are answered right away with 404 during a grace period, and its
+        data is released when its last reader is done or, at the latest, when the grace period ends"""
+        segment = self.segments.pop(name)
+        segment.retire()
+        # playlists stop listing it
+        for rendition in self.hls_renditions.values():
+            rendition.remove_segment(segment)
+        self.retired_segments[name] = (time.monotonic() + SEGMENT_GRACE_PERIOD, segment)
+
+    def purge_placeholders(self):
+        """Removes the segments created by requests that never arrived, such as far-ahead or bogus segment
+        names. Nobody waits for them anymore. Returns the removed segments"""
+        deadline = time.monotonic() - PLACEHOLDER_MAX_AGE
+        placeholders = [segment for segment in self.segments.values()
+                        if segment.arrival_time is None and segment.created < deadline]
+        for segment in placeholders:
+            del self.segments[segment.name]
+            segment.retire()
+        return placeholders
+
+    def purge_retired_segments(self):
+        now = time.monotonic()
+        for name in [name for name, (deadline, _) in self.retired_segments.items() if deadline <= now]:
+            deadline, segment = self.retired_segments.pop(name)
+            segment.reclaim()
+
+    def close_storage(self):
+        if self.storage is not None:
+            self.storage.close()
+            self.storage = None
+
+    def hls_rendition(self, rendition_id: int):
+        if rendition_id not in self.hls_renditions:
+            self.hls_renditions[rendition_id] = HlsRendition()
+        return self.hls_renditions[rendition_id]
+
+    def representation_latency(self, representation: int):
+        if representation not in self.latency:
+            self.latency[representation] = LatencyStats()
+        return self.latency[representation]
+
+    def clear_hls_renditions(self):
+        self.hls_renditions = dict()
 
     def stop_ffmpeg(self):
         self.ffmpeg_state.stop()
@@ -248,3 +536,5 @@ class Stream:
         self.clear_manifest()
         self.clear_init_segments()
         self.clear_segments()
+        self.clear_hls_renditions()
+        self.sessions.clear()
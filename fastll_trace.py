@@ -0,0 +1,102 @@
+import json
+import random
+import time
+from typing import List
+
+from fastll_defaults import TRACE_BUFFER_SIZE
+
+# viewer record positions
+VIEWER_CLIENT = 0
+VIEWER_REQUEST = 1
+VIEWER_FIRST_BYTE = 2
+VIEWER_LAST_BYTE = 3
+
+
+class SegmentTimeline:
+    """Delivery timeline of a segment. Times are time.time() values, written relative to the first event"""
+    __slots__ = ("stream", "name", "placeholder", "first_put", "chunk_times", "chunk_sizes", "put_completed",
+                 "viewers")
+
+    def __init__(self, stream: str, name: str):
+        self.stream = stream
+        self.name = name
+        self.placeholder = None
+        self.first_put = None
+        self.chunk_times = []
+        self.chunk_sizes = []
+        self.put_completed = None
+        self.viewers = []
+
+    def chunk(self, size: int):
+        self.chunk_times.append(time.time())
+        self.chunk_sizes.append(size)
+
+    def viewer(self, client: str, request_time: float):
+        # [client, request, first byte, last byte]
+        viewer = [client, request_time, None, None]
+        self.viewers.append(viewer)
+        return viewer
+
+    def to_dict(self):
+        times = [t for t in (self.placeholder, self.first_put) if t is not None]
+        times.extend(viewer[VIEWER_REQUEST] for viewer in self.viewers)
+        origin = min(times) if len(times) > 0 else 0
+
+        def relative(t):
+            return None if t is None else round((t - origin) * 1000, 1)
+
+        return {
+            "stream": self.stream,
+            "segment": self.name,
+            "t0": origin,
+            "placeholder": relative(self.placeholder),
+            "first_put": relative(self.first_put),
+            "chunks": [[relative(t), size] for t, size in zip(self.chunk_times, self.chunk_sizes)],
+            "put_completed": relative(self.put_completed),
+            "viewers": [[viewer[VIEWER_CLIENT], relative(viewer[VIEWER_REQUEST]), relative(viewer[VIEWER_FIRST_BYTE]),
+                         relative(viewer[VIEWER_LAST_BYTE])] for viewer in self.viewers],
+        }
+
+
+class Tracer:
+    """Samples segments, buffers their finished timelines in memory and hands them to a background writer"""
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.path = None
+        self.buffer: List[dict] = []
+        self.dropped = 0
+
+    def configure(self, path: str, sample_rate: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.enabled = path is not None
+
+    def start(self, stream: str, name: str):
+        """Returns a timeline for a new segment when it is sampled, None otherwise"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        return SegmentTimeline(stream, name)
+
+    def finish(self, timeline: SegmentTimeline):
+        if timeline is None:
+            return
+        if len(self.buffer) >= TRACE_BUFFER_SIZE:
+            self.dropped = self.dropped + 1
+            return
+        self.buffer.append(timeline.to_dict())
+
+    def take(self):
+        buffer = self.buffer
+        self.buffer = []
+        return buffer
+
+
+def write_trace_file(path: str, timelines: List[dict]):
+    """Appends timelines to path as JSON lines. Blocking, must run in an executor."""
+    with open(path, "a") as trace_file:
+        trace_file.write("".join(json.dumps(timeline) + "\n" for timeline in timelines))
+
+
+tracer = Tracer()
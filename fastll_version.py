@@ -0,0 +1 @@
+VERSION = "Fastll 0.7.1"
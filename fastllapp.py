@@ -1,21 +1,22 @@
 import argparse
+import importlib.util
 import logging
 import os
+import shutil
+import signal
 import sys
 import json
-import distutils.spawn
 
-from loguru import logger
-from uvicorn import Config, Server
-from fastll_conf import fastll_conf
-from fastll import VERSION
-from fastll_defaults import DEFAULT_TIME_DISPLACEMENT
+from fastll_version import VERSION
 
 LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO"))
 JSON_LOGS = True if os.environ.get("JSON_LOGS", "0") == "1" else False
 
 
 class InterceptHandler(logging.Handler):
+    # walking the stack for every record is expensive, hot path logging mode disables it
+    find_caller = True
+
     def emit(self, record):
         # Get corresponding Loguru level if it exists
         try:
@@ -24,10 +25,12 @@ class InterceptHandler(logging.Handler):
             level = record.levelno
 
         # Find caller from where originated the logged message
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
-            frame = frame.f_back
-            depth += 1
+        depth = 2
+        if self.find_caller:
+            frame = logging.currentframe()
+            while frame.f_code.co_filename == logging.__file__:
+                frame = frame.f_back
+                depth += 1
 
         logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
 
@@ -43,8 +46,8 @@ def setup_logging():
         logging.getLogger(name).handlers = []
         logging.getLogger(name).propagate = True
 
-    # configure loguru
-    logger.configure(handlers=[{"sink": sys.stdout, "serialize": JSON_LOGS}])
+    # configure loguru, records are written by a background thread so the event loop never waits on the sink
+    logger.configure(handlers=[{"sink": sys.stdout, "serialize": JSON_LOGS, "enqueue": True}])
 
 
 def file_contents(s):
@@ -58,6 +61,76 @@ def file_contents(s):
     return data
 
 
+class Http2Server:
+    """Serves the application with hypercorn, which speaks HTTP/2 (h2 with TLS, h2c without it) and HTTP/1.1 on
+    the same port. Segments keep streaming as they arrive, paced by the HTTP/2 flow control window of each stream"""
+
+    def __init__(self, host, port, ssl_key, ssl_cert):
+        from hypercorn.config import Config as HypercornConfig
+        self.config = HypercornConfig()
+        self.config.bind = [f"{host}:{port}"]
+        self.config.keyfile = ssl_key
+        self.config.certfile = ssl_cert
+        # records go to the root logger, as uvicorn ones
+        self.config.errorlog = logging.getLogger("hypercorn.error")
+        # set by the application from its clock
+        self.config.include_date_header = False
+
+    def run(self):
+        import asyncio
+        from hypercorn.asyncio import serve
+        from fastll import app
+        asyncio.run(serve(app, self.config))
+
+
+def create_server(host, port, log_level, ssl_key, ssl_cert, http2):
+    if http2:
+        return Http2Server(host, port, ssl_key, ssl_cert)
+    from uvicorn import Config, Server
+    return Server(
+        Config(
+            "fastll:app",
+            host=host,
+            port=port,
+            log_level=log_level,
+            ssl_keyfile=ssl_key,
+            ssl_certfile=ssl_cert,
+            # set by the application from its clock
+            date_header=False,
+        ),
+    )
+
+
+def run_worker(conf, worker, log_level, ssl_key, ssl_cert, ready):
+    """Serves the streams owned by one worker of the sharded mode on its own port. Runs in a child process, ready
+    is set when its startup is complete"""
+    global logger
+    global LOG_LEVEL
+    # reloads are ignored until the application handles them, at the end of its startup
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    from loguru import logger
+    from fastll import app
+    from fastll_conf import fastll_conf
+    from fastll_shard import worker_port, worker_file
+
+    LOG_LEVEL = log_level
+    app.add_event_handler("startup", ready.set)
+    fastll_conf.update(conf)
+    fastll_conf["worker"] = worker
+    # FFmpeg of each stream sends its objects to the worker owning it
+    fastll_conf["port"] = worker_port(conf["port"], worker)
+    if conf["ingestPort"] is not None:
+        fastll_conf["ingestPort"] = conf["ingestPort"] + worker
+    fastll_conf["latencyFile"] = worker_file(conf["latencyFile"], worker)
+    fastll_conf["traceFile"] = worker_file(conf["traceFile"], worker)
+
+    server = create_server(conf["host"], fastll_conf["port"], log_level, ssl_key, ssl_cert, conf["http2"])
+    setup_logging()
+    logger.debug(f"Worker {worker} running on: {conf['host']}:{fastll_conf['port']}")
+    server.run()
+
+
 def parse_arguments():
     # Argument parsing
     parser = argparse.ArgumentParser()
@@ -71,8 +144,16 @@ def parse_arguments():
 
 
 if __name__ == '__main__':
-    # argument parsing
+    # argument parsing, --version and usage errors don't load the server
     args = parse_arguments()
+
+    from loguru import logger
+    from uvicorn import Config, Server
+    from fastll_conf import fastll_conf, read_streams
+    from fastll_defaults import DEFAULT_TIME_DISPLACEMENT, DEFAULT_TRACE_SAMPLE_RATE, DEFAULT_STATS_DIR, \
+        DEFAULT_INGEST_HOST, DEFAULT_STORAGE_DIR, DEFAULT_RECORD_DIR, DEFAULT_CDN_ORIGIN, CDN_MANIFEST_MAX_AGE, \
+        CDN_SEGMENT_MAX_AGE, DEFAULT_WORKERS, DEFAULT_HTTP2
+
     config = json.loads(args.config)
     verbose = False
     if "verbose" in config:
@@ -91,12 +172,7 @@ if __name__ == '__main__':
 
     streams = None
     if "streams" in config:
-        streams_config = config["streams"]
-        try:
-            with open(streams_config) as json_file:
-                streams = json.load(json_file)
-        except FileNotFoundError:
-            logger.error(f"Stream configuration file can't be read")
+        streams = read_streams(config["streams"])
 
     timeDisplacement = DEFAULT_TIME_DISPLACEMENT
     if "timeDisplacement" in config:
@@ -106,6 +182,75 @@ if __name__ == '__main__':
     if "waitForAbsentSegment" in config:
         waitForAbsentSegment = config["waitForAbsentSegment"]
 
+    latencyFile = None
+    if "latencyFile" in config:
+        latencyFile = config["latencyFile"]
+
+    traceFile = None
+    if "traceFile" in config:
+        traceFile = config["traceFile"]
+
+    traceSampleRate = DEFAULT_TRACE_SAMPLE_RATE
+    if "traceSampleRate" in config:
+        traceSampleRate = config["traceSampleRate"]
+
+    statsDir = DEFAULT_STATS_DIR
+    if "statsDir" in config:
+        statsDir = config["statsDir"]
+
+    storageDir = DEFAULT_STORAGE_DIR
+    if "storageDir" in config:
+        storageDir = config["storageDir"]
+
+    recordDir = DEFAULT_RECORD_DIR
+    if "recordDir" in config:
+        recordDir = config["recordDir"]
+
+    maxViewers = None
+    if "maxViewers" in config:
+        maxViewers = config["maxViewers"]
+
+    maxEgressKbps = None
+    if "maxEgressKbps" in config:
+        maxEgressKbps = config["maxEgressKbps"]
+
+    ingestPort = None
+    if "ingestPort" in config:
+        ingestPort = config["ingestPort"]
+
+    ingestHost = DEFAULT_INGEST_HOST
+    if "ingestHost" in config:
+        ingestHost = config["ingestHost"]
+
+    cdnOrigin = DEFAULT_CDN_ORIGIN
+    if "cdnOrigin" in config:
+        cdnOrigin = config["cdnOrigin"]
+
+    cdnManifestMaxAge = CDN_MANIFEST_MAX_AGE
+    if "cdnManifestMaxAge" in config:
+        cdnManifestMaxAge = config["cdnManifestMaxAge"]
+
+    cdnSegmentMaxAge = CDN_SEGMENT_MAX_AGE
+    if "cdnSegmentMaxAge" in config:
+        cdnSegmentMaxAge = config["cdnSegmentMaxAge"]
+
+    http2 = DEFAULT_HTTP2
+    if "http2" in config:
+        http2 = config["http2"]
+
+    workers = DEFAULT_WORKERS
+    if "workers" in config:
+        workers = config["workers"]
+
+    adminToken = None
+    if "adminToken" in config:
+        adminToken = config["adminToken"]
+
+    logSampling = None
+    if "logSampling" in config:
+        logSampling = config["logSampling"]
+        InterceptHandler.find_caller = False
+
     if verbose:
         LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "DEBUG"))
     else:
@@ -117,20 +262,61 @@ if __name__ == '__main__':
     fastll_conf["port"] = port
     fastll_conf["https"] = https
     fastll_conf["streams"] = streams
+    fastll_conf["streamsFile"] = config.get("streams")
+    fastll_conf["adminToken"] = adminToken
+    fastll_conf["statsDir"] = statsDir
+    fastll_conf["storageDir"] = storageDir
+    fastll_conf["recordDir"] = recordDir
+    fastll_conf["cdnOrigin"] = cdnOrigin
+    fastll_conf["cdnManifestMaxAge"] = cdnManifestMaxAge
+    fastll_conf["cdnSegmentMaxAge"] = cdnSegmentMaxAge
+    fastll_conf["maxViewers"] = maxViewers
+    fastll_conf["maxEgressKbps"] = maxEgressKbps
+    fastll_conf["ingestPort"] = ingestPort
+    fastll_conf["ingestHost"] = ingestHost
+    fastll_conf["logSampling"] = logSampling
     fastll_conf["timeDisplacement"] = timeDisplacement
     fastll_conf["waitForAbsentSegment"] = waitForAbsentSegment
+    fastll_conf["latencyFile"] = latencyFile
+    fastll_conf["traceFile"] = traceFile
+    fastll_conf["traceSampleRate"] = traceSampleRate
+    fastll_conf["workers"] = workers
+    fastll_conf["http2"] = http2
+
+    if http2 and importlib.util.find_spec("hypercorn") is None:
+        logger.error("hypercorn not found, HTTP/2 requires it. Please install it and try again")
+        exit(-1)
+
+    if ingestPort is not None:
+        # the public port, the worker ones in sharded mode, and the ingest ones
+        ports = {port}
+        if workers > 1:
+            ports.update(range(port + 1, port + 1 + workers))
+        if ports.intersection(range(ingestPort, ingestPort + max(workers, 1))):
+            logger.error(f"Ingest ports {ingestPort}-{ingestPort + max(workers, 1) - 1} overlap the server ones")
+            exit(-1)
+
+    supervisor = None
 
     # create server
-    server = Server(
-        Config(
-            "fastll:app",
-            host=host,
-            port=port,
-            log_level=LOG_LEVEL,
-            ssl_keyfile=ssl_key,
-            ssl_certfile=ssl_cert,
-        ),
-    )
+    if workers > 1:
+        # sharded mode, this process only runs the front router
+        from fastll_shard import ShardRouter, WorkerSupervisor
+        supervisor = WorkerSupervisor(run_worker, fastll_conf, workers, LOG_LEVEL, ssl_key, ssl_cert)
+        router = ShardRouter(host, port, https, workers, adminToken, supervisor)
+        server = Server(
+            Config(
+                router,
+                host=host,
+                port=port,
+                log_level=LOG_LEVEL,
+                ssl_keyfile=ssl_key,
+                ssl_certfile=ssl_cert,
+                lifespan="off",
+            ),
+        )
+    else:
+        server = create_server(host, port, LOG_LEVEL, ssl_key, ssl_cert, http2)
 
     # setup logging last, to make sure no library overwrites it
     # (they shouldn't, but it happens)
@@ -146,12 +332,28 @@ if __name__ == '__main__':
         exit(-1)
     logger.debug(f"Time Displacement: {timeDisplacement}")
     logger.debug(f"Wait for absent segment: {waitForAbsentSegment}")
+    logger.debug(f"Latency file: {latencyFile}")
+    logger.debug(f"Trace file: {traceFile}, sample rate: {traceSampleRate}")
+    logger.debug(f"Log sampling: {logSampling}")
+    logger.debug(f"Max viewers: {maxViewers}, max egress: {maxEgressKbps} kbps")
+    logger.debug(f"Ingest listener: {ingestHost}:{ingestPort}")
+    logger.debug(f"Workers: {workers}, HTTP/2: {http2}")
 
     # check ffmpeg
-    ffprobe_present = distutils.spawn.find_executable("ffprobe")
+    ffprobe_present = shutil.which("ffprobe")
     if ffprobe_present is None:
         logger.error("ffprobe not found. Please install it and try again")
         exit(-1)
 
+    if supervisor is not None:
+        supervisor.start()
+        # configuration reloads go to every worker
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: supervisor.reload())
+
     # server.install_signal_handlers = lambda: None
-    server.run()
+    try:
+        server.run()
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
@@ -67,7 +67,7 @@ ffmpeg_gen_video_command = \
      "dash",  # 58
      "http://fakehost/fakestream/manifest.mpd"  # 59
      ]
-ffmpeg_gen_video_command_time_server = "{http_url}/isotime"
+ffmpeg_gen_video_command_time_server = "{http_url}/isotime/{stream}"
 ffmpeg_gen_video_command_output = "{http_url}/{stream}/manifest.mpd"
 # noinspection SpellCheckingInspection
 ffmpeg_rtsp_video_command = \
@@ -122,7 +122,7 @@ ffmpeg_rtsp_video_fps = "fps={fps}, scale={width}:-2"
 # noinspection SpellCheckingInspection
 # ffmpeg_rtsp_video_x264opts = "keyint={fps}:min-keyint={fps}:scenecut=-1"
 ffmpeg_rtsp_video_bitrate = "{bitrate}k"
-ffmpeg_rtsp_video_time_server = "{http_url}/isotime"
+ffmpeg_rtsp_video_time_server = "{http_url}/isotime/{stream}"
 ffmpeg_rtsp_video_segmentation = "id=0,streams=v,seg_duration={seg_duration},frag_duration={frag_duration}"
 # ffmpeg_rtsp_video_segmentation = "id=0,streams=v"
 ffmpeg_rtsp_video_target_latency = "{latency}"
@@ -162,11 +162,15 @@ ffmpeg_rtsp_video_refs_param = "-refs:v:{index}"
 ffmpeg_rtsp_video_refs_option = "0"
 
 
-def ffmpeg_command(http_url: str, stream: Stream):
+def ffmpeg_command(http_url: str, stream: Stream, ingest_url: str = None):
+    # objects are sent to the ingest listener when there is one, the time server is always the public one
+    if ingest_url is None:
+        ingest_url = http_url
+
     if stream.type == "GEN":
         command = copy.deepcopy(ffmpeg_gen_video_command)
-        command[30] = ffmpeg_gen_video_command_time_server.format(http_url=http_url)
-        command[59] = ffmpeg_gen_video_command_output.format(http_url=http_url, stream=stream.name)
+        command[30] = ffmpeg_gen_video_command_time_server.format(http_url=http_url, stream=stream.name)
+        command[59] = ffmpeg_gen_video_command_output.format(http_url=ingest_url, stream=stream.name)
         return command
 
     if stream.type == "RTSP":
@@ -178,12 +182,12 @@ def ffmpeg_command(http_url: str, stream: Stream):
         # command[15] = ffmpeg_rtsp_video_x264opts.format(fps=stream.intra_interval)
         # command[30] = ffmpeg_rtsp_video_bitrate.format(bitrate=stream.bitrate)
         # command[32] = ffmpeg_rtsp_video_bitrate.format(bitrate=stream.bitrate)
-        command[13] = ffmpeg_rtsp_video_time_server.format(http_url=http_url)
+        command[13] = ffmpeg_rtsp_video_time_server.format(http_url=http_url, stream=stream.name)
         command[23] = ffmpeg_rtsp_video_segmentation.format(seg_duration=stream.segment_duration,
                                                             frag_duration=stream.fragment_duration)
         # command[23] = ffmpeg_rtsp_video_segmentation
         command[33] = ffmpeg_rtsp_video_target_latency.format(latency=stream.target_latency)
-        command[44] = ffmpeg_rtsp_video_command_output.format(http_url=http_url, stream=stream.name)
+        command[44] = ffmpeg_rtsp_video_command_output.format(http_url=ingest_url, stream=stream.name)
 
         # stream qualities
         stream_qualities_base_pos = 11
@@ -0,0 +1,43 @@
+import pytest
+
+from fastll_admission import egress_representation
+from fastll_session import EgressTotals, SessionTable
+from fastll_stream import Stream
+
+
+def stream(policy: str, switching: bool):
+    fll_stream = Stream({
+        "name": "Camera", "stream": "cam", "type": "GEN", "maxEgressKbps": 1000, "admissionPolicy": policy,
+        "serverSideRepresentationSwitching": switching,
+        "qualities": {"video": [{"targetWidth": "640", "targetBitrate": "250"},
+                                {"targetWidth": "1280", "targetBitrate": "750"}]},
+    })
+    # not accounted in the server totals
+    fll_stream.sessions = SessionTable(10, server_totals=EgressTotals())
+    return fll_stream
+
+
+def serve(fll_stream: Stream, client: str, representation: int):
+    session = fll_stream.sessions.touch(client)
+    served = egress_representation(fll_stream, session, representation)
+    if served is not None:
+        fll_stream.sessions.set_representation(session, served, fll_stream.representation_kbps(served))
+    return served
+
+
+@pytest.mark.parametrize("switching", [False, True])
+def test_reject_new_viewers_only(switching):
+    fll_stream = stream("reject", switching)
+    assert serve(fll_stream, "a", 1) == 1
+    assert serve(fll_stream, "b", 0) == 0
+    # no room for a third viewer at the highest representation
+    assert serve(fll_stream, "c", 1) is None
+    # an admitted viewer switching up is never cut off
+    assert serve(fll_stream, "b", 1) == (0 if switching else 1)
+
+
+def test_steer_new_viewers():
+    fll_stream = stream("steer", True)
+    assert serve(fll_stream, "a", 1) == 1
+    assert serve(fll_stream, "b", 1) == 0
+    assert serve(fll_stream, "c", 1) is None
@@ -0,0 +1,17 @@
+from fastll_auth import admin_authorized
+
+
+def test_token_required_when_configured():
+    assert admin_authorized("secret", "Bearer secret", "203.0.113.7")
+    assert not admin_authorized("secret", "Bearer wrong", "127.0.0.1")
+    assert not admin_authorized("secret", None, "127.0.0.1")
+    assert not admin_authorized("secret", "secret", "127.0.0.1")
+
+
+def test_loopback_only_without_token():
+    assert admin_authorized(None, None, "127.0.0.1")
+    assert admin_authorized(None, None, "::1")
+    assert not admin_authorized(None, None, "203.0.113.7")
+    assert not admin_authorized(None, "Bearer anything", "10.0.0.1")
+    assert not admin_authorized(None, None, "localhost")
+    assert not admin_authorized(None, None, None)
@@ -0,0 +1,23 @@
+from starlette.requests import Request
+
+from fastll_cdn import CachedBody, manifest_response
+
+
+def request(**headers) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/cam/manifest.mpd", "query_string": b"",
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def test_content_codings_have_their_own_etag():
+    body = CachedBody("<MPD/>", 0)
+    identity = manifest_response(request(), body)
+    compressed = manifest_response(request(accept_encoding="gzip, br"), body)
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert identity.headers["etag"] != compressed.headers["etag"]
+    # a validator of one coding never validates the other
+    assert manifest_response(request(if_none_match=identity.headers["etag"]), body).status_code == 304
+    assert manifest_response(request(if_none_match=compressed.headers["etag"]), body).status_code == 200
+    assert manifest_response(request(accept_encoding="gzip", if_none_match=compressed.headers["etag"]),
+                             body).status_code == 304
+    assert manifest_response(request(accept_encoding="gzip", if_none_match=identity.headers["etag"]),
+                             body).status_code == 200
@@ -0,0 +1,125 @@
+import struct
+
+import pytest
+
+from fastll_cmaf import NTP_UNIX_OFFSET, SAMPLE_IS_NON_SYNC, CmafIndex, parse_timescale
+
+SYNC = 0x02000000
+NON_SYNC = 0x01010000
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def large_box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4sQ", 1, box_type, 16 + len(payload)) + payload
+
+
+def full_box(box_type: bytes, version: int, flags: int, payload: bytes = b"") -> bytes:
+    return box(box_type, struct.pack(">I", version << 24 | flags) + payload)
+
+
+def prft(seconds: int, fraction: int) -> bytes:
+    # reference track id, NTP timestamp and media time
+    return full_box(b"prft", 0, 0, struct.pack(">IIII", 1, seconds, fraction, 0))
+
+
+def tfhd(default_flags: int = None) -> bytes:
+    if default_flags is None:
+        return full_box(b"tfhd", 0, 0x020000, struct.pack(">I", 1))
+    # sample description index and default sample duration come before the default sample flags
+    return full_box(b"tfhd", 0, 0x020000 | 0x02 | 0x08 | 0x20, struct.pack(">IIII", 1, 1, 512, default_flags))
+
+
+def tfdt(media_time: int, version: int = 1) -> bytes:
+    return full_box(b"tfdt", version, 0, struct.pack(">Q" if version == 1 else ">I", media_time))
+
+
+def trun(first_flags: int = None, sample_flags: int = None) -> bytes:
+    flags = 0x01
+    payload = struct.pack(">Ii", 1, 0)
+    if first_flags is not None:
+        flags = flags | 0x04
+        payload = payload + struct.pack(">I", first_flags)
+    if sample_flags is not None:
+        # sample duration, size and flags of the only sample
+        flags = flags | 0x100 | 0x200 | 0x400
+        payload = payload + struct.pack(">III", 512, 100, sample_flags)
+    return full_box(b"trun", 0, flags, payload)
+
+
+def fragment(traf: bytes, size: int = 100, prft_box: bytes = b"", mdat=box) -> bytes:
+    moof = box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", 1)) + box(b"traf", traf))
+    return box(b"styp", b"msdh") + prft_box + moof + mdat(b"mdat", bytes(size))
+
+
+def index(*data: bytes) -> CmafIndex:
+    cmaf_index = CmafIndex()
+    cmaf_index.feed(b"".join(data))
+    return cmaf_index
+
+
+def test_prft_is_converted_to_unix_time():
+    data = fragment(tfhd() + tfdt(0) + trun(), prft_box=prft(NTP_UNIX_OFFSET + 1700000000, 2 ** 31))
+    assert index(data).fragments[0].prft == 1700000000.5
+
+
+@pytest.mark.parametrize("default_flags, keyframe", [(SYNC, True), (NON_SYNC, False)])
+def test_tfhd_default_sample_flags(default_flags, keyframe):
+    assert index(fragment(tfhd(default_flags) + tfdt(0) + trun())).fragments[0].keyframe is keyframe
+
+
+def test_no_sample_flags():
+    assert index(fragment(tfhd() + tfdt(0) + trun())).fragments[0].keyframe is False
+
+
+@pytest.mark.parametrize("default_flags", [None, NON_SYNC])
+def test_trun_first_sample_flags(default_flags):
+    # the first sample flags override the defaults of the track fragment
+    data = fragment(tfhd(default_flags) + tfdt(0) + trun(first_flags=SYNC))
+    assert index(data).fragments[0].keyframe is True
+    data = fragment(tfhd(SYNC) + tfdt(0) + trun(first_flags=SYNC | SAMPLE_IS_NON_SYNC))
+    assert index(data).fragments[0].keyframe is False
+
+
+def test_trun_sample_flags():
+    assert index(fragment(tfhd(NON_SYNC) + tfdt(0) + trun(sample_flags=SYNC))).fragments[0].keyframe is True
+
+
+@pytest.mark.parametrize("version", [0, 1])
+def test_tfdt(version):
+    assert index(fragment(tfhd() + tfdt(90000, version) + trun())).fragments[0].media_time == 90000
+
+
+def test_boxes_split_across_appends():
+    first = fragment(tfhd(SYNC) + tfdt(0) + trun(), size=1000)
+    second = fragment(tfhd(NON_SYNC) + tfdt(512) + trun(), size=1000)
+    data = first + second
+    cmaf_index = CmafIndex()
+    # the segment data grows as chunks arrive, boxes end in the middle of them
+    for end in range(7, len(data), 7):
+        cmaf_index.feed(data[:end])
+        assert all(i.end <= end for i in cmaf_index.fragments)
+    cmaf_index.feed(data)
+    assert [(i.offset, i.end, i.keyframe, i.media_time) for i in cmaf_index.fragments] == [
+        (0, len(first), True, 0), (len(first), len(data), False, 512)]
+    assert cmaf_index.last_keyframe_offset() == 0
+    assert cmaf_index.completed_end() == len(data)
+
+
+def test_large_size_box():
+    data = fragment(tfhd(SYNC) + tfdt(0) + trun(), size=100, mdat=large_box)
+    cmaf_index = CmafIndex()
+    # the large size isn't known until the 16 bytes of its header arrive
+    cmaf_index.feed(data[:len(data) - 100 - 4])
+    assert len(cmaf_index.fragments) == 0
+    cmaf_index.feed(data)
+    assert cmaf_index.fragments[0].end == len(data)
+    assert cmaf_index.fragments[0].keyframe is True
+
+
+def test_timescale():
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIII", 0, 0, 90000, 0))
+    init = box(b"ftyp", b"iso6") + box(b"moov", box(b"mvhd") + box(b"trak", box(b"tkhd") + box(b"mdia", mdhd)))
+    assert parse_timescale(init) == 90000
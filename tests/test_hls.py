@@ -0,0 +1,139 @@
+import asyncio
+import struct
+
+from starlette.requests import Request
+
+import fastll
+import fastll_hls
+from fastll_storage import MemoryStorage
+from fastll_stream import Segment, Stream
+
+TIMESCALE = 90000
+SYNC = 0x02000000
+NON_SYNC = 0x01010000
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, flags: int, payload: bytes) -> bytes:
+    return box(box_type, struct.pack(">I", flags) + payload)
+
+
+def fragment(media_time: int, keyframe: bool) -> bytes:
+    # a single sample with the tfhd default sample flags
+    tfhd = full_box(b"tfhd", 0x020020, struct.pack(">II", 1, SYNC if keyframe else NON_SYNC))
+    tfdt = full_box(b"tfdt", 0x01000000, struct.pack(">Q", media_time))
+    trun = full_box(b"trun", 0, struct.pack(">I", 1))
+    return box(b"moof", box(b"traf", tfhd + tfdt + trun)) + box(b"mdat", bytes(64))
+
+
+def init_segment() -> bytes:
+    mdhd = full_box(b"mdhd", 0, struct.pack(">IIII", 0, 0, TIMESCALE, 0))
+    return box(b"moov", box(b"trak", box(b"mdia", mdhd)))
+
+
+def hls_stream() -> Stream:
+    fll_stream = Stream({"name": "Camera", "stream": "cam", "type": "GEN", "llHls": True, "segmentDuration": "1",
+                         "fragmentDuration": "0.5",
+                         "qualities": {"video": [{"targetWidth": "640", "targetBitrate": "250"}]}})
+    fll_stream.storage = MemoryStorage()
+    fll_stream.init_segments[0].set_initial_segment(init_segment())
+    fll_stream.manifest.event.set()
+    return fll_stream
+
+
+def add_segment(fll_stream: Stream, number: int, fragments, completed: bool = True) -> Segment:
+    name = fastll_hls.segment_name.format(rendition=0, number=number)
+    segment = Segment(name, fll_stream.storage)
+    fll_stream.segments[name] = segment
+    fll_stream.hls_rendition(0).add_segment(number, segment)
+    for media_time, keyframe in fragments:
+        segment.append(fragment(media_time, keyframe))
+    if completed:
+        segment.complete()
+    return segment
+
+
+def playlist_lines(fll_stream: Stream):
+    return fastll_hls.media_playlist(fll_stream, 0).splitlines()
+
+
+def request(**query) -> Request:
+    query_string = "&".join(f"{name}={value}" for name, value in query.items()).encode()
+    return Request({"type": "http", "method": "GET", "path": "/cam/media-stream0.m3u8", "headers": [],
+                    "query_string": query_string})
+
+
+def test_media_playlist():
+    fll_stream = hls_stream()
+    # segments starting with a keyframe, the first one a bit longer than the configured duration
+    add_segment(fll_stream, 1, [(0, True), (54000, False)])
+    add_segment(fll_stream, 2, [(99000, True)], completed=False)
+    lines = playlist_lines(fll_stream)
+    assert "#EXT-X-MEDIA-SEQUENCE:1" in lines
+    assert lines[lines.index("chunk-stream0-00001.m4s") - 3:lines.index("chunk-stream0-00001.m4s")] == [
+        '#EXT-X-PART:DURATION=0.600,URI="chunk-stream0-00001.m4s?part=0",INDEPENDENT=YES',
+        '#EXT-X-PART:DURATION=0.500,URI="chunk-stream0-00001.m4s?part=1"',
+        "#EXTINF:1.100,"]
+    assert lines[-2:] == ['#EXT-X-PART:DURATION=0.500,URI="chunk-stream0-00002.m4s?part=0",INDEPENDENT=YES',
+                          '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="chunk-stream0-00002.m4s?part=1"']
+
+
+def test_preload_hint_of_next_segment():
+    fll_stream = hls_stream()
+    add_segment(fll_stream, 1, [(0, True), (45000, False)])
+    lines = playlist_lines(fll_stream)
+    # the end of the last part isn't known until the next segment arrives
+    assert "#EXTINF:1.000," in lines
+    assert lines[-1] == '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="chunk-stream0-00002.m4s?part=0"'
+
+
+def test_retired_segments_leave_the_window():
+    fll_stream = hls_stream()
+    for number in range(1, 5):
+        add_segment(fll_stream, number, [(number * TIMESCALE, True)])
+    fll_stream.retire_segment("chunk-stream0-00001.m4s")
+    fll_stream.retire_segment("chunk-stream0-00002.m4s")
+    lines = playlist_lines(fll_stream)
+    assert "#EXT-X-MEDIA-SEQUENCE:3" in lines
+    assert not any("chunk-stream0-00001" in i or "chunk-stream0-00002" in i for i in lines)
+    assert "chunk-stream0-00004.m4s" in lines
+
+
+def test_blocking_playlist_reload():
+    async def run():
+        fll_stream = hls_stream()
+        add_segment(fll_stream, 1, [(0, True), (45000, False)])
+        segment = add_segment(fll_stream, 2, [(90000, True)], completed=False)
+        rendition = fll_stream.hls_rendition(0)
+
+        # available parts are answered right away
+        response = await fastll.hls_playlist(request(_HLS_msn=2, _HLS_part=0), fll_stream, "media-stream0.m3u8")
+        assert response.status_code == 200
+
+        blocked = asyncio.ensure_future(fastll.hls_playlist(request(_HLS_msn=2, _HLS_part=1), fll_stream,
+                                                            "media-stream0.m3u8"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        segment.append(fragment(135000, False))
+        rendition.notify()
+        response = await asyncio.wait_for(blocked, 1)
+        assert response.status_code == 200
+        assert b'URI="chunk-stream0-00002.m4s?part=1"' in response.body
+        assert b'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="chunk-stream0-00002.m4s?part=2"' in response.body
+
+        # a whole segment is waited for without _HLS_part
+        blocked = asyncio.ensure_future(fastll.hls_playlist(request(_HLS_msn=2), fll_stream, "media-stream0.m3u8"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        segment.complete()
+        rendition.notify()
+        assert (await asyncio.wait_for(blocked, 1)).status_code == 200
+
+        # too far ahead of the live edge
+        response = await fastll.hls_playlist(request(_HLS_msn=5), fll_stream, "media-stream0.m3u8")
+        assert response.status_code == 400
+
+    asyncio.run(run())
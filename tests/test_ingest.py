@@ -0,0 +1,60 @@
+import asyncio
+
+from fastapi import Response
+
+import fastll_ingest
+from fastll_ingest import IngestQueue, IngestRequest
+from fastll_storage import SegmentStorageError
+
+
+class Incoming:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.chunks = []
+
+    def append(self, chunk: bytes):
+        if len(self.chunks) == self.capacity:
+            raise SegmentStorageError("full")
+        self.chunks.append(chunk)
+
+    def fail(self, error: SegmentStorageError):
+        return Response(status_code=507)
+
+    def complete(self):
+        return Response(status_code=200)
+
+
+def test_chunks_are_appended_in_batches():
+    async def run():
+        fastll_ingest._main_loop = asyncio.get_running_loop()
+        queue = IngestQueue()
+        drains = []
+        drain = queue.drain
+        queue.drain = lambda: drains.append(drain())
+        first = IngestRequest(Incoming(10))
+        second = IngestRequest(Incoming(10))
+        for chunk in (b"a", b"b", b"c"):
+            queue.put(first, chunk)
+            queue.put(second, chunk)
+        queue.put(first, None)
+        await asyncio.sleep(0)
+        assert len(drains) == 1
+        assert first.incoming.chunks == second.incoming.chunks == [b"a", b"b", b"c"]
+        assert first.done.result().status_code == 200
+        assert not second.done.done()
+
+    asyncio.run(run())
+
+
+def test_answered_request_is_discarded():
+    async def run():
+        fastll_ingest._main_loop = asyncio.get_running_loop()
+        queue = IngestQueue()
+        request = IngestRequest(Incoming(1))
+        for chunk in (b"a", b"b", b"c", None):
+            queue.put(request, chunk)
+        await asyncio.sleep(0)
+        assert request.incoming.chunks == [b"a"]
+        assert request.done.result().status_code == 507
+
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import pytest
+
+from fastll_push import FRAME_HEADER, end_frame, frame_header
+
+
+def read_objects(data: bytes, read_size: int):
+    """Objects of a push channel read as the player adapter does, from reads of read_size bytes"""
+    objects = {}
+    ended = []
+    buffer = b""
+    name = None
+    remaining = 0
+    for start in range(0, len(data), read_size):
+        buffer = buffer + data[start:start + read_size]
+        while True:
+            if remaining > 0:
+                size = min(remaining, len(buffer))
+                if size == 0:
+                    break
+                objects[name] = objects[name] + buffer[:size]
+                buffer = buffer[size:]
+                remaining = remaining - size
+                continue
+            if len(buffer) < FRAME_HEADER.size:
+                break
+            name_length, size = FRAME_HEADER.unpack_from(buffer)
+            if len(buffer) < FRAME_HEADER.size + name_length:
+                break
+            name = buffer[FRAME_HEADER.size:FRAME_HEADER.size + name_length].decode()
+            buffer = buffer[FRAME_HEADER.size + name_length:]
+            objects.setdefault(name, b"")
+            if size == 0:
+                ended.append(name)
+            else:
+                remaining = size
+    assert buffer == b"" and remaining == 0
+    return objects, ended
+
+
+def channel(objects):
+    data = b""
+    for name, chunks in objects:
+        for chunk in chunks:
+            data = data + frame_header(name, len(chunk)) + chunk
+        data = data + end_frame(name)
+    return data
+
+
+@pytest.mark.parametrize("read_size", [1, 5, 6, 7, 100, 1 << 20])
+def test_round_trip(read_size):
+    objects = [
+        ("init-stream0.m4s", [b"ftyp" * 10]),
+        ("chunk-stream0-00001.m4s", [b"a" * 1000, b"b", b"c" * 70000]),
+        ("chunk-stream0-00002.m4s", [bytes(range(256))]),
+    ]
+    received, ended = read_objects(channel(objects), read_size)
+    assert received == {name: b"".join(chunks) for name, chunks in objects}
+    assert ended == [name for name, _ in objects]
+
+
+def test_frame_header():
+    assert frame_header("init-stream0.m4s", 1234) == b"\x00\x10\x00\x00\x04\xd2init-stream0.m4s"
+    assert end_frame("é") == b"\x00\x02\x00\x00\x00\x00" + "é".encode()
@@ -0,0 +1,39 @@
+import os
+import signal
+import time
+
+from fastll_shard import WorkerSupervisor, owned_streams, stream_owner
+
+
+def run_worker(conf, worker, log_level, ssl_key, ssl_cert, ready):
+    ready.set()
+    time.sleep(60)
+
+
+def wait(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_owned_streams():
+    streams = [{"stream": f"cam{i}"} for i in range(20)]
+    owned = [owned_streams(streams, worker, 3) for worker in range(3)]
+    assert sorted(i["stream"] for worker in owned for i in worker) == sorted(i["stream"] for i in streams)
+    assert all(stream_owner(i["stream"], 3) == worker for worker in range(3) for i in owned[worker])
+
+
+def test_dead_workers_are_restarted():
+    supervisor = WorkerSupervisor(run_worker, {"streams": []}, 2, "INFO", None, None)
+    supervisor.start()
+    try:
+        wait(lambda: supervisor.available(0) and supervisor.available(1))
+        pid = supervisor.processes[1].pid
+        os.kill(pid, signal.SIGKILL)
+        wait(lambda: not supervisor.available(1))
+        assert supervisor.available(0)
+        wait(lambda: supervisor.available(1))
+        assert supervisor.processes[1].pid != pid
+    finally:
+        supervisor.stop()
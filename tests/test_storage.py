@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from fastll_storage import MemoryStorage, MmapFileStorage, SegmentStorageError, SharedMemoryRingStorage
+
+SLOT_SIZE = 64 * 1024
+
+
+@pytest.fixture(params=["memory", "sharedMemory", "mmap"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryStorage()
+    elif request.param == "sharedMemory":
+        backend = SharedMemoryRingStorage(4, SLOT_SIZE)
+    else:
+        backend = MmapFileStorage(str(tmp_path / "segments"))
+    yield backend
+    backend.close()
+
+
+def test_append_and_read(storage):
+    key = storage.put("chunk-stream0-00001.m4s")
+    assert storage.append(key, b"abc") == 3
+    assert storage.append(key, b"defgh") == 8
+    assert storage.size(key) == 8
+    assert bytes(storage.read(key)) == b"abcdefgh"
+    assert bytes(storage.read(key, 2, 5)) == b"cde"
+    assert bytes(storage.read(key, 6, 100)) == b"gh"
+    assert bytes(storage.read(key, 8)) == b""
+    assert bytes(storage.view(key)) == b"abcdefgh"
+
+
+def test_reads_are_stable_across_appends(storage):
+    key = storage.put("chunk-stream0-00001.m4s")
+    storage.append(key, b"first")
+    data = storage.read(key, 1)
+    # growing a segment must not fail or change data already read
+    storage.append(key, b"second" * 1000)
+    assert bytes(data) == b"irst"
+    storage.complete(key)
+    assert bytes(storage.read(key, 0, 11)) == b"firstsecond"
+
+
+def test_large_segment(storage):
+    key = storage.put("chunk-stream0-00001.m4s")
+    chunk = bytes(range(256)) * 16
+    for _ in range(12):
+        storage.append(key, chunk)
+    storage.complete(key)
+    assert storage.size(key) == 12 * len(chunk)
+    assert bytes(storage.read(key)) == chunk * 12
+
+
+def test_keys_are_not_reused(storage):
+    first = storage.put("chunk-stream0-00001.m4s")
+    storage.append(first, b"old")
+    storage.delete(first)
+    second = storage.put("chunk-stream0-00001.m4s")
+    assert second != first
+    assert storage.read(first) is None
+    assert storage.size(first) == 0
+    assert bytes(storage.read(second)) == b""
+
+
+def test_deleted_segment(storage):
+    key = storage.put("chunk-stream0-00001.m4s")
+    storage.append(key, b"data")
+    storage.delete(key)
+    assert storage.read(key) is None
+    assert bytes(storage.view(key)) == b""
+    with pytest.raises(SegmentStorageError):
+        storage.append(key, b"more")
+    # deleting twice is harmless
+    storage.delete(key)
+
+
+def test_subscribe_follows_appends_until_completed(storage):
+    async def run():
+        key = storage.put("chunk-stream0-00001.m4s")
+        storage.append(key, b"ab")
+        received = []
+
+        async def reader():
+            async for data in storage.subscribe(key, 1):
+                received.append(bytes(data))
+
+        task = asyncio.ensure_future(reader())
+        await asyncio.sleep(0)
+        storage.append(key, b"cd")
+        await asyncio.sleep(0)
+        storage.append(key, b"ef", notify=False)
+        storage.notify(key)
+        await asyncio.sleep(0)
+        storage.complete(key)
+        await asyncio.wait_for(task, 1)
+        return received
+
+    received = asyncio.run(run())
+    assert b"".join(received) == b"bcdef"
+
+
+def test_subscribe_ends_when_deleted(storage):
+    async def run():
+        key = storage.put("chunk-stream0-00001.m4s")
+        storage.append(key, b"ab")
+        received = []
+
+        async def reader():
+            async for data in storage.subscribe(key):
+                received.append(bytes(data))
+
+        task = asyncio.ensure_future(reader())
+        await asyncio.sleep(0)
+        storage.delete(key)
+        await asyncio.wait_for(task, 1)
+        return received
+
+    assert asyncio.run(run()) == [b"ab"]
+
+
+def test_subscribe_times_out(storage):
+    async def run():
+        key = storage.put("chunk-stream0-00001.m4s")
+        return [data async for data in storage.subscribe(key, timeout=0.01)]
+
+    assert asyncio.run(run()) == []
+
+
+def test_shared_memory_ring_evicts_oldest():
+    storage = SharedMemoryRingStorage(2, SLOT_SIZE)
+    try:
+        keys = [storage.put(f"chunk-stream0-{i:05d}.m4s") for i in range(3)]
+        assert storage.read(keys[0]) is None
+        assert storage.read(keys[1]) is not None
+        assert storage.read(keys[2]) is not None
+        with pytest.raises(SegmentStorageError):
+            storage.append(keys[2], bytes(SLOT_SIZE + 1))
+    finally:
+        storage.close()
+
+
+def test_mmap_files_are_removed(tmp_path):
+    directory = tmp_path / "segments"
+    storage = MmapFileStorage(str(directory))
+    key = storage.put("chunk-stream0-00001.m4s")
+    storage.append(key, b"data")
+    assert len(list(directory.iterdir())) == 1
+    storage.close()
+    # closed once the last segment is deleted
+    assert directory.exists()
+    storage.delete(key)
+    assert not directory.exists()
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+import fastll
+from fastll_stream import Stream
+
+
+def stream_config(stream: str, **options):
+    config = {"name": stream, "stream": stream, "type": "GEN",
+              "qualities": {"video": [{"targetWidth": "640", "targetBitrate": "250"}]}}
+    config.update(options)
+    return config
+
+
+@pytest.fixture
+def streams():
+    yield
+    fastll.fll_streams.clear()
+    fastll.conf_streams.clear()
+
+
+def test_release_replaced_stream(streams):
+    fastll.conf_streams["cam"] = stream_config("cam")
+    old_stream = fastll.get_stream("cam")
+    # replaced by a reload while the check task was stopping another stream
+    new_stream = Stream(stream_config("cam"))
+    fastll.fll_streams["cam"] = new_stream
+    fastll.release_stream(old_stream)
+    assert fastll.fll_streams["cam"] is new_stream
+    # removed by a reload
+    del fastll.fll_streams["cam"]
+    fastll.release_stream(new_stream)
+    assert "cam" not in fastll.fll_streams
+
+
+@pytest.mark.parametrize("options", [{"storage": "disk"}, {"utcTiming": "ntp"}])
+def test_startup_rejects_bad_streams(streams, options):
+    fastll.fastll_conf.update({"host": "localhost", "port": 8000, "https": False, "timeDisplacement": 0,
+                               "streams": [stream_config("cam"), stream_config("bad", **options)]})
+    with pytest.raises(ValueError):
+        asyncio.run(fastll.startup_event())